@@ -10,6 +10,26 @@ def create_app(config='app.config.DevelopmentConfig'):
     app.config.from_object(config)
     # Initialize Database DB and LoginManager
     init_extensions(app)
+    # Build the product search and autocomplete indexes, and the catalog
+    # snapshot, lazily on first use.
+    from .analytics import init_analytics
+    from .cache import init_cache
+    from .catalog import init_catalog
+    from .conditional import init_conditional
+    from .report_jobs import init_report_jobs
+    from .response_cache import init_response_cache
+    from .session_cart import init_session_cart
+    from .search import init_search
+    from .suggest import init_suggest
+    init_analytics(app)
+    init_cache(app)
+    init_catalog(app)
+    init_conditional(app)
+    init_report_jobs(app)
+    init_response_cache(app)
+    init_session_cart(app)
+    init_search(app)
+    init_suggest(app)
     from .routes import init_routes
     init_routes(app)
 
@@ -20,4 +40,21 @@ def create_app(config='app.config.DevelopmentConfig'):
         from .seed import seed
         seed()
 
+    # Use "flask sweep-reservations" to give back the stock held by
+    # reservations that have expired.
+    @app.cli.command("sweep-reservations")
+    def sweep_reservations():
+        from .models import Reservation
+        swept = Reservation.sweep_expired(
+            app.config['RESERVATION_SWEEP_BATCH'])
+        print(f'Swept {swept} expired reservations.')
+
+    # Use "flask rebuild-sales-daily" to rebuild the daily sales rollup from
+    # the orders, e.g. after importing old orders.
+    @app.cli.command("rebuild-sales-daily")
+    def rebuild_sales_daily():
+        from .models import SalesDaily
+        orders = SalesDaily.rebuild(app.config['SALES_DAILY_REBUILD_BATCH'])
+        print(f'Added up {orders} orders.')
+
     return app
@@ -0,0 +1,230 @@
+"""Sales analytics for the admin dashboard, computed with NumPy.
+
+Every order item, with its order's id, customer and day, is read with one
+query into a column per field, and the figures are worked out with
+vectorized group-bys over those columns (``np.unique`` to number the groups,
+``np.bincount`` to add them up) rather than by walking orders and their
+items one at a time:
+
+- revenue and units sold by day, week or month,
+- the average basket, in units and in value,
+- each product's sell-through: the share of its stock that's been sold,
+- the share of customers who ordered more than once.
+
+The columns and the figures are kept until a commit adds order items (see
+signals.py), or for ANALYTICS_MAX_AGE seconds, since orders placed through
+other worker processes don't reach this one.
+
+Example:
+    >>> sales_analytics().summary('week')['repeat_customer_rate']
+    0.25
+"""
+from __future__ import annotations
+import threading
+import time
+from typing import NamedTuple
+
+import numpy as np
+import sqlalchemy as sa
+from flask import current_app
+
+from .extensions import db
+from .models import Order, OrderItem, Product, SalesDaily
+from .signals import order_items_added
+
+
+class SalesColumns(NamedTuple):
+    """Every order item, a column per field.
+
+    Attributes:
+        order_id (np.ndarray): The item's order's id.
+        user_id (np.ndarray): The order's customer's id, -1 if it has none.
+        day (np.ndarray): The day the order was placed, as datetime64[D].
+        product_id (np.ndarray): The item's product's id.
+        quantity (np.ndarray): How many were ordered.
+        price (np.ndarray): The price they were ordered at.
+        products (np.ndarray): The id of every product, ascending.
+        names (list[str]): The products' names, in the same order.
+        stock (np.ndarray): The products' stock, in the same order.
+    """
+    order_id: np.ndarray
+    user_id: np.ndarray
+    day: np.ndarray
+    product_id: np.ndarray
+    quantity: np.ndarray
+    price: np.ndarray
+    products: np.ndarray
+    names: list[str]
+    stock: np.ndarray
+
+
+def load_columns() -> SalesColumns:
+    """Reads every order item, and every product's stock, into columns.
+
+    Returns:
+        SalesColumns: The columns.
+    """
+    rows = db.session.execute(
+        sa.select(OrderItem.order_id, Order.user_id, Order.order_date,
+                  OrderItem.product_id, OrderItem.quantity, OrderItem.price)
+        .join(Order, OrderItem.order_id == Order.id)).all()
+    order_id, user_id, ordered, product_id, quantity, price = \
+        zip(*rows) if rows else [()] * 6
+    products = db.session.execute(
+        sa.select(Product.id, Product.name, Product.stock)
+        .order_by(Product.id)).all()
+    ids, names, stock = zip(*products) if products else [()] * 3
+    return SalesColumns(
+        order_id=np.array(order_id, dtype=np.int64),
+        user_id=np.array([-1 if user is None else user for user in user_id],
+                         dtype=np.int64),
+        day=np.array(ordered, dtype='datetime64[us]').astype('datetime64[D]'),
+        product_id=np.array(product_id, dtype=np.int64),
+        quantity=np.array(quantity, dtype=np.int64),
+        price=np.array(price, dtype=np.float64),
+        products=np.array(ids, dtype=np.int64),
+        names=list(names),
+        stock=np.array(stock, dtype=np.int64))
+
+
+def period_starts(days: np.ndarray, period: str) -> np.ndarray:
+    """Returns the first day of the day, week (starting on Monday) or month
+    each of the given days falls in.
+
+    Raises:
+        ValueError: If the period isn't one of SalesDaily.PERIODS.
+    """
+    if period == 'day':
+        return days
+    if period == 'week':
+        # Day 0, 1 January 1970, was a Thursday.
+        numbers = days.astype(np.int64)
+        return (numbers - (numbers + 3) % 7).astype('datetime64[D]')
+    if period == 'month':
+        return days.astype('datetime64[M]').astype('datetime64[D]')
+    raise ValueError(f'Unknown period: {period!r}')
+
+
+def summarize(columns: SalesColumns, period: str = 'day') -> dict:
+    """Works out the dashboard's figures from the columns.
+
+    Args:
+        columns (SalesColumns): Every order item and product.
+        period (str): 'day', 'week' or 'month', what revenue is added up by.
+
+    Returns:
+        dict: The figures, ready to be sent as JSON.
+
+    Raises:
+        ValueError: If the period isn't one of SalesDaily.PERIODS.
+    """
+    starts, by_period = np.unique(period_starts(columns.day, period),
+                                  return_inverse=True)
+    line_value = columns.quantity * columns.price
+    revenue = np.bincount(by_period, weights=line_value,
+                          minlength=len(starts))
+    units = np.bincount(by_period, weights=columns.quantity,
+                        minlength=len(starts))
+
+    orders, first_item, by_order = np.unique(
+        columns.order_id, return_index=True, return_inverse=True)
+    order_units = np.bincount(by_order, weights=columns.quantity)
+    order_value = np.bincount(by_order, weights=line_value)
+
+    customers = columns.user_id[first_item]
+    _, orders_per_customer = np.unique(customers[customers >= 0],
+                                       return_counts=True)
+
+    # Items of products that have since been deleted aren't counted.
+    position = np.searchsorted(columns.products, columns.product_id)
+    known = position < len(columns.products)
+    known[known] = columns.products[position[known]] == \
+        columns.product_id[known]
+    sold = np.bincount(position[known], weights=columns.quantity[known],
+                       minlength=len(columns.products)).astype(np.int64)
+    available = sold + columns.stock
+    sell_through = np.divide(sold, available, out=np.zeros(len(sold)),
+                             where=available > 0)
+
+    return {
+        'period': period,
+        'revenue': [
+            {'start': str(start), 'units': int(count),
+             'revenue': round(float(total), 2)}
+            for start, count, total in zip(starts, units, revenue)],
+        'orders': len(orders),
+        'average_basket': {
+            'units': round(float(order_units.mean()), 2) if len(orders)
+            else 0.0,
+            'value': round(float(order_value.mean()), 2) if len(orders)
+            else 0.0},
+        'customers': len(orders_per_customer),
+        'repeat_customer_rate': round(float(
+            (orders_per_customer > 1).mean()), 4)
+        if len(orders_per_customer) else 0.0,
+        'sell_through': [
+            {'id': int(columns.products[i]), 'name': columns.names[i],
+             'sold': int(sold[i]), 'stock': int(columns.stock[i]),
+             'rate': round(float(sell_through[i]), 4)}
+            # Best selling first; stable, so ties stay in id order.
+            for i in np.argsort(-sell_through, kind='stable')]}
+
+
+class SalesAnalytics:
+    """Keeps the sales columns, and the figures worked out from them, until
+    orders are placed.
+
+    Methods:
+        summary: Returns the dashboard's figures for a period.
+        invalidate: Forgets the columns and figures.
+    """
+
+    def __init__(self, max_age: float = 300):
+        self.max_age = max_age
+        self._lock = threading.Lock()
+        self._columns: SalesColumns | None = None
+        self._loaded = 0.0
+        self._summaries: dict[str, dict] = {}
+
+    def summary(self, period: str = 'day') -> dict:
+        """Returns the dashboard's figures, with revenue by ``period``.
+
+        Raises:
+            ValueError: If the period isn't one of SalesDaily.PERIODS.
+        """
+        if period not in SalesDaily.PERIODS:
+            raise ValueError(f'Unknown period: {period!r}')
+        with self._lock:
+            if self._columns is None or \
+                    time.monotonic() - self._loaded > self.max_age:
+                self._columns = load_columns()
+                self._loaded = time.monotonic()
+                self._summaries = {}
+            if period not in self._summaries:
+                self._summaries[period] = summarize(self._columns, period)
+            return self._summaries[period]
+
+    def invalidate(self):
+        """Forgets the columns and figures, so they're read again next
+        time."""
+        with self._lock:
+            self._columns = None
+            self._summaries = {}
+
+
+def init_analytics(app):
+    """Attaches an empty sales analytics cache to the app."""
+    app.extensions['sales_analytics'] = SalesAnalytics(
+        app.config['ANALYTICS_MAX_AGE'])
+
+
+def sales_analytics() -> SalesAnalytics:
+    """Returns the current app's sales analytics cache."""
+    return current_app.extensions['sales_analytics']
+
+
+@order_items_added.connect
+def _invalidate_analytics(app, items):
+    """Forgets the app's sales analytics after orders are placed."""
+    if 'sales_analytics' in app.extensions:
+        app.extensions['sales_analytics'].invalidate()
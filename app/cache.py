@@ -0,0 +1,240 @@
+"""In-process caches.
+
+Product pages look the same product up on every request, so product records
+are cached in a size-bounded LRU cache in front of the database. Cached
+records are plain ProductRow tuples rather than ORM objects, so they can be
+shared between requests and threads without being tied to a session.
+Entries are evicted after any commit that changes the product (see
+signals.py), so a cached record is never older than the last commit made by
+this process. Commits made through other worker processes don't reach this
+one, so entries also expire after PRODUCT_CACHE_TTL seconds.
+
+Rendered template fragments, like the featured products on the home page,
+are cached the same way in a FragmentCache, with a time to live.
+
+Example:
+    >>> product = cached_product(42)
+    >>> product.name, product.price
+    ('Wireless Mouse', 19.75)
+    >>> product_cache().stats()
+    {'hits': 0, 'misses': 1, 'size': 1, 'maxsize': 1024}
+"""
+from __future__ import annotations
+import threading
+import time
+from collections import OrderedDict
+
+from flask import abort, current_app
+
+from .extensions import db
+from .models import Product
+from .signals import ProductRow, products_changed
+
+_MISSING = object()
+
+
+class LRUCache:
+    """A thread-safe cache that holds up to maxsize entries, evicting the
+    least recently used entry to make room for a new one.
+
+    Attributes:
+        maxsize (int): The most entries the cache holds.
+        ttl (float): How many seconds an entry is kept for, or None to keep
+          it until it's evicted.
+        hits (int): How many lookups found their key.
+        misses (int): How many lookups didn't.
+
+    Methods:
+        get: Looks a key up.
+        get_or_load: Looks a key up, loading and caching it on a miss.
+        set: Adds or replaces an entry.
+        delete: Removes an entry.
+        clear: Removes every entry.
+        stats: Returns the hit and miss counters and the size.
+    """
+
+    def __init__(self, maxsize: int = 128, ttl: float | None = None):
+        self.maxsize = maxsize
+        self.ttl = ttl
+        self.hits = 0
+        self.misses = 0
+        self._entries = OrderedDict()
+        self._lock = threading.Lock()
+        # Bumped by every delete, so a value loaded before an entry was
+        # invalidated isn't put back into the cache afterwards.
+        self._generation = 0
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key, default=None):
+        """Returns the value cached for a key, or default on a miss."""
+        with self._lock:
+            value, expires = self._entries.get(key, (_MISSING, None))
+            if value is not _MISSING and expires is not None and \
+                    expires <= time.monotonic():
+                del self._entries[key]
+                value = _MISSING
+            if value is _MISSING:
+                self.misses += 1
+                return default
+            self.hits += 1
+            self._entries.move_to_end(key)
+            return value
+
+    def get_or_load(self, key, load):
+        """Returns the value cached for a key, calling load() to get it (and
+        caching it) on a miss. None is returned but not cached."""
+        with self._lock:
+            generation = self._generation
+        value = self.get(key, _MISSING)
+        if value is not _MISSING:
+            return value
+        value = load()
+        if value is not None:
+            with self._lock:
+                if generation == self._generation:
+                    self._set(key, value)
+        return value
+
+    def set(self, key, value):
+        """Adds or replaces the value cached for a key."""
+        with self._lock:
+            self._set(key, value)
+
+    def _set(self, key, value):
+        expires = None if self.ttl is None else time.monotonic() + self.ttl
+        self._entries[key] = (value, expires)
+        self._entries.move_to_end(key)
+        while len(self._entries) > self.maxsize:
+            self._entries.popitem(last=False)
+
+    def delete(self, key):
+        """Removes a key from the cache, if it's there."""
+        with self._lock:
+            self._generation += 1
+            self._entries.pop(key, None)
+
+    def clear(self):
+        """Removes every entry from the cache."""
+        with self._lock:
+            self._generation += 1
+            self._entries.clear()
+
+    def stats(self) -> dict:
+        """Returns the hit and miss counters and the size of the cache."""
+        with self._lock:
+            return {'hits': self.hits, 'misses': self.misses,
+                    'size': len(self._entries), 'maxsize': self.maxsize}
+
+
+class FragmentCache:
+    """A cache of rendered template fragments.
+
+    Each fragment expires after a time to live, and is also dropped as soon
+    as a commit changes any of the products it shows.
+
+    Methods:
+        get: Returns a fragment, if it's cached and hasn't expired.
+        set: Caches a fragment.
+        invalidate_products: Drops the fragments showing some products.
+    """
+
+    def __init__(self):
+        self._fragments: dict[str, tuple[str, float, frozenset]] = {}
+        self._lock = threading.Lock()
+
+    def get(self, key: str) -> str | None:
+        """Returns the fragment cached under a key, or None if there isn't
+        one or it has expired."""
+        with self._lock:
+            entry = self._fragments.get(key)
+            if entry is None:
+                return None
+            if entry[1] <= time.monotonic():
+                del self._fragments[key]
+                return None
+            return entry[0]
+
+    def set(self, key: str, fragment: str, ttl: float, product_ids=()):
+        """Caches a fragment.
+
+        Args:
+            key (str): The name of the fragment.
+            fragment (str): The rendered fragment.
+            ttl (float): How many seconds to keep the fragment for.
+            product_ids (Iterable[int]): The products shown in the fragment.
+        """
+        with self._lock:
+            self._fragments[key] = (fragment, time.monotonic() + ttl,
+                                    frozenset(product_ids))
+
+    def invalidate_products(self, product_ids):
+        """Drops every fragment showing any of the given products."""
+        product_ids = set(product_ids)
+        with self._lock:
+            for key in [key for key, (_, _, shown) in self._fragments.items()
+                        if shown & product_ids]:
+                del self._fragments[key]
+
+
+def init_cache(app):
+    """Attaches an empty product cache, if it's enabled, and an empty
+    fragment cache to the app."""
+    if app.config['PRODUCT_CACHE_ENABLED']:
+        app.extensions['product_cache'] = LRUCache(
+            app.config['PRODUCT_CACHE_SIZE'], app.config['PRODUCT_CACHE_TTL'])
+    app.extensions['fragment_cache'] = FragmentCache()
+
+
+def fragment_cache() -> FragmentCache:
+    """Returns the current app's fragment cache."""
+    return current_app.extensions['fragment_cache']
+
+
+def product_cache() -> LRUCache | None:
+    """Returns the current app's product cache, or None if it's disabled."""
+    return current_app.extensions.get('product_cache')
+
+
+def _load_product(product_id: int) -> ProductRow | None:
+    product = db.session.get(Product, product_id)
+    if product is None:
+        return None
+    return ProductRow(product.id, product.name, product.description,
+                      product.price, product.stock)
+
+
+def cached_product(product_id: int) -> ProductRow:
+    """Looks a product up through the product cache.
+
+    Args:
+        product_id (int): The product's unique identifier.
+
+    Raises:
+        NotFound: If there is no product with this id (a 404 response).
+
+    Returns:
+        ProductRow: The product's id, name, description, price and stock.
+    """
+    cache = product_cache()
+    if cache is None:
+        product = _load_product(product_id)
+    else:
+        product = cache.get_or_load(product_id,
+                                    lambda: _load_product(product_id))
+    if product is None:
+        abort(404)
+    return product
+
+
+@products_changed.connect
+def _evict_changed_products(app, changes):
+    """Drops products changed by a commit from the app's product cache, and
+    the fragments showing them from its fragment cache."""
+    cache = app.extensions.get('product_cache')
+    if cache is not None:
+        for product_id in changes:
+            cache.delete(product_id)
+    if 'fragment_cache' in app.extensions:
+        app.extensions['fragment_cache'].invalidate_products(changes)
@@ -0,0 +1,268 @@
+"""Filtering, sorting and facet counts for the product catalog.
+
+/catalog and /search can be narrowed down to a price range and to products
+in stock, and sorted by price, name or stock. Pages of products are still
+fetched from the database (with keyset pagination over composite indexes on
+``(price, id)``, ``(name, id)`` and ``(stock, id)``), but the number of
+products in each price bucket is counted from an in-memory snapshot of every
+product's price and stock, kept in sorted arrays, so the counts don't need a
+second scan of the product table.
+
+Like the search index, the snapshot is built the first time it's needed and
+is then kept up to date from SQLAlchemy session events. Stock changes with
+every order, including orders placed through other worker processes, so once
+the snapshot is CATALOG_SNAPSHOT_MAX_AGE seconds old a new one is read in a
+background thread and swapped in.
+
+Example:
+    >>> filters = CatalogFilters.from_args({'min_price': '20', 'sort': 'price'})
+    >>> page = filters.paginate(Product.query, per_page=24)
+    >>> catalog_snapshot().price_facets(in_stock=filters.in_stock)
+    [PriceFacet(low=0, high=25, count=12), PriceFacet(low=25, high=50, ...
+"""
+from __future__ import annotations
+import bisect
+import threading
+from typing import NamedTuple
+
+import sqlalchemy as sa
+from flask import current_app
+
+from .extensions import db
+from .models import Product
+from .pagination import Page, decode_cursor, encode_cursor, paginate
+from .signals import ProductChange, products_changed
+from .utils import BackgroundRebuild
+
+# The ways products can be sorted: the ?sort= value, its label and the
+# column to sort by (ties are broken by id), or None for newest (highest id)
+# first. A leading "-" sorts descending.
+SORTS = {
+    '': ('Newest', None),
+    'price': ('Price: low to high', Product.price),
+    '-price': ('Price: high to low', Product.price),
+    'name': ('Name', Product.name),
+    'stock': ('Stock: low to high', Product.stock),
+    '-stock': ('Stock: high to low', Product.stock),
+}
+
+
+class PriceFacet(NamedTuple):
+    """The number of products priced from low up to (not including) high.
+    The last bucket has no upper bound, so its high is None."""
+    low: float
+    high: float | None
+    count: int
+
+
+class CatalogFilters(NamedTuple):
+    """The filters and sort order chosen for a catalog or search page.
+
+    Attributes:
+        min_price (float | None): The lowest price to show.
+        max_price (float | None): The highest price to show.
+        in_stock (bool): Whether to only show products in stock.
+        sort (str): One of the keys of SORTS.
+    """
+    min_price: float | None = None
+    max_price: float | None = None
+    in_stock: bool = False
+    sort: str = ''
+
+    @classmethod
+    def from_args(cls, args) -> CatalogFilters:
+        """Reads the filters from a request's query string arguments,
+        ignoring any that aren't valid."""
+        def price(name):
+            try:
+                value = float(args.get(name, ''))
+            except ValueError:
+                return None
+            return value if value >= 0 else None
+
+        sort = args.get('sort', '')
+        return cls(min_price=price('min_price'), max_price=price('max_price'),
+                   in_stock=args.get('in_stock') in ('1', 'on', 'true'),
+                   sort=sort if sort in SORTS else '')
+
+    def matches(self, price: float, stock: int) -> bool:
+        """Checks whether a product with a price and stock passes the
+        filters."""
+        return ((self.min_price is None or price >= self.min_price) and
+                (self.max_price is None or price <= self.max_price) and
+                (not self.in_stock or stock > 0))
+
+    def apply(self, query):
+        """Adds the filters to a product query."""
+        if self.min_price is not None:
+            query = query.filter(Product.price >= self.min_price)
+        if self.max_price is not None:
+            query = query.filter(Product.price <= self.max_price)
+        if self.in_stock:
+            query = query.filter(Product.stock > 0)
+        return query
+
+    def paginate(self, query, after: str | None = None,
+                 before: str | None = None, per_page: int = 20) -> Page:
+        """Fetches a page of a filtered and sorted product query.
+
+        Cursors are strings: a product id when sorting by id, otherwise an
+        encoded (sort value, id) pair.
+        """
+        query = self.apply(query)
+        column = SORTS[self.sort][1]
+        descending = self.sort.startswith('-')
+        if column is None:
+            # Newest first: ids only ever go up.
+            return paginate(query, Product.id,
+                            after=_int_or_none(after),
+                            before=_int_or_none(before),
+                            per_page=per_page, descending=True)
+        page = paginate(query, (column, Product.id),
+                        after=decode_cursor(after, 2),
+                        before=decode_cursor(before, 2),
+                        per_page=per_page, descending=descending)
+        return Page(page.items,
+                    page.prev_cursor and encode_cursor(page.prev_cursor),
+                    page.next_cursor and encode_cursor(page.next_cursor))
+
+
+def _int_or_none(value):
+    try:
+        return int(value)
+    except (TypeError, ValueError):
+        return None
+
+
+class _Prices:
+    """Every product's price and stock, and every price, and every in-stock
+    price, in a sorted list."""
+
+    def __init__(self, rows):
+        self.rows: dict[int, tuple[float, int]] = {}
+        self.prices: list[float] = []
+        self.in_stock_prices: list[float] = []
+        for product_id, price, stock in rows:
+            self.rows[product_id] = (price, stock)
+            self.prices.append(price)
+            if stock > 0:
+                self.in_stock_prices.append(price)
+        self.prices.sort()
+        self.in_stock_prices.sort()
+
+    def apply_changes(self, changes: dict[int, ProductChange]):
+        for product_id, change in changes.items():
+            if change.row is not None and not \
+                    change.fields & {'price', 'stock'}:
+                continue
+            old = self.rows.pop(product_id, None)
+            if old is not None:
+                _remove(self.prices, old[0])
+                if old[1] > 0:
+                    _remove(self.in_stock_prices, old[0])
+            if change.row is not None:
+                price, stock = change.row.price, change.row.stock
+                self.rows[product_id] = (price, stock)
+                bisect.insort(self.prices, price)
+                if stock > 0:
+                    bisect.insort(self.in_stock_prices, price)
+
+
+class CatalogSnapshot:
+    """An in-memory copy of every product's price and stock.
+
+    Besides each product's own price and stock, the snapshot keeps every
+    price, and every in-stock price, in a sorted list. Counting the products
+    in a price range is then two binary searches instead of a table scan.
+    Once it's max_age seconds old, a new copy is read in the background, to
+    pick up commits made through other processes, while the old one is
+    still used.
+
+    Methods:
+        apply_changes: Updates products changed by a commit.
+        price_facets: Counts products per price bucket.
+    """
+
+    def __init__(self, buckets: tuple[float, ...] = (0,),
+                 max_age: float = 60):
+        self.buckets = buckets
+        self._lock = threading.RLock()
+        # Reads the snapshot, and reads it again once it's too old.
+        self.rebuild = BackgroundRebuild(self._build, _Prices.apply_changes,
+                                         self._lock, max_age)
+
+    @staticmethod
+    def _build() -> _Prices:
+        return _Prices(db.session.execute(
+            sa.select(Product.id, Product.price, Product.stock)))
+
+    def apply_changes(self, changes: dict[int, ProductChange]):
+        """Updates the snapshot with products changed by a commit.
+
+        Args:
+            changes (Dict[int, ProductChange]): How each product changed.
+        """
+        with self._lock:
+            self.rebuild.update(changes)
+
+    def price_facets(self, in_stock: bool = False,
+                     product_ids=None) -> list[PriceFacet]:
+        """Counts the products in each price bucket.
+
+        Args:
+            in_stock (bool): Whether to only count products in stock.
+            product_ids (Iterable[int]): Only count these products (e.g. the
+              matches for a search). By default every product is counted.
+
+        Returns:
+            List[PriceFacet]: The count for each bucket, cheapest first.
+        """
+        with self._lock:
+            snapshot = self.rebuild.get()
+            if product_ids is None:
+                prices = snapshot.in_stock_prices if in_stock \
+                    else snapshot.prices
+            else:
+                prices = sorted(
+                    row[0] for row in map(snapshot.rows.get, product_ids)
+                    if row is not None and (not in_stock or row[1] > 0))
+            facets = []
+            for i, low in enumerate(self.buckets):
+                high = self.buckets[i + 1] if i + 1 < len(self.buckets) \
+                    else None
+                start = bisect.bisect_left(prices, low)
+                end = (len(prices) if high is None
+                       else bisect.bisect_left(prices, high))
+                facets.append(PriceFacet(low, high, end - start))
+            return facets
+
+    def row(self, product_id: int) -> tuple[float, int] | None:
+        """Returns a product's price and stock."""
+        with self._lock:
+            return self.rebuild.get().rows.get(product_id)
+
+
+def _remove(values: list, value):
+    """Removes one occurrence of a value from a sorted list."""
+    i = bisect.bisect_left(values, value)
+    if i < len(values) and values[i] == value:
+        del values[i]
+
+
+def init_catalog(app):
+    """Attaches an empty catalog snapshot to the app."""
+    app.extensions['catalog'] = CatalogSnapshot(
+        app.config['CATALOG_PRICE_BUCKETS'],
+        app.config['CATALOG_SNAPSHOT_MAX_AGE'])
+
+
+def catalog_snapshot() -> CatalogSnapshot:
+    """Returns the current app's catalog snapshot."""
+    return current_app.extensions['catalog']
+
+
+@products_changed.connect
+def _apply_product_changes(app, changes):
+    """Updates the app's catalog snapshot after a commit changes products."""
+    if 'catalog' in app.extensions:
+        app.extensions['catalog'].apply_changes(changes)
@@ -0,0 +1,129 @@
+"""Conditional GET for pages built from product data.
+
+The catalog, search and product pages only change when products do, so
+rather than rendering them again for a visitor (or a CDN) that already has
+them, they're sent with an ``ETag``, and a request that comes back with a
+matching ``If-None-Match`` gets an empty 304 response before the view runs
+at all. Pages also show who is logged in and how many items are in their
+cart, and carry a CSRF token for the visitor's session, so the tag includes
+those too. There's no ``Last-Modified`` date, since ``If-Modified-Since``
+can't tell one visitor's copy of a page from another's.
+
+The ETags come from the database, so every worker sends the same tag for
+the same page: product pages use the product's ``version``, which every
+commit that changes it bumps (see signals.py), and the catalog and search
+pages use the number of products, the sum of their versions and the newest
+product's id, which change whenever any product is added, changed or
+deleted. Tags also include APP_VERSION, so pages aren't revalidated across
+a deploy that changed how they look, and the current CONDITIONAL_MAX_AGE
+period, so the CSRF token in a page that's revalidated is never older than
+that.
+
+Example:
+    >>> @app.route('/items_page/<int:prod_id>')
+    ... @conditional(lambda prod_id: product_versions().product(prod_id))
+    ... def items_page(prod_id):
+    ...     ...
+"""
+from __future__ import annotations
+import hashlib
+import time
+from functools import wraps
+from typing import NamedTuple
+
+import sqlalchemy as sa
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+
+from .extensions import db
+from .models import Product
+from .session_cart import cart_item_count
+
+
+class Version(NamedTuple):
+    """The version of some data, as seen by every worker.
+
+    Attributes:
+        key (str): Changes every time the data does.
+    """
+    key: str
+
+
+class ProductVersions:
+    """Reads the versions of the product table and of each product from the
+    database.
+
+    Methods:
+        catalog: Returns the version of the whole product table.
+        product: Returns the version of one product.
+    """
+
+    def catalog(self) -> Version:
+        """Returns the version of the whole product table."""
+        count, total, newest = db.session.execute(sa.select(
+            sa.func.count(Product.id),
+            sa.func.coalesce(sa.func.sum(Product.version), 0),
+            sa.func.coalesce(sa.func.max(Product.id), 0))).one()
+        return Version(f'{count}.{total}.{newest}')
+
+    def product(self, product_id: int) -> Version:
+        """Returns the version of one product, or of its absence."""
+        version = db.session.scalar(
+            sa.select(Product.version).where(Product.id == product_id))
+        return Version(str(version or 0))
+
+
+def init_conditional(app):
+    """Attaches the product versions to the app."""
+    app.extensions['product_versions'] = ProductVersions()
+
+
+def product_versions() -> ProductVersions:
+    """Returns the current app's product versions."""
+    return current_app.extensions['product_versions']
+
+
+def _etag(version: Version) -> str:
+    # The nav shows how many items are in the visitor's cart, and forms
+    # carry a CSRF token for their session.
+    user = f'{current_user.get_id() or ""}:{cart_item_count()}:' \
+        f'{session.get("csrf_token", "")}'
+    period = int(time.time() // current_app.config['CONDITIONAL_MAX_AGE'])
+    key = f'{current_app.config["APP_VERSION"]}:{period}:{version.key}:{user}'
+    return hashlib.sha1(key.encode()).hexdigest()
+
+
+def conditional(version_of):
+    """Decorator for GET views that only change when product data does.
+
+    Args:
+        version_of (Callable[..., Version]): Called with the view's keyword
+          arguments, returns the version of the data the page shows.
+
+    Returns:
+        Callable: The decorator.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            # A message waiting to be flashed has to be rendered.
+            if request.method not in ('GET', 'HEAD') or \
+                    session.get('_flashes'):
+                return view(*args, **kwargs)
+            if 'csrf' in current_app.extensions:
+                # Make sure the visitor has the CSRF token the page will
+                # carry, so the tag covers it from their first visit.
+                generate_csrf()
+            etag = _etag(version_of(**kwargs))
+            if request.if_none_match.contains(etag):
+                response = current_app.response_class(status=304)
+            else:
+                response = make_response(view(*args, **kwargs))
+                if response.status_code != 200:
+                    return response
+            response.set_etag(etag)
+            response.vary.add('Cookie')
+            return response
+        return wrapped
+    return decorator
@@ -12,6 +12,105 @@ class Config:
     SQLALCHEMY_DATABASE_URI = os.environ.get('DATABASE_URL') or \
         'mysql+pymysql://container@host.docker.internal/dev_db'
 
+    # Search
+    # How much a match in a product's name counts compared to a match in its
+    # description when ranking search results, and how many results to show.
+    SEARCH_FIELD_WEIGHTS = (3.0, 1.0)
+    SEARCH_RESULTS_LIMIT = 50
+    # How similar (0 to 1) a word has to be to a misspelled search term to be
+    # searched for instead, when the search term itself matches nothing.
+    SEARCH_FUZZY_THRESHOLD = 0.3
+    # The most suggestions the search box autocomplete can show.
+    SUGGEST_LIMIT = 10
+    # The search index and the autocomplete index follow commits made through
+    # this process, and are read again from the database after this many
+    # seconds to pick up commits made through other worker processes.
+    SEARCH_INDEX_MAX_AGE = 300
+    SUGGEST_MAX_AGE = 300
+
+    # Catalog
+    # How many products to show per page, and the most a page can ask for
+    # with ?per_page=.
+    PRODUCTS_PER_PAGE = 24
+    MAX_PRODUCTS_PER_PAGE = 100
+    # Where the price ranges shown next to the catalog start. The last range
+    # has no upper limit.
+    CATALOG_PRICE_BUCKETS = (0, 25, 50, 100, 200, 500)
+    # The in-memory copy of every product's price and stock that the price
+    # ranges are counted from is read again, in the background, after this
+    # many seconds.
+    CATALOG_SNAPSHOT_MAX_AGE = 60
+
+    # Caching
+    # Product pages are served from an in-process cache of up to
+    # PRODUCT_CACHE_SIZE products, each kept for PRODUCT_CACHE_TTL seconds.
+    PRODUCT_CACHE_ENABLED = True
+    PRODUCT_CACHE_SIZE = 1024
+    PRODUCT_CACHE_TTL = 60
+    # How many seconds rendered fragments (like the home page's featured
+    # products) are cached for. They're also dropped when a product in them
+    # changes.
+    FRAGMENT_CACHE_TTL = 300
+    # Pages shown to visitors who aren't logged in are cached in a
+    # RESPONSE_CACHE_BACKEND: 'memory' (this process only), 'filesystem'
+    # (shared by every worker, in RESPONSE_CACHE_DIR, by default
+    # instance/response-cache) or None to turn it off.
+    # Entries are kept for up to RESPONSE_CACHE_TIMEOUT seconds, and
+    # browsers and CDNs are told to keep them for RESPONSE_CACHE_MAX_AGE.
+    RESPONSE_CACHE_BACKEND = os.environ.get('RESPONSE_CACHE_BACKEND') or \
+        'memory'
+    RESPONSE_CACHE_DIR = os.environ.get('RESPONSE_CACHE_DIR')
+    RESPONSE_CACHE_SIZE = 512
+    RESPONSE_CACHE_TIMEOUT = 300
+    RESPONSE_CACHE_MAX_AGE = 60
+    # Catalog, search and product pages are revalidated with ETags, which
+    # also change every CONDITIONAL_MAX_AGE seconds, so the CSRF token in a
+    # revalidated page is never older than that, and with every APP_VERSION,
+    # which should be set to something new (e.g. the commit) on each deploy.
+    CONDITIONAL_MAX_AGE = 300
+    APP_VERSION = os.environ.get('APP_VERSION') or ''
+
+    # Carts
+    # Visitors who aren't logged in keep their cart in the session cookie,
+    # which can only hold so many products.
+    SESSION_CART_MAX_PRODUCTS = 50
+
+    # Orders
+    # A checkout that deadlocks with another one is tried this many times in
+    # all, waiting a random time of up to ORDER_RETRY_BACKOFF seconds (doubled
+    # after each attempt) in between.
+    ORDER_RETRY_ATTEMPTS = 3
+    ORDER_RETRY_BACKOFF = 0.05
+    # Loading the checkout page holds the stock for the cart's items for this
+    # many seconds. "flask sweep-reservations" (run it from cron) gives back
+    # the stock of expired holds, RESERVATION_SWEEP_BATCH at a time.
+    RESERVATION_TTL = 600
+    RESERVATION_SWEEP_BATCH = 500
+
+    # Admin
+    # The sales report is streamed, reading and writing this many rows at a
+    # time.
+    SALES_REPORT_BATCH_SIZE = 1000
+    # Orders placed in the last SALES_REPORT_CURSOR_LAG seconds may not all
+    # be committed yet, so they're left for the next report. It must be
+    # longer than any checkout transaction, retries included.
+    SALES_REPORT_CURSOR_LAG = 60
+    # "flask rebuild-sales-daily" adds up about this many orders per
+    # transaction, a range of days at a time.
+    SALES_DAILY_REBUILD_BATCH = 1000
+    # Reports can be written in the background, by REPORT_JOB_WORKERS
+    # threads, to gzip files in REPORT_JOB_DIR (by default
+    # instance/report-jobs) that are kept for REPORT_JOB_MAX_AGE seconds.
+    REPORT_JOB_DIR = os.environ.get('REPORT_JOB_DIR')
+    REPORT_JOB_WORKERS = 2
+    REPORT_JOB_MAX_AGE = 86400
+    # The dashboard's sales analytics are kept until an order is placed
+    # through this process, and for at most this many seconds.
+    ANALYTICS_MAX_AGE = 300
+
+    # The products featured on the home page, in order (only three please!)
+    FEATURED_PRODUCT_IDS = (34, 42, 13)
+
 class DevelopmentConfig(Config):
     DEBUG = True
 
@@ -19,3 +118,5 @@ class TestingConfig(Config):
     TESTING = True
     SQLALCHEMY_DATABASE_URI = "sqlite:///:memory:"
     WTF_CSRF_ENABLED = False
+    # Orders placed by the tests are reported straight away.
+    SALES_REPORT_CURSOR_LAG = 0
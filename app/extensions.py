@@ -1,17 +1,20 @@
 from flask_login import LoginManager
 from flask_migrate import Migrate
 from flask_sqlalchemy import SQLAlchemy
+from flask_wtf.csrf import CSRFProtect
 
 db = SQLAlchemy()
 login_manager = LoginManager()
 migrate = Migrate()
+csrf = CSRFProtect()
 
 def init_extensions(app):
     """
-    This initializes the db, the login manager, and 
-    the migrations tool.
+    This initializes the db, the login manager, 
+    the migrations tool, and CSRF protection for every POST.
     """
     db.init_app(app)
     migrate.init_app(app, db)
+    csrf.init_app(app)
     login_manager.init_app(app)
     login_manager.login_view = 'login'
@@ -2,9 +2,10 @@ from datetime import datetime
 
 from flask_wtf import FlaskForm
 import sqlalchemy as sa
-from wtforms import StringField, PasswordField, BooleanField, SubmitField
+from wtforms import StringField, PasswordField, BooleanField, HiddenField, \
+    SubmitField
 from wtforms.validators import DataRequired, ValidationError, EqualTo, \
-    Regexp, Email, Length
+    Regexp, Email, Length, Optional
 from wtforms.fields.choices import SelectField
 
 from .extensions import db
@@ -76,6 +77,9 @@ class CheckoutForm(FlaskForm):
     exp_year = SelectField("Expiration Year", choices=years,
                            validators=[DataRequired()])
     cvv = StringField('CVV', validators=[DataRequired(), Length(min=3, max=3)])
+    # Set when the form is shown and saved with the order, so submitting the
+    # same form twice places the order once.
+    idempotency_key = HiddenField(validators=[Optional(), Length(max=64)])
     submit = SubmitField('Submit Order')
 
     def validate_exp_month(self, exp_month):
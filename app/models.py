@@ -1,10 +1,19 @@
 """Database models for the e-commerce platform."""
 from __future__ import annotations
-from datetime import datetime
-
+import csv
+import io
+import random
+import sys
+import time
+from datetime import date, datetime, timedelta
+from typing import Iterator
+
+from flask import current_app
 from flask_login import UserMixin
-from sqlalchemy import or_
+import sqlalchemy as sa
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from sqlalchemy.exc import SQLAlchemyError
+from sqlalchemy.orm import joinedload
 from werkzeug.security import check_password_hash, generate_password_hash
 
 from .extensions import db, login_manager
@@ -133,9 +142,16 @@ class Product(db.Model):
         description (str): A brief description of the product.
         price (float): The price of the product.
         stock (int): The quantity of the product in stock.
+        version (int): Bumped by every commit that changes the product (see
+          signals.py), so every worker can tell which version of a product
+          a page was built from.
 
     Methods:
         subtract_stock: Subtracts a given quantity from the product's stock.
+        take_stock: Atomically subtracts a quantity from a product's stock in
+          the database, if there's enough of it.
+        take_stocks: Like take_stock, for several products at once.
+        return_stock: Adds quantities back to products' stock in the database.
 
     Example:
         >>> product = Product(name='TV', description='A small TV',
@@ -146,16 +162,32 @@ class Product(db.Model):
     description = db.Column(db.String(255), nullable=False)
     price = db.Column(db.Float, nullable=False)
     stock = db.Column(db.Integer, nullable=False)
+    version = db.Column(db.Integer, nullable=False, default=1,
+                        server_default='1')
+
+    # For paging through the catalog sorted by price, name or stock.
+    __table_args__ = (
+        db.Index('ix_product_price_id', 'price', 'id'),
+        db.Index('ix_product_name_id', 'name', 'id'),
+        db.Index('ix_product_stock_id', 'stock', 'id'),
+    )
 
     @staticmethod
-    def search(query: str):
+    def search(query: str, limit: int | None = None, fuzzy: bool = False):
         """Searches for products based on a search query.
 
         This method will search for products based on their name
-        or description.
+        or description. Matching is done on whole words using the in-memory
+        search index (see search.py), and a product must contain every word
+        in the query to match. If a limit is given, only the most relevant
+        products are returned, best match first. A fuzzy search also matches
+        words that are spelled similarly to the query's words, so typos like
+        "blutooth" still find something.
 
         Args:
             query (str): The search query to use.
+            limit (int): The maximum number of products to return.
+            fuzzy (bool): Whether to match misspelled words.
 
         Returns:
             List[Product]: A list of products that match the search query.
@@ -163,10 +195,38 @@ class Product(db.Model):
         Example:
             >>> Product.search('TV')
             [<Product Large TV>, <Product Small TV>]
+            >>> Product.search('TV', limit=1)
+            [<Product Small TV>]
+            >>> Product.search('Smal TV', fuzzy=True)
+            [<Product Small TV>]
+        """
+        from .search import search_index
+        if limit is None and not fuzzy:
+            product_ids = sorted(search_index().search(query))
+        else:
+            product_ids, _ = search_index().top_k(
+                query, limit if limit is not None else sys.maxsize,
+                fuzzy=fuzzy)
+        return Product.get_many(product_ids)
+
+    @staticmethod
+    def get_many(product_ids: list[int]) -> list[Product]:
+        """Fetches several products with one query, keeping the given order.
+
+        Ids that don't belong to a product are skipped.
+
+        Args:
+            product_ids (List[int]): The ids of the products to fetch.
+
+        Returns:
+            List[Product]: The products, in the same order as their ids.
         """
-        query_match = or_(Product.name.ilike(f'%{query}%'),
-                          Product.description.ilike(f'%{query}%'))
-        return Product.query.filter(query_match).all()
+        if not product_ids:
+            return []
+        products = {product.id: product for product in
+                    Product.query.filter(Product.id.in_(product_ids))}
+        return [products[product_id] for product_id in product_ids
+                if product_id in products]
 
     def subtract_stock(self, quantity: int):
         """Subtracts a given quantity from the product's stock.
@@ -197,6 +257,90 @@ class Product(db.Model):
                              f' Stock: {self.stock}, Subtracted: {quantity}')
         self.stock -= quantity
 
+    @staticmethod
+    def take_stock(product_id: int, quantity: int) -> bool:
+        """Subtracts a quantity from a product's stock in the database, if
+        there's enough of it.
+
+        Unlike subtract_stock, this doesn't read the stock first: it runs
+        ``UPDATE product SET stock = stock - :q WHERE id = :id AND stock >=
+        :q``, so two concurrent checkouts can't both take the last item. The
+        change is reported with mark_products_changed and isn't committed.
+
+        Args:
+            product_id (int): The id of the product.
+            quantity (int): The quantity to take.
+
+        Returns:
+            bool: Whether the stock was taken. False if there wasn't enough
+              of it, or the product doesn't exist.
+        """
+        from .signals import mark_products_changed
+        result = db.session.execute(
+            sa.update(Product)
+            .where(Product.id == product_id, Product.stock >= quantity)
+            .values(stock=Product.stock - quantity)
+            .execution_options(synchronize_session=False))
+        if result.rowcount != 1:
+            return False
+        mark_products_changed(db.session, [product_id], ['stock'])
+        return True
+
+    @staticmethod
+    def take_stocks(quantities: dict[int, int]) -> bool:
+        """Like take_stock, but for several products at once, with one
+        UPDATE: either there's enough stock of every product and it's all
+        taken, or nothing is.
+
+        Args:
+            quantities (Dict[int, int]): The quantity to take of each
+              product, keyed by product id.
+
+        Returns:
+            bool: Whether the stock was taken.
+        """
+        from .signals import mark_products_changed
+        quantities = {product_id: quantity for product_id, quantity
+                      in quantities.items() if quantity > 0}
+        if not quantities:
+            return True
+        wanted = sa.case(quantities, value=Product.id)
+        savepoint = db.session.begin_nested()
+        result = db.session.execute(
+            sa.update(Product)
+            .where(Product.id.in_(quantities), Product.stock >= wanted)
+            .values(stock=Product.stock - wanted)
+            .execution_options(synchronize_session=False))
+        if result.rowcount != len(quantities):
+            savepoint.rollback()
+            return False
+        savepoint.commit()
+        mark_products_changed(db.session, quantities, ['stock'])
+        return True
+
+    @staticmethod
+    def return_stock(quantities: dict[int, int]):
+        """Adds quantities back to products' stock in the database, with one
+        UPDATE, e.g. when a reservation is released.
+
+        The change is reported with mark_products_changed and isn't
+        committed.
+
+        Args:
+            quantities (Dict[int, int]): The quantity to add back to each
+              product, keyed by product id.
+        """
+        from .signals import mark_products_changed
+        if not quantities:
+            return
+        db.session.execute(
+            sa.update(Product)
+            .where(Product.id.in_(quantities))
+            .values(stock=Product.stock + sa.case(quantities, value=Product.id,
+                                                  else_=0))
+            .execution_options(synchronize_session=False))
+        mark_products_changed(db.session, quantities, ['stock'])
+
     def __repr__(self):
         return f'<Product id={self.id} name={self.name}>'
 
@@ -213,9 +357,18 @@ class Cart(db.Model):
         user_id (int): The user's unique identifier associated with the cart.
         user (User): The user associated with the cart.
         items (List[CartItem]): A list of items in the cart.
+        item_count (int): How many items (counting quantities) are in the
+          cart, kept up to date as items change.
+        subtotal (float): The total price of the items in the cart, kept up
+          to date as items and their prices change.
 
     Methods:
+        get_for_user: Fetches a user's cart with its items and products.
+        add_to_totals: Adds to the stored totals of carts.
+        recompute_totals: Recomputes the stored totals of carts.
         add_product: Adds a product to the cart with an optional quantity.
+        add_products: Adds several products to the cart at once.
+        update_quantities: Sets the quantities of several items at once.
         remove_product: Removes a product from the cart.
         remove_cart_item: Removes a cart item from the cart.
         get_total_price: Calculates the total price of all items in the cart.
@@ -234,6 +387,85 @@ class Cart(db.Model):
     user = db.relationship('User', back_populates='cart')
     items = db.relationship('CartItem', back_populates='cart',
                             cascade='all, delete-orphan')
+    # Stored so the cart summary and the nav badge don't need the items.
+    item_count = db.Column(db.Integer, nullable=False, default=0,
+                           server_default='0')
+    subtotal = db.Column(db.Float, nullable=False, default=0,
+                         server_default='0')
+
+    @staticmethod
+    def get_for_user(user_id: int) -> Cart | None:
+        """Fetches a user's cart, its items and their products in one query.
+
+        Pages that show every item's product, and the cart's total, can use
+        this instead of lazily loading each item's product, which would be a
+        query per item.
+
+        Args:
+            user_id (int): The user's unique identifier.
+
+        Returns:
+            Cart | None: The user's cart, or None if they don't have one.
+
+        Example:
+            >>> cart = Cart.get_for_user(user.id)
+            >>> cart.items[0].product.name  # Already loaded.
+            'TV'
+        """
+        return Cart.query.options(
+            joinedload(Cart.items).joinedload(CartItem.product)
+        ).filter_by(user_id=user_id).first()
+
+    @staticmethod
+    def add_to_totals(quantities):
+        """Adds quantities of products to the stored totals of carts.
+
+        This is what keeps item_count and subtotal up to date as items are
+        added, changed and removed: one UPDATE per cart, using the products'
+        current prices. Carts already loaded have their totals expired.
+
+        Args:
+            quantities (Dict[Tuple[int, int], int]): The quantity added (or
+              removed, if negative) for each cart id and product id.
+        """
+        by_cart = {}
+        for (cart_id, product_id), quantity in quantities.items():
+            products = by_cart.setdefault(cart_id, {})
+            products[product_id] = products.get(product_id, 0) + quantity
+        table = Cart.__table__
+        for cart_id, products in by_cart.items():
+            price = sa.select(sa.func.sum(
+                sa.case(products, value=Product.id, else_=0) * Product.price)
+            ).where(Product.id.in_(products)).scalar_subquery()
+            db.session.execute(sa.update(table).where(table.c.id == cart_id)
+                               .values(item_count=table.c.item_count +
+                                       sum(products.values()),
+                                       subtotal=sa.func.round(
+                                           table.c.subtotal +
+                                           sa.func.coalesce(price, 0), 2)))
+        _expire_totals(db.session, by_cart)
+
+    @staticmethod
+    def recompute_totals(condition, connection=None):
+        """Recomputes the stored totals of carts from their items.
+
+        Args:
+            condition (ColumnElement): Which carts to recompute, e.g.
+              ``Cart.id == 3``.
+            connection (Connection): The connection to run the UPDATE on.
+              Defaults to the session's.
+        """
+        cart, cart_item = Cart.__table__, CartItem.__table__
+        count = sa.select(sa.func.coalesce(sa.func.sum(cart_item.c.quantity),
+                                           0)) \
+            .where(cart_item.c.cart_id == cart.c.id).scalar_subquery()
+        subtotal = sa.select(sa.func.coalesce(
+            sa.func.sum(cart_item.c.quantity * Product.__table__.c.price), 0)) \
+            .select_from(cart_item.join(Product.__table__)) \
+            .where(cart_item.c.cart_id == cart.c.id).scalar_subquery()
+        statement = sa.update(cart).where(condition).values(
+            item_count=count, subtotal=sa.func.round(subtotal, 2))
+        (connection or db.session).execute(statement)
 
     def clear_cart(self):
         """Removes all items from the cart.
@@ -252,13 +484,18 @@ class Cart(db.Model):
         """
         for item in self.items:
             db.session.delete(item)
+        self.item_count = 0
+        self.subtotal = 0
         db.session.commit()
 
     def add_product(self, product_id: int, quantity: int = 1):
         """Adds a product to the cart, optionally with a specified quantity.
 
         If no quantity is provided, the default is 1. If the product is already
-        in the cart, the quantity will be added to the current quantity.
+        in the cart, the quantity will be added to the current quantity. This
+        is a single upsert statement, so adding the same product at the same
+        time from two requests can't create two cart items. It isn't
+        committed.
 
         Args:
             product_id (int): The id of the product to be added to the cart.
@@ -273,15 +510,71 @@ class Cart(db.Model):
             >>> cart.items[0].name
             'TV'
         """
-        current_item = CartItem.query.filter_by(cart_id=self.id,
-                                                product_id=product_id).first()
-        if current_item:
-            current_item.quantity += quantity
-        else:
-            new_item = CartItem(cart_id=self.id, product_id=product_id,
-                                quantity=quantity)
-            db.session.add(new_item)
-        db.session.commit()
+        self.add_products({product_id: quantity})
+
+    def add_products(self, quantities: dict[int, int]):
+        """Adds several products to the cart with a single upsert statement.
+
+        Works like add_product for each product. It isn't committed.
+
+        Args:
+            quantities (Dict[int, int]): The quantity to add of each product,
+              by product id.
+
+        Example:
+            >>> cart.add_products({tv.id: 1, radio.id: 2})
+            >>> cart.item_count
+            3
+        """
+        db.session.add(self)
+        # Flush so a new cart has an id, and earlier changes to its items
+        # come before the upsert.
+        db.session.flush()
+        CartItem.add_quantities([(self.id, product_id, quantity)
+                                 for product_id, quantity in quantities.items()])
+        # The upsert went around the ORM, so reload the items next time.
+        if 'items' not in sa.inspect(self).unloaded:
+            for item in self.items:
+                db.session.expire(item, ['quantity'])
+        db.session.expire(self, ['items'])
+
+    def update_quantities(self, quantities: dict[int, int]):
+        """Sets the quantities of several items in the cart at once.
+
+        Items whose new quantity is 0 or less are removed. The items are
+        loaded with one query that also checks they're all in this cart, and
+        the totals are updated with one statement. It isn't committed.
+
+        Args:
+            quantities (Dict[int, int]): The new quantity of each item, by
+              cart item id.
+
+        Raises:
+            ValueError: If any of the items isn't in this cart. Nothing is
+              changed.
+
+        Example:
+            >>> cart.update_quantities({cart.items[0].id: 3,
+            ...                         cart.items[1].id: 0})
+            >>> len(cart.items), cart.items[0].quantity
+            (1, 3)
+        """
+        items = CartItem.query.filter(CartItem.id.in_(quantities),
+                                      CartItem.cart_id == self.id).all()
+        if len(items) != len(quantities):
+            raise ValueError('Some of the items are not in this cart.')
+        changes = {}
+        for item in items:
+            quantity = quantities[item.id]
+            changes[(self.id, item.product_id)] = \
+                max(quantity, 0) - item.quantity
+            if quantity <= 0:
+                db.session.delete(item)
+            else:
+                item.quantity = quantity
+        db.session.flush()
+        Cart.add_to_totals(changes)
+        db.session.expire(self, ['items'])
 
     def remove_product(self, product_id: int):
         """Removes a product from the cart.
@@ -306,12 +599,16 @@ class Cart(db.Model):
         current_item = CartItem.query.filter_by(cart_id=self.id,
                                                 product_id=product_id).first()
         if current_item:
+            Cart.add_to_totals({(self.id, product_id): -current_item.quantity})
             db.session.delete(current_item)
             db.session.commit()
 
     def get_total_price(self) -> float:
         """Calculates the total price of all items in the cart.
 
+        This walks every item and its product, pages that only need the
+        total should read the stored subtotal instead.
+
         Returns:
 
             float: The total price of all items in the cart.
@@ -367,6 +664,47 @@ class CartItem(db.Model):
     cart = db.relationship('Cart', back_populates='items')
     product = db.relationship('Product')
 
+    # A product is in a cart at most once, with a quantity.
+    __table_args__ = (
+        db.UniqueConstraint('cart_id', 'product_id',
+                            name='uq_cart_item_cart_id_product_id'),
+    )
+
+    @staticmethod
+    def add_quantities(rows):
+        """Adds quantities of products to carts with one upsert statement.
+
+        A product that isn't in the cart yet gets a new cart item, otherwise
+        the quantity is added to the existing item's. This doesn't go through
+        the ORM, so CartItem objects already loaded won't see the changes
+        until they're expired or refreshed. It isn't committed.
+
+        Args:
+            rows (Iterable[Tuple[int, int, int]]): The cart id, product id
+              and quantity to add, for each product.
+
+        Raises:
+            ValueError: If any quantity is less than 1. Nothing is added.
+
+        Example:
+            >>> CartItem.add_quantities([(cart.id, tv.id, 2),
+            ...                          (cart.id, radio.id, 1)])
+        """
+        quantities = {}
+        for cart_id, product_id, quantity in rows:
+            if quantity < 1:
+                raise ValueError('Quantities must be 1 or more.')
+            key = (cart_id, product_id)
+            quantities[key] = quantities.get(key, 0) + quantity
+        if not quantities:
+            return
+        _upsert(CartItem.__table__,
+                [{'cart_id': cart_id, 'product_id': product_id,
+                  'quantity': quantity}
+                 for (cart_id, product_id), quantity in quantities.items()],
+                ('cart_id', 'product_id'), ('quantity',))
+        Cart.add_to_totals(quantities)
+
     def update_quantity(self, quantity: int):
         """Sets the quantity of the item in the cart.
 
@@ -386,6 +724,8 @@ class CartItem(db.Model):
             >>> cart.items[0].quantity
             4
         """
+        Cart.add_to_totals({(self.cart_id, self.product_id):
+                            max(quantity, 0) - self.quantity})
         if quantity <= 0:
             db.session.delete(self)
             db.session.commit()
@@ -397,6 +737,268 @@ class CartItem(db.Model):
         return f'<CartItem id={self.id}>'
 
 
+class Reservation(db.Model):
+    """Stock held for a cart while its owner checks out.
+
+    When the checkout page loads, the stock for each item in the cart is
+    taken from the product (so a product's stock is what's left for everyone
+    else) and held here until expires_at. Placing the order turns the holds
+    into sales without touching the products again, and holds that expire
+    first are given back to the products by sweep_expired, which "flask
+    sweep-reservations" runs (schedule it with cron). A checkout that's
+    short of a product doesn't wait for the sweeper, though: it gives back
+    the product's expired holds itself, with release_expired. Deleting a
+    cart (e.g. with its user) gives back all its holds first.
+
+    Attributes:
+        id (int): The reservation's unique identifier.
+        cart_id (int): The id of the cart the stock is held for.
+        product_id (int): The id of the product whose stock is held.
+        quantity (int): How much stock is held.
+        expires_at (datetime): When the hold runs out.
+
+    Methods:
+        hold_cart: Holds stock for everything in a cart.
+        claim: Takes over a hold, e.g. to sell what it holds.
+        release_expired: Gives back the stock of some products' expired
+          holds, within the current transaction.
+        release_cart: Gives back the stock of all a cart's holds, within the
+          current transaction.
+        sweep_expired: Gives stock held by expired reservations back.
+
+    Example:
+        >>> Reservation.hold_cart(cart, ttl=600)
+        []
+        >>> product.stock
+        3
+        >>> order = Order.create_order_from_cart(cart)
+        >>> product.stock
+        3
+    """
+    id = db.Column(db.Integer, primary_key=True)
+    cart_id = db.Column(db.Integer, db.ForeignKey('cart.id'), nullable=False)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'),
+                           nullable=False)
+    quantity = db.Column(db.Integer, nullable=False)
+    expires_at = db.Column(db.DateTime, nullable=False, index=True)
+
+    # A cart holds stock of a product at most once.
+    __table_args__ = (
+        db.UniqueConstraint('cart_id', 'product_id',
+                            name='uq_reservation_cart_id_product_id'),
+    )
+
+    @staticmethod
+    def hold_cart(cart: Cart, ttl: float) -> list[int]:
+        """Holds stock for everything in a cart for ttl seconds, replacing
+        the cart's current holds. Doesn't commit.
+
+        Stock is taken with one UPDATE when there's enough of everything,
+        or else in ascending product id order, like an order does. If
+        there isn't enough, other carts' expired holds on the products are
+        given back first. Anything the cart no longer holds goes back to
+        its product. Items with a quantity below 1 aren't held.
+
+        Args:
+            cart (Cart): The cart to hold stock for.
+            ttl (float): How many seconds to hold it for.
+
+        Returns:
+            List[int]: The ids of the products there wasn't enough stock
+              to hold. Whatever was held for them before is still held.
+        """
+        expires_at = datetime.now() + timedelta(seconds=ttl)
+        # Extend the cart's holds before reading them. The UPDATE locks
+        # them, so the sweeper (which skips locked holds) can't give back
+        # stock that's read here as still held.
+        db.session.execute(
+            sa.update(Reservation).where(Reservation.cart_id == cart.id)
+            .values(expires_at=expires_at)
+            .execution_options(synchronize_session=False))
+        holds = {hold.product_id: hold for hold in
+                 Reservation.query.filter_by(cart_id=cart.id)
+                 .populate_existing()}
+        wanted = {item.product_id: item.quantity for item in cart.items
+                  if item.quantity > 0}
+        more = {product_id: quantity - holds[product_id].quantity
+                if product_id in holds else quantity
+                for product_id, quantity in wanted.items()}
+        # Usually there's enough of everything, and it can all be taken at
+        # once. Otherwise take what there's enough of, one product at a time.
+        taken = Product.take_stocks(more)
+        if not taken and Reservation.release_expired(
+                [product_id for product_id in more if more[product_id] > 0],
+                cart.id):
+            taken = Product.take_stocks(more)
+        if taken:
+            short = []
+        else:
+            short = [product_id for product_id in sorted(more)
+                     if more[product_id] > 0 and
+                     not Product.take_stock(product_id, more[product_id])]
+        # The holds are written with one statement of each kind.
+        returned, added, changed, deleted = {}, [], [], []
+        for product_id in wanted.keys() | holds.keys():
+            hold = holds.get(product_id)
+            held = hold.quantity if hold is not None else 0
+            quantity = held if product_id in short else \
+                wanted.get(product_id, 0)
+            if quantity < held:
+                returned[product_id] = held - quantity
+            if quantity == 0:
+                if hold is not None:
+                    deleted.append(hold.id)
+            elif hold is not None:
+                changed.append({'id': hold.id, 'quantity': quantity,
+                                'expires_at': expires_at})
+            else:
+                added.append({'cart_id': cart.id, 'product_id': product_id,
+                              'quantity': quantity, 'expires_at': expires_at})
+        if added:
+            db.session.execute(sa.insert(Reservation), added)
+        if changed:
+            db.session.execute(sa.update(Reservation), changed)
+        if deleted:
+            db.session.execute(
+                sa.delete(Reservation).where(Reservation.id.in_(deleted))
+                .execution_options(synchronize_session=False))
+        for hold in holds.values():
+            db.session.expire(hold)
+        Product.return_stock(returned)
+        return short
+
+    @staticmethod
+    def claim(hold: Reservation | None) -> int:
+        """Takes over a hold by deleting it, so the sweeper can't give its
+        stock back too. Doesn't commit.
+
+        Args:
+            hold (Reservation | None): The hold to take over.
+
+        Returns:
+            int: The quantity held, or 0 if there was no hold or it was
+              already swept.
+        """
+        if hold is None:
+            return 0
+        result = db.session.execute(
+            sa.delete(Reservation).where(Reservation.id == hold.id)
+            .execution_options(synchronize_session=False))
+        return hold.quantity if result.rowcount == 1 else 0
+
+    @staticmethod
+    def release_expired(product_ids, cart_id: int | None = None) -> bool:
+        """Deletes the expired holds on some products and gives their stock
+        back, so a checkout that's short of them doesn't have to wait for
+        the sweeper. Doesn't commit.
+
+        Args:
+            product_ids (Iterable[int]): The ids of the products.
+            cart_id (int | None): A cart whose holds are left alone, since
+              its owner is checking out.
+
+        Returns:
+            bool: Whether any stock was given back.
+        """
+        product_ids = list(product_ids)
+        if not product_ids:
+            return False
+        conditions = [Reservation.product_id.in_(product_ids),
+                      Reservation.expires_at <= datetime.now()]
+        if cart_id is not None:
+            conditions.append(Reservation.cart_id != cart_id)
+        savepoint = db.session.begin_nested()
+        rows = db.session.execute(
+            sa.select(Reservation.id, Reservation.product_id,
+                      Reservation.quantity)
+            .where(*conditions).with_for_update(skip_locked=True)).all()
+        result = db.session.execute(
+            sa.delete(Reservation)
+            .where(Reservation.id.in_([row.id for row in rows]), *conditions)
+            .execution_options(synchronize_session=False))
+        if result.rowcount != len(rows):
+            # Someone else claimed, swept or extended some of them.
+            savepoint.rollback()
+            return False
+        returned = {}
+        for row in rows:
+            returned[row.product_id] = \
+                returned.get(row.product_id, 0) + row.quantity
+        Product.return_stock(returned)
+        savepoint.commit()
+        return bool(rows)
+
+    @staticmethod
+    def release_cart(cart_id: int) -> int:
+        """Deletes all a cart's holds, expired or not, and gives their stock
+        back, e.g. before the cart is deleted. Doesn't commit.
+
+        Args:
+            cart_id (int): The cart's unique identifier.
+
+        Returns:
+            int: How many holds were released.
+        """
+        rows = db.session.execute(
+            sa.select(Reservation.id, Reservation.product_id,
+                      Reservation.quantity)
+            .where(Reservation.cart_id == cart_id).with_for_update()).all()
+        if not rows:
+            return 0
+        db.session.execute(
+            sa.delete(Reservation)
+            .where(Reservation.id.in_([row.id for row in rows]))
+            .execution_options(synchronize_session=False))
+        returned = {}
+        for row in rows:
+            returned[row.product_id] = \
+                returned.get(row.product_id, 0) + row.quantity
+        Product.return_stock(returned)
+        return len(rows)
+
+    @staticmethod
+    def sweep_expired(batch_size: int = 500) -> int:
+        """Deletes expired reservations and gives their stock back, in
+        batches of batch_size, committing after each one.
+
+        Args:
+            batch_size (int): How many reservations to sweep per transaction.
+
+        Returns:
+            int: How many reservations were swept.
+        """
+        now = datetime.now()
+        swept = 0
+        while True:
+            # Skip holds a checkout is claiming rather than wait for it.
+            rows = db.session.execute(
+                sa.select(Reservation.id, Reservation.product_id,
+                          Reservation.quantity)
+                .where(Reservation.expires_at <= now)
+                .order_by(Reservation.id).limit(batch_size)
+                .with_for_update(skip_locked=True)).all()
+            if not rows:
+                return swept
+            result = db.session.execute(
+                sa.delete(Reservation)
+                .where(Reservation.id.in_([row.id for row in rows]))
+                .execution_options(synchronize_session=False))
+            if result.rowcount != len(rows):
+                # A checkout claimed some of them since they were read.
+                db.session.rollback()
+                continue
+            returned = {}
+            for row in rows:
+                returned[row.product_id] = \
+                    returned.get(row.product_id, 0) + row.quantity
+            Product.return_stock(returned)
+            db.session.commit()
+            swept += len(rows)
+
+    def __repr__(self):
+        return f'<Reservation id={self.id}>'
+
+
 class Order(db.Model):
     """The model for storing order information in the database.
 
@@ -407,22 +1009,54 @@ class Order(db.Model):
         id (int): The order's unique identifier.
         user_id (int): The user's id associated with the order.
         order_date (datetime): The date and time the order was placed.
+        idempotency_key (str): The key of the checkout form the order was
+          placed with, if any. Keys are unique, so an order can only be
+          placed once with the same form.
         user (User): The user associated with the order.
         items (List[OrderItem]): A list of items in the order.
 
     Methods:
         create_order_from_cart: Creates an order from a user's cart.
+        get_by_idempotency_key: Finds a user's order by its idempotency key.
+        report_conditions: Returns the conditions that pick the orders for a
+          sales report.
+        last_id: Returns the greatest id of the orders meeting conditions.
+        stream_csv: Generates orders in CSV format, a chunk at a time.
         get_total_price: Calculates the total price of all items in the order.
     """
     id = db.Column(db.Integer, primary_key=True)
     user_id = db.Column(db.Integer, db.ForeignKey('user.id'))
-    order_date = db.Column(db.DateTime, nullable=False)
+    order_date = db.Column(db.DateTime, nullable=False, index=True)
+    idempotency_key = db.Column(db.String(64), nullable=True)
     user = db.relationship('User')
     items = db.relationship('OrderItem', back_populates='order',
                             cascade='all, delete-orphan')
 
+    __table_args__ = (
+        db.UniqueConstraint('idempotency_key',
+                            name='uq_order_idempotency_key'),
+    )
+
+    @staticmethod
+    def get_by_idempotency_key(user_id: int,
+                               idempotency_key: str | None) -> Order | None:
+        """Finds a user's order by the idempotency key it was placed with.
+
+        Args:
+            user_id (int): The id of the user who placed the order.
+            idempotency_key (str | None): The key. None finds nothing.
+
+        Returns:
+            Order | None: The order, or None if there isn't one.
+        """
+        if not idempotency_key:
+            return None
+        return Order.query.filter_by(user_id=user_id,
+                                     idempotency_key=idempotency_key).first()
+
     @staticmethod
-    def create_order_from_cart(cart: Cart) -> Order:
+    def create_order_from_cart(cart: Cart,
+                               idempotency_key: str | None = None) -> Order:
         """Creates an order from a user's cart.
 
         Static method meant for directly converting an existing cart into an
@@ -430,17 +1064,29 @@ class Order(db.Model):
         will result a new order being created in the database. This will also
         update the stock of each product in the order, and clear the user's
         cart. If there isn't enough stock or an error occurs, the transaction
-        will be rolled back.
+        will be rolled back. A transaction that deadlocks with another
+        checkout is retried, up to ORDER_RETRY_ATTEMPTS times in all, after
+        a random wait that doubles (at most) each time, starting from
+        ORDER_RETRY_BACKOFF seconds.
+
+        If an order was already placed with the same idempotency key (say the
+        form was submitted twice), that order is returned and nothing else
+        happens. Two submissions at once can't both place an order, since the
+        key is unique: the second one's INSERT fails and it returns the
+        first one's order.
 
         Args:
             cart (Cart): The user's cart to convert into an order.
+            idempotency_key (str | None): A key identifying this attempt to
+              place the order, e.g. from the checkout form.
 
         Exceptions:
             ValueError: If there is not enough stock for a product.
             RuntimeError: If the transaction fails for any reason.
 
         Returns:
-            Order: The newly created order.
+            Order: The newly created order, or the one placed before with the
+              same idempotency key.
 
         Example:
             >>> user = User(username=..., name=..., email=..., address=...)
@@ -456,30 +1102,91 @@ class Order(db.Model):
             >>> len(cart.items)
             0
         """
-        order = Order(user_id=cart.user_id, order_date=datetime.now())
+        order = Order.get_by_idempotency_key(cart.user_id, idempotency_key)
+        if order is not None:
+            return order
+        attempts = current_app.config['ORDER_RETRY_ATTEMPTS']
+        backoff = current_app.config['ORDER_RETRY_BACKOFF']
+        for attempt in range(attempts):
+            try:
+                return Order._place_order(cart, idempotency_key)
+            except sa.exc.IntegrityError:
+                db.session.rollback()
+                # Another submission with the same key got there first.
+                order = Order.get_by_idempotency_key(cart.user_id,
+                                                     idempotency_key)
+                if order is None:
+                    raise RuntimeError("Transaction failed. Please try again.")
+                return order
+            except SQLAlchemyError as e:
+                db.session.rollback()
+                # Another checkout holding the same products got in the
+                # way: wait a random while, so the two don't collide again,
+                # and start over.
+                if not _is_lock_conflict(e) or attempt == attempts - 1:
+                    raise RuntimeError("Transaction failed. Please try again.")
+                time.sleep(random.uniform(0, backoff * 2 ** attempt))
+
+    @staticmethod
+    def _place_order(cart: Cart, idempotency_key: str | None) -> Order:
+        """Creates an order from a cart in one transaction, without retrying.
+
+        Stock held for the cart (see Reservation) is claimed rather than
+        taken from the products again. Any other stock needed is taken in
+        ascending product id order (each UPDATE locks its row), so two
+        checkouts that share products always lock them in the same order and
+        can't deadlock; if there isn't enough, other carts' expired holds on
+        the product are given back first. The order items are inserted with
+        one executemany, and added to the daily sales rollup with one upsert.
+        """
+        from .signals import mark_order_items_added
+        order = Order(user_id=cart.user_id, order_date=datetime.now(),
+                      idempotency_key=idempotency_key or None)
         db.session.add(order)
-        try:
-            for cart_item in cart.items:
-                product = cart_item.product
-                # If there isn't enough stock, rollback the transaction.
-                if product.stock < cart_item.quantity:
-                    db.session.rollback()
-                    raise ValueError('Insufficient stock for product.'
-                                     f'Stock {product.stock} < '
-                                     f'Quantity {cart_item.quantity}')
-                # Update stock.
-                product.subtract_stock(cart_item.quantity)
-                # Create orders
-                order_item = OrderItem(product_id=product.id,
-                                       quantity=cart_item.quantity,
-                                       price=product.price)
-                order.items.append(order_item)
-            # Clear cart now that everything is in the order.
-            cart.clear_cart()
-            db.session.commit()
-        except SQLAlchemyError as e:
-            db.session.rollback()
-            raise RuntimeError("Transaction failed. Please try again.")
+        # Insert the order first, so a duplicate idempotency key fails before
+        # any stock is touched.
+        db.session.flush()
+        cart_items = sorted(cart.items, key=lambda item: item.product_id)
+        holds = {hold.product_id: hold for hold in
+                 Reservation.query.filter_by(cart_id=cart.id)}
+        returned = {}
+        for cart_item in cart_items:
+            if cart_item.quantity < 1:
+                name = cart_item.product.name
+                db.session.rollback()
+                raise ValueError(f'Invalid quantity for product {name}.')
+            # Stock held when the checkout page loaded is already taken.
+            held = Reservation.claim(holds.pop(cart_item.product_id, None))
+            needed = cart_item.quantity - held
+            if needed < 0:
+                returned[cart_item.product_id] = -needed
+            # Take the rest in the database, so a concurrent checkout can't
+            # take it too. If there isn't enough, rollback the transaction.
+            elif needed > 0 and not Product.take_stock(
+                    cart_item.product_id, needed) and not (
+                    Reservation.release_expired([cart_item.product_id],
+                                                cart.id) and
+                    Product.take_stock(cart_item.product_id, needed)):
+                name = cart_item.product.name
+                db.session.rollback()
+                raise ValueError(f'Insufficient stock for product {name}.')
+        # Holds for products no longer in the cart go back.
+        for product_id, hold in holds.items():
+            returned[product_id] = Reservation.claim(hold)
+        Product.return_stock(returned)
+        db.session.execute(sa.insert(OrderItem), [
+            {'order_id': order.id, 'product_id': cart_item.product_id,
+             'quantity': cart_item.quantity, 'price': cart_item.product.price}
+            for cart_item in cart_items])
+        mark_order_items_added(db.session, [
+            (cart_item.product_id, cart_item.quantity)
+            for cart_item in cart_items])
+        SalesDaily.add_sales(
+            (order.order_date.date(), cart_item.product_id,
+             cart_item.quantity, cart_item.quantity * cart_item.product.price)
+            for cart_item in cart_items)
+        # Clear cart now that everything is in the order. This commits.
+        cart.clear_cart()
         return order
 
     @staticmethod
@@ -488,19 +1195,87 @@ class Order(db.Model):
 
         This creates a string for a CSV file containing all orders in the
         database with one product per line. The columns are order_id, user_id,
-        order_date, product_id, quantity, and price.
+        order_date, product_id, quantity, and price. To send the report
+        without holding it all in memory, use stream_csv instead.
 
         Returns:
             str: A string containing all orders in CSV format.
         """
-        orders = Order.query.all()
-        result = 'order_id,user_id,order_date,product_id,quantity,price\n'
-        for order in orders:
-            for item in order.items:
-                result += (f'{order.id},{order.user_id},{order.order_date},'
-                           f'{item.product_id},{item.quantity},{item.price}\n')
-        return result
+        return ''.join(Order.stream_csv())
+
+    @staticmethod
+    def report_conditions(start: date | None = None, end: date | None = None,
+                          since_id: int | None = None) -> list:
+        """Returns the conditions that pick the orders for a sales report.
+
+        Args:
+            start (date | None): Only orders placed on or after this day.
+            end (date | None): Only orders placed on or before this day.
+            since_id (int | None): Only orders with a greater id, e.g. the
+              last one from the previous report.
+
+        Returns:
+            List[ColumnElement]: The conditions, to be combined with AND.
+        """
+        conditions = []
+        if start is not None:
+            conditions.append(Order.order_date >= datetime.combine(
+                start, datetime.min.time()))
+        if end is not None:
+            conditions.append(Order.order_date < datetime.combine(
+                end + timedelta(days=1), datetime.min.time()))
+        if since_id is not None:
+            conditions.append(Order.id > since_id)
+        return conditions
+
+    @staticmethod
+    def last_id(conditions=()) -> int | None:
+        """Returns the greatest id of the orders meeting the conditions (see
+        report_conditions), or None if there aren't any."""
+        return db.session.scalar(
+            sa.select(sa.func.max(Order.id)).where(*conditions))
+
+    @staticmethod
+    def stream_csv(batch_size: int = 1000, conditions=()) -> Iterator[str]:
+        """Generates orders in CSV format, a chunk at a time.
+
+        The orders and their items are read with one joined query, batch_size
+        rows at a time (with a server-side cursor where the database driver
+        has one), and each batch is written out as one chunk, so memory use
+        doesn't grow with the number of orders.
+
+        Args:
+            batch_size (int): How many rows to read and write at a time.
+            conditions (Iterable[ColumnElement]): Only orders meeting these
+              conditions (see report_conditions) are included. All orders
+              are by default.
 
+        Yields:
+            str: The header line, then each batch of rows.
+
+        Example:
+            >>> conditions = Order.report_conditions(since_id=1041)
+            >>> return Response(stream_with_context(
+            ...     Order.stream_csv(conditions=conditions)), mimetype='text/csv')
+        """
+        query = (
+            sa.select(Order.id, Order.user_id, Order.order_date,
+                      OrderItem.product_id, OrderItem.quantity,
+                      OrderItem.price)
+            .join(OrderItem, OrderItem.order_id == Order.id)
+            .where(*conditions)
+            .order_by(Order.id, OrderItem.id)
+            .execution_options(yield_per=batch_size))
+        buffer = io.StringIO()
+        writer = csv.writer(buffer, lineterminator='\n')
+        writer.writerow(['order_id', 'user_id', 'order_date', 'product_id',
+                         'quantity', 'price'])
+        yield buffer.getvalue()
+        for rows in db.session.execute(query).partitions():
+            buffer.seek(0)
+            buffer.truncate()
+            writer.writerows(rows)
+            yield buffer.getvalue()
 
     def get_total_price(self) -> float:
         """Calculates the total price of all items in the order.
@@ -557,7 +1332,7 @@ class OrderItem(db.Model):
 
     """
     id = db.Column(db.Integer, primary_key=True)
-    order_id = db.Column(db.Integer, db.ForeignKey('order.id'))
+    order_id = db.Column(db.Integer, db.ForeignKey('order.id'), index=True)
     product_id = db.Column(db.Integer, db.ForeignKey('product.id'))
     quantity = db.Column(db.Integer, nullable=False)
     price = db.Column(db.Float, nullable=False)
@@ -566,3 +1341,321 @@ class OrderItem(db.Model):
 
     def __repr__(self):
         return f'<OrderItem id={self.id}>'
+
+
+class SalesDaily(db.Model):
+    """A rollup of how much of each product was sold each day.
+
+    Every order adds its items to the rows for the day it was placed, in the
+    same transaction, so sales reports can add up a row per day (and
+    product) rather than every order item.
+
+    Attributes:
+        day (date): The day the sales were made.
+        product_id (int): The id of the product sold.
+        units (int): How many units were sold.
+        revenue (float): What they were sold for in all.
+
+    Methods:
+        add_sales: Adds sales to the rollup with one upsert statement.
+        rebuild: Rebuilds the rollup from the orders, a range of days at a
+          time.
+        revenue_by: Adds up units and revenue by day, week or month.
+        top_products: Returns the products with the most revenue.
+
+    Example:
+        >>> SalesDaily.revenue_by('month', date(2026, 1, 1), date(2026, 3, 31))
+        [(datetime.date(2026, 1, 1), 1204, 25140.5), ...]
+    """
+    __tablename__ = 'sales_daily'
+    day = db.Column(db.Date, primary_key=True)
+    product_id = db.Column(db.Integer, db.ForeignKey('product.id'),
+                           primary_key=True)
+    units = db.Column(db.Integer, nullable=False, default=0)
+    revenue = db.Column(db.Float, nullable=False, default=0)
+
+    PERIODS = ('day', 'week', 'month')
+
+    @staticmethod
+    def add_sales(rows):
+        """Adds sales to the rollup with one upsert statement. It isn't
+        committed.
+
+        Rows are written in (day, product id) order, so two transactions
+        adding to the same rows always lock them in the same order.
+
+        Args:
+            rows (Iterable[Tuple[date, int, int, float]]): The day, product
+              id, units and revenue of each sale.
+        """
+        sales = {}
+        for day, product_id, units, revenue in rows:
+            previous = sales.get((day, product_id), (0, 0))
+            sales[day, product_id] = (previous[0] + units,
+                                      previous[1] + revenue)
+        if not sales:
+            return
+        _upsert(SalesDaily.__table__,
+                [{'day': day, 'product_id': product_id, 'units': units,
+                  'revenue': revenue}
+                 for (day, product_id), (units, revenue)
+                 in sorted(sales.items())],
+                ('day', 'product_id'), ('units', 'revenue'))
+
+    @staticmethod
+    def rebuild(batch_size: int = 1000) -> int:
+        """Rebuilds the rollup from the orders, a range of days at a time.
+
+        Each range is whole days holding about batch_size orders (a busier
+        day is still done at once), rebuilt in a short transaction of its
+        own, so checkouts are only ever held up by one range. Orders placed
+        while it runs add themselves to the rollup as usual, so the range's
+        rows are deleted first, which locks them (PostgreSQL needs a LOCK
+        TABLE), and only then is the newest order's id taken as a high-water
+        mark: orders up to it that have committed are added up, and any
+        that haven't add themselves to the new rows once the range commits.
+
+        Args:
+            batch_size (int): About how many orders to add up per
+              transaction.
+
+        Returns:
+            int: How many orders were added up.
+        """
+        dialect = db.session.get_bind(
+            mapper=sa.inspect(SalesDaily)).dialect.name
+        day = sa.func.date(Order.order_date, type_=sa.Date)
+        start, total = None, 0
+        while True:
+            # The range ends with the day of its batch_size-th order.
+            last = db.session.scalar(
+                sa.select(Order.order_date)
+                .where(*([] if start is None else
+                         [Order.order_date >= start]))
+                .order_by(Order.order_date)
+                .offset(batch_size - 1).limit(1))
+            end = None if last is None else \
+                datetime(last.year, last.month, last.day) + timedelta(days=1)
+            days, orders = [], []
+            if start is not None:
+                days.append(SalesDaily.day >= start.date())
+                orders.append(Order.order_date >= start)
+            if end is not None:
+                days.append(SalesDaily.day < end.date())
+                orders.append(Order.order_date < end)
+            if dialect == 'postgresql':
+                db.session.execute(sa.text(
+                    f'LOCK TABLE {SalesDaily.__tablename__} '
+                    f'IN EXCLUSIVE MODE'))
+            db.session.execute(sa.delete(SalesDaily).where(*days))
+            orders.append(Order.id <= (Order.last_id() or 0))
+            total += db.session.scalar(
+                sa.select(sa.func.count(Order.id)).where(*orders))
+            SalesDaily.add_sales(db.session.execute(
+                sa.select(day, OrderItem.product_id,
+                          sa.func.sum(OrderItem.quantity),
+                          sa.func.sum(OrderItem.quantity * OrderItem.price))
+                .join(OrderItem, OrderItem.order_id == Order.id)
+                .where(*orders)
+                .group_by(day, OrderItem.product_id)))
+            db.session.commit()
+            if end is None:
+                return total
+            start = end
+
+    @staticmethod
+    def revenue_by(period: str, start: date | None = None,
+                   end: date | None = None) -> list[tuple[date, int, float]]:
+        """Adds up units and revenue by day, week (starting on Monday) or
+        month, between two days (both included).
+
+        This reads one row per day from the rollup, and groups the days into
+        weeks or months in Python, which works the same on every database.
+
+        Args:
+            period (str): 'day', 'week' or 'month'.
+            start (date | None): The first day, if any.
+            end (date | None): The last day, if any.
+
+        Returns:
+            List[Tuple[date, int, float]]: The first day of each period that
+              had sales, with its units and revenue, in order.
+
+        Raises:
+            ValueError: If the period isn't one of PERIODS.
+        """
+        if period not in SalesDaily.PERIODS:
+            raise ValueError(f'Unknown period: {period!r}')
+        rows = db.session.execute(
+            sa.select(SalesDaily.day, sa.func.sum(SalesDaily.units),
+                      sa.func.sum(SalesDaily.revenue))
+            .where(*SalesDaily._between(start, end))
+            .group_by(SalesDaily.day).order_by(SalesDaily.day))
+        totals = {}
+        for day, units, revenue in rows:
+            if period == 'week':
+                day -= timedelta(days=day.weekday())
+            elif period == 'month':
+                day = day.replace(day=1)
+            previous = totals.get(day, (0, 0))
+            totals[day] = (previous[0] + units, previous[1] + revenue)
+        return [(day, units, round(revenue, 2))
+                for day, (units, revenue) in totals.items()]
+
+    @staticmethod
+    def top_products(n: int = 10, start: date | None = None,
+                     end: date | None = None) -> list[tuple[Product, int,
+                                                           float]]:
+        """Returns the n products with the most revenue between two days
+        (both included).
+
+        Args:
+            n (int): How many products to return.
+            start (date | None): The first day, if any.
+            end (date | None): The last day, if any.
+
+        Returns:
+            List[Tuple[Product, int, float]]: Each product, with its units
+              and revenue, from the most revenue down.
+        """
+        revenue = sa.func.sum(SalesDaily.revenue)
+        rows = db.session.execute(
+            sa.select(SalesDaily.product_id, sa.func.sum(SalesDaily.units),
+                      revenue)
+            .where(*SalesDaily._between(start, end))
+            .group_by(SalesDaily.product_id)
+            .order_by(revenue.desc(), SalesDaily.product_id)
+            .limit(n)).all()
+        products = {product.id: product for product in
+                    Product.get_many([row[0] for row in rows])}
+        return [(products[product_id], units, round(revenue, 2))
+                for product_id, units, revenue in rows
+                if product_id in products]
+
+    @staticmethod
+    def _between(start: date | None, end: date | None) -> list:
+        conditions = []
+        if start is not None:
+            conditions.append(SalesDaily.day >= start)
+        if end is not None:
+            conditions.append(SalesDaily.day <= end)
+        return conditions
+
+    def __repr__(self):
+        return f'<SalesDaily day={self.day} product_id={self.product_id}>'
+
+
+# Errors a transaction gets when it collides with another one and can just
+# be tried again: MySQL deadlocks and lock wait timeouts, PostgreSQL
+# serialization failures and deadlocks, and SQLite's SQLITE_BUSY and
+# SQLITE_LOCKED.
+_MYSQL_LOCK_ERRORS = (1205, 1213)
+_POSTGRESQL_LOCK_ERRORS = ('40001', '40P01')
+_SQLITE_LOCK_ERRORS = (5, 6)
+
+
+def _is_lock_conflict(error: SQLAlchemyError) -> bool:
+    """Returns whether a database error means the transaction collided with
+    another one, so it can be retried."""
+    orig = getattr(error, 'orig', None)
+    if orig is None:
+        return False
+    code = getattr(orig, 'sqlite_errorcode', None)
+    if code is not None:
+        # Extended result codes keep the primary code in the low byte.
+        return code & 0xff in _SQLITE_LOCK_ERRORS
+    state = getattr(orig, 'pgcode', None) or getattr(orig, 'sqlstate', None)
+    if state is not None:
+        return state in _POSTGRESQL_LOCK_ERRORS
+    return bool(orig.args) and orig.args[0] in _MYSQL_LOCK_ERRORS
+
+
+def _upsert(table: sa.Table, rows: list[dict], key_cols, increment_cols):
+    """Inserts rows into a table, or, where a row with the same key is
+    already there, adds to its increment columns instead. It isn't
+    committed.
+
+    MySQL, PostgreSQL and SQLite do it with one INSERT ... ON DUPLICATE KEY
+    UPDATE or ON CONFLICT DO UPDATE statement. Other databases get
+    _update_then_insert.
+
+    Args:
+        table (Table): The table.
+        rows (List[dict]): The rows, in the order to write them in.
+        key_cols (Sequence[str]): The columns of the table's unique key.
+        increment_cols (Sequence[str]): The columns to add to.
+    """
+    if not rows:
+        return
+    dialect = db.session.get_bind(clause=table).dialect.name
+    if dialect == 'mysql':
+        statement = mysql.insert(table).values(rows)
+        statement = statement.on_duplicate_key_update({
+            col: table.c[col] + statement.inserted[col]
+            for col in increment_cols})
+    elif dialect in ('sqlite', 'postgresql'):
+        insert = sqlite.insert if dialect == 'sqlite' else postgresql.insert
+        statement = insert(table).values(rows)
+        statement = statement.on_conflict_do_update(
+            index_elements=list(key_cols),
+            set_={col: table.c[col] + statement.excluded[col]
+                  for col in increment_cols})
+    else:
+        _update_then_insert(table, rows, key_cols, increment_cols)
+        return
+    db.session.execute(statement)
+
+
+def _update_then_insert(table: sa.Table, rows: list[dict], key_cols,
+                        increment_cols):
+    """Does what _upsert does with an UPDATE per row, then one INSERT of the
+    rows that weren't there, for databases without an upsert statement. Two
+    transactions inserting the same new row collide on its key, and one of
+    them fails with an IntegrityError."""
+    missing = []
+    for row in rows:
+        result = db.session.execute(
+            sa.update(table)
+            .where(*(table.c[col] == row[col] for col in key_cols))
+            .values({col: table.c[col] + row[col] for col in increment_cols}))
+        if result.rowcount == 0:
+            missing.append(row)
+    if missing:
+        db.session.execute(sa.insert(table), missing)
+
+
+def _expire_totals(session, cart_ids=None):
+    """Expires the totals of loaded carts (all of them by default), after
+    they were changed by an UPDATE."""
+    for obj in list(session.identity_map.values()):
+        if isinstance(obj, Cart) and (cart_ids is None or obj.id in cart_ids):
+            session.expire(obj, ['item_count', 'subtotal'])
+
+
+@sa.event.listens_for(db.session, 'before_flush')
+def _release_deleted_carts(session, flush_context, instances):
+    """Gives back the stock held for carts being deleted (e.g. with their
+    user), before the carts' rows go."""
+    for obj in session.deleted:
+        if isinstance(obj, Cart) and obj.id is not None:
+            Reservation.release_cart(obj.id)
+
+
+@sa.event.listens_for(db.session, 'after_flush')
+def _reprice_carts(session, flush_context):
+    """Recomputes the totals of carts holding products whose price changed,
+    in the same transaction."""
+    repriced = [obj.id for obj in session.dirty if isinstance(obj, Product)
+                and sa.inspect(obj).attrs.price.history.has_changes()]
+    if repriced:
+        Cart.recompute_totals(
+            Cart.id.in_(sa.select(CartItem.cart_id)
+                        .where(CartItem.product_id.in_(repriced))),
+            session.connection())
+        session.info['repriced_carts'] = True
+
+
+@sa.event.listens_for(db.session, 'after_flush_postexec')
+def _expire_repriced_carts(session, flush_context):
+    if session.info.pop('repriced_carts', False):
+        _expire_totals(session)
@@ -0,0 +1,135 @@
+"""Keyset (cursor) pagination.
+
+Instead of ``OFFSET``, which makes the database read and throw away every
+row before the requested page, keyset pagination remembers the key of the
+last row on a page and asks for the rows after it: ``WHERE id > :after
+ORDER BY id LIMIT :n``. With an index on the key, page 1000 costs the same
+as page 1.
+
+To page through rows sorted by a column that isn't unique (like price), the
+key is the sort column followed by the primary key, e.g. ``(price, id)``,
+and the cursor is that pair of values from the last row on the page.
+
+Example:
+    >>> page = paginate(Product.query, Product.id, after=40, per_page=20)
+    >>> [p.id for p in page.items]
+    [41, 42, ..., 60]
+    >>> page.next_cursor, page.prev_cursor
+    (60, 41)
+    >>> page = paginate(Product.query, (Product.price, Product.id),
+    ...                 after=(19.99, 11), per_page=20)
+    >>> page.next_cursor
+    (29.75, 14)
+"""
+from __future__ import annotations
+import base64
+import binascii
+import json
+from typing import Any, NamedTuple
+
+import sqlalchemy as sa
+
+
+class Page(NamedTuple):
+    """One page of results.
+
+    Attributes:
+        items (List): The rows on the page.
+        prev_cursor (Any): The ``before`` cursor for the previous page, or
+          None if this is the first page.
+        next_cursor (Any): The ``after`` cursor for the next page, or None
+          if this is the last page.
+    """
+    items: list
+    prev_cursor: Any
+    next_cursor: Any
+
+
+def paginate(query, key, after: Any = None, before: Any = None,
+             per_page: int = 20, descending: bool = False) -> Page:
+    """Fetches the page of a query after (or before) a cursor.
+
+    One extra row is fetched to find out whether there's another page in the
+    direction being paged, without counting the rows.
+
+    Args:
+        query (Query): The query to paginate, without an ORDER BY.
+        key (Column | Tuple[Column, ...]): The column, or columns, to sort
+          and page by. Together they must be unique and should be indexed.
+        after (Any): Return the rows whose key comes after this one. For a
+          key of several columns, a tuple of their values.
+        before (Any): Return the rows whose key comes before this one.
+          Ignored if ``after`` is given.
+        per_page (int): The most rows to return.
+        descending (bool): Whether to sort from the largest key down.
+
+    Returns:
+        Page: The rows and the cursors for the pages around them.
+    """
+    columns = key if isinstance(key, tuple) else (key,)
+    backwards = after is None and before is not None
+    cursor = before if backwards else after
+    # Paging backwards is paging forwards in the opposite order, then
+    # flipping the rows back around.
+    reverse = descending != backwards
+    if cursor is not None:
+        values = cursor if isinstance(key, tuple) else (cursor,)
+        query = query.filter(_comes_after(columns, values, reverse))
+    order = [column.desc() if reverse else column.asc() for column in columns]
+    rows = query.order_by(*order).limit(per_page + 1).all()
+    more = len(rows) > per_page
+    items = rows[:per_page]
+    if backwards:
+        items.reverse()
+        has_prev, has_next = more, True
+    else:
+        has_prev, has_next = after is not None, more
+    if not items:
+        return Page([], None, None)
+    return Page(items,
+                _cursor(items[0], key) if has_prev else None,
+                _cursor(items[-1], key) if has_next else None)
+
+
+def _comes_after(columns, values, reverse: bool):
+    """Builds the condition for rows whose key sorts after the given values.
+
+    ``(a, b) > (x, y)`` is written out as ``a > x OR (a = x AND b > y)``,
+    which every database can match against an index on ``(a, b)``.
+    """
+    clauses = []
+    for i, (column, value) in enumerate(zip(columns, values)):
+        equal = [c == v for c, v in zip(columns[:i], values[:i])]
+        clauses.append(sa.and_(*equal, column < value if reverse
+                               else column > value))
+    return sa.or_(*clauses)
+
+
+def _cursor(row, key):
+    if isinstance(key, tuple):
+        return tuple(getattr(row, column.key) for column in key)
+    return getattr(row, key.key)
+
+
+def encode_cursor(cursor: tuple) -> str:
+    """Encodes a cursor of several values for use in a URL."""
+    data = json.dumps(cursor, separators=(',', ':')).encode()
+    return base64.urlsafe_b64encode(data).decode().rstrip('=')
+
+
+def decode_cursor(value: str | None, length: int) -> tuple | None:
+    """Decodes a cursor made by encode_cursor.
+
+    Returns None if the value is missing or isn't a cursor of the expected
+    length, so a mangled URL just starts from the first page.
+    """
+    if not value:
+        return None
+    try:
+        data = base64.urlsafe_b64decode(value + '=' * (-len(value) % 4))
+        cursor = json.loads(data)
+    except (binascii.Error, ValueError):
+        return None
+    if not isinstance(cursor, list) or len(cursor) != length:
+        return None
+    return tuple(cursor)
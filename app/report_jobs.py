@@ -0,0 +1,193 @@
+"""Background jobs for heavy admin reports.
+
+Building a big report ties up a WSGI worker for as long as the query and
+the CSV writing take. Instead, a report can be handed to a small thread
+pool, which writes it to a gzip-compressed file on disk, while the admin
+polls the job's status and downloads the file once it's done.
+
+Each job is identified by the report's name and parameters, which include
+the id of the last order it covers, so asking for the same report again
+gets the same job, and once it's done the same file, until new orders
+arrive. Files are kept in REPORT_JOB_DIR for REPORT_JOB_MAX_AGE seconds,
+so a finished report can be downloaded from any worker on the host. Any
+report file there is sent to admins, so the directory must belong to this
+user and no one else may write to it. Jobs that are still running are only
+known to the process running them.
+
+Example:
+    >>> job = report_jobs().submit('sales_report', {'since_id': 1041},
+    ...                            lambda: Order.stream_csv(conditions=...))
+    >>> job.status
+    'pending'
+    >>> report_jobs().get(job.id).status
+    'done'
+"""
+from __future__ import annotations
+import gzip
+import hashlib
+import json
+import os
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from typing import Callable, Iterable
+
+from flask import current_app
+
+from .utils import private_directory
+
+
+class Job:
+    """A report being written in the background.
+
+    Attributes:
+        id (str): Identifies the report and its parameters.
+        path (str): Where the gzip-compressed report is written.
+        status (str): 'pending', 'running', 'done' or 'failed'.
+        error (str | None): Why the job failed, if it did.
+        future (Future | None): The job's future, if this process runs it.
+    """
+
+    def __init__(self, job_id: str, path: str, status: str = 'pending'):
+        self.id = job_id
+        self.path = path
+        self.status = status
+        self.error = None
+        self.future: Future | None = None
+
+
+class ReportJobs:
+    """Runs report jobs in a thread pool and keeps track of them.
+
+    Methods:
+        submit: Starts a job for a report, unless there already is one.
+        get: Looks a job up by its id.
+    """
+
+    def __init__(self, app, directory: str, workers: int = 2,
+                 max_age: float = 86400):
+        self.app = app
+        self.max_age = max_age
+        self._directory = directory
+        self._checked = False
+        self._executor = ThreadPoolExecutor(
+            max_workers=workers, thread_name_prefix='report-job')
+        self._jobs: dict[str, Job] = {}
+        self._lock = threading.Lock()
+
+    @property
+    def directory(self) -> str:
+        """The directory report files are written to, created (or checked)
+        the first time it's needed rather than whenever an app is created.
+
+        Raises:
+            RuntimeError: If it belongs to another user, or other users can
+              write to it.
+        """
+        if not self._checked:
+            private_directory(self._directory)
+            self._checked = True
+        return self._directory
+
+    def _path(self, job_id: str) -> str:
+        return os.path.join(self.directory, f'{job_id}.csv.gz')
+
+    def submit(self, name: str, params: dict,
+               generate: Callable[[], Iterable[str]]) -> Job:
+        """Starts a job that writes a report, unless there's already a job
+        (or a finished file) for the same report and parameters.
+
+        Args:
+            name (str): The report's name.
+            params (dict): The report's parameters. They must be JSON
+              serializable, and should include whatever changes when the
+              report would, like the id of the last order it covers.
+            generate (Callable[[], Iterable[str]]): Called in an app context
+              on a worker thread, returns the report a chunk at a time.
+
+        Returns:
+            Job: The job.
+        """
+        key = json.dumps([name, params], sort_keys=True, default=str)
+        job_id = f'{name}-{hashlib.sha1(key.encode()).hexdigest()[:20]}'
+        with self._lock:
+            job = self._jobs.get(job_id)
+            if job is not None and job.status != 'failed':
+                return job
+            path = self._path(job_id)
+            if os.path.exists(path):
+                job = self._jobs[job_id] = Job(job_id, path, 'done')
+                return job
+            self._prune()
+            job = self._jobs[job_id] = Job(job_id, path)
+            job.future = self._executor.submit(self._run, job, generate)
+            return job
+
+    def get(self, job_id: str) -> Job | None:
+        """Looks a job up by its id.
+
+        A job started by another process is found once its file is written.
+
+        Returns:
+            Job | None: The job, or None if there isn't one.
+        """
+        with self._lock:
+            job = self._jobs.get(job_id)
+        if job is not None:
+            return job
+        path = self._path(os.path.basename(job_id))
+        return Job(job_id, path, 'done') if os.path.exists(path) else None
+
+    def _run(self, job: Job, generate: Callable[[], Iterable[str]]):
+        job.status = 'running'
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with self.app.app_context(), os.fdopen(fd, 'wb') as raw, \
+                    gzip.open(raw, 'wt', encoding='utf-8',
+                              newline='') as file:
+                for chunk in generate():
+                    file.write(chunk)
+            # Only a complete file is ever seen under the job's name.
+            os.replace(temp, job.path)
+        except Exception as e:
+            _unlink(temp)
+            job.error = str(e)
+            job.status = 'failed'
+            self.app.logger.exception('Report job %s failed', job.id)
+            return
+        job.status = 'done'
+
+    def _prune(self):
+        """Deletes files older than max_age, and forgets their jobs."""
+        cutoff = time.time() - self.max_age
+        for entry in os.scandir(self.directory):
+            try:
+                if entry.is_file() and entry.stat().st_mtime < cutoff:
+                    _unlink(entry.path)
+            except OSError:
+                pass
+        for job_id, job in list(self._jobs.items()):
+            if job.status == 'done' and not os.path.exists(job.path):
+                del self._jobs[job_id]
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def init_report_jobs(app):
+    """Attaches a report job runner, writing to REPORT_JOB_DIR (or
+    instance/report-jobs), to the app."""
+    app.extensions['report_jobs'] = ReportJobs(
+        app, app.config['REPORT_JOB_DIR'] or
+        os.path.join(app.instance_path, 'report-jobs'),
+        app.config['REPORT_JOB_WORKERS'], app.config['REPORT_JOB_MAX_AGE'])
+
+
+def report_jobs() -> ReportJobs:
+    """Returns the current app's report job runner."""
+    return current_app.extensions['report_jobs']
@@ -0,0 +1,335 @@
+"""A full-page response cache for visitors who aren't logged in.
+
+Most catalog, search and product page views come from anonymous visitors,
+who all see the same page for the same URL. Their responses are cached,
+keyed by path and normalized query string, and served without running the
+view or rendering a template. Logged in users always get a freshly rendered
+page, as does anyone with a message waiting to be flashed or something in
+their session cart (the nav shows how many items it holds).
+
+Entries are stored in a pluggable backend: ``memory`` (an LRU cache in this
+process) or ``filesystem`` (a private directory that every WSGI worker on
+the host can share). Each entry is tagged with the data it was built from, e.g.
+``products`` or ``product:42``, and remembers the version of each of its
+tags when it was stored. A commit that changes products gives their tags
+new versions, so every entry built from them is a miss from then on, in
+every worker sharing the backend.
+
+Example:
+    >>> @app.route('/items_page/<int:prod_id>')
+    ... @cached_response(lambda prod_id: ['product:%d' % prod_id])
+    ... def items_page(prod_id):
+    ...     ...
+"""
+from __future__ import annotations
+import hashlib
+import json
+import os
+import tempfile
+import time
+import uuid
+from functools import wraps
+from typing import NamedTuple
+from urllib.parse import urlencode
+
+from flask import current_app, make_response, request, session
+from flask_login import current_user
+from flask_wtf.csrf import generate_csrf
+
+from .cache import LRUCache
+from .signals import products_changed
+from .utils import private_directory
+
+# Stands in for the visitor's CSRF token in cached pages.
+_CSRF_PLACEHOLDER = b'__response_cache_csrf_token__'
+
+
+class CachedResponse(NamedTuple):
+    """A response stored in the cache.
+
+    Attributes:
+        status (int): The status code.
+        headers (List[Tuple[str, str]]): The response headers.
+        body (bytes): The response body.
+        tags (Dict[str, str]): The version of each tag when it was stored.
+        expires (float): When the entry expires, as a Unix timestamp.
+    """
+    status: int
+    headers: list
+    body: bytes
+    tags: dict
+    expires: float
+
+
+class MemoryBackend:
+    """Stores responses in an LRU cache in this process."""
+
+    def __init__(self, maxsize: int = 512):
+        self._entries = LRUCache(maxsize)
+        # Kept apart from the entries so a tag's version is never evicted.
+        self._tags: dict[str, str] = {}
+
+    def get(self, key: str) -> CachedResponse | None:
+        return self._entries.get(key)
+
+    def set(self, key: str, entry: CachedResponse):
+        self._entries.set(key, entry)
+
+    def tag_versions(self, tags) -> dict[str, str | None]:
+        return {tag: self._tags.get(tag) for tag in tags}
+
+    def bump_tags(self, tags):
+        for tag in tags:
+            self._tags[tag] = uuid.uuid4().hex
+
+    def clear(self):
+        self._entries.clear()
+        self._tags.clear()
+
+
+class FileSystemBackend:
+    """Stores responses as files in a directory, so they can be shared by
+    every worker process on the host.
+
+    Each file holds a line of JSON with the entry's status, headers, tags
+    and expiry, followed by the body as it is, so reading an entry never
+    runs code. The directory must belong to this user, and no one else may
+    write to it. Files are written to a temporary name and then renamed into
+    place, so a reader never sees half a file. Once there are more than
+    maxsize entries, expired entries and then the ones expiring soonest are
+    deleted, going by the files' modification times.
+    """
+
+    def __init__(self, directory: str, maxsize: int = 512):
+        self.directory = private_directory(directory)
+        self.maxsize = maxsize
+        self._tags_directory = private_directory(
+            os.path.join(directory, 'tags'))
+
+    def _path(self, directory: str, key: str) -> str:
+        return os.path.join(directory, hashlib.sha1(key.encode()).hexdigest())
+
+    def _write(self, path: str, data: bytes, expires: float | None = None):
+        fd, temp = tempfile.mkstemp(dir=self.directory, suffix='.tmp')
+        try:
+            with os.fdopen(fd, 'wb') as file:
+                file.write(data)
+            if expires is not None:
+                os.utime(temp, (expires, expires))
+            os.replace(temp, path)
+        except BaseException:
+            os.unlink(temp)
+            raise
+
+    def get(self, key: str) -> CachedResponse | None:
+        return _read_entry(self._path(self.directory, key))
+
+    def set(self, key: str, entry: CachedResponse):
+        header = json.dumps({'status': entry.status,
+                             'headers': entry.headers, 'tags': entry.tags,
+                             'expires': entry.expires})
+        self._write(self._path(self.directory, key),
+                    header.encode() + b'\n' + entry.body, entry.expires)
+        self._prune()
+
+    def _entries(self) -> list[os.DirEntry]:
+        return [entry for entry in os.scandir(self.directory)
+                if entry.is_file() and not entry.name.endswith('.tmp')]
+
+    def _entry_paths(self) -> list[str]:
+        return [entry.path for entry in self._entries()]
+
+    def _prune(self):
+        """Deletes expired entries, then those expiring soonest, once there
+        are more than maxsize. Each file's modification time is set to when
+        it expires, so only the directory is read, never the files. A tenth
+        of maxsize is freed at once, so this doesn't run on every set."""
+        entries = self._entries()
+        if len(entries) <= self.maxsize:
+            return
+        now = time.time()
+        expiries = []
+        for entry in entries:
+            try:
+                expires = entry.stat().st_mtime
+            except OSError:
+                continue
+            if expires <= now:
+                _unlink(entry.path)
+            else:
+                expiries.append((expires, entry.path))
+        expiries.sort()
+        keep = self.maxsize - self.maxsize // 10
+        for _, path in expiries[:max(0, len(expiries) - keep)]:
+            _unlink(path)
+
+    def tag_versions(self, tags) -> dict[str, str | None]:
+        versions = {}
+        for tag in tags:
+            try:
+                with open(self._path(self._tags_directory, tag)) as file:
+                    versions[tag] = file.read()
+            except OSError:
+                versions[tag] = None
+        return versions
+
+    def bump_tags(self, tags):
+        for tag in tags:
+            self._write(self._path(self._tags_directory, tag),
+                        uuid.uuid4().hex.encode())
+
+    def clear(self):
+        for path in self._entry_paths():
+            _unlink(path)
+
+
+def _read_entry(path: str) -> CachedResponse | None:
+    """Reads an entry written by FileSystemBackend.set, or returns None if
+    there's no such file or it can't be read."""
+    try:
+        with open(path, 'rb') as file:
+            header, _, body = file.read().partition(b'\n')
+        fields = json.loads(header)
+        return CachedResponse(
+            fields['status'], [tuple(pair) for pair in fields['headers']],
+            body, fields['tags'], fields['expires'])
+    except (OSError, ValueError, KeyError, TypeError):
+        return None
+
+
+def _unlink(path: str):
+    try:
+        os.unlink(path)
+    except FileNotFoundError:
+        pass
+
+
+def init_response_cache(app):
+    """Attaches the response cache backend chosen by RESPONSE_CACHE_BACKEND
+    to the app, unless it's None."""
+    backend = app.config['RESPONSE_CACHE_BACKEND']
+    size = app.config['RESPONSE_CACHE_SIZE']
+    if backend is None:
+        return
+    if backend == 'memory':
+        app.extensions['response_cache'] = MemoryBackend(size)
+    elif backend == 'filesystem':
+        app.extensions['response_cache'] = FileSystemBackend(
+            app.config['RESPONSE_CACHE_DIR'] or
+            os.path.join(app.instance_path, 'response-cache'), size)
+    else:
+        raise ValueError(f'Unknown RESPONSE_CACHE_BACKEND: {backend!r}')
+
+
+def response_cache():
+    """Returns the current app's response cache backend, or None if the
+    response cache is disabled."""
+    return current_app.extensions.get('response_cache')
+
+
+def cache_key() -> str:
+    """Returns the cache key for the current request: its path and query
+    string, with the arguments sorted and empty ones dropped."""
+    args = sorted((key, value) for key, value in request.args.items(multi=True)
+                  if value)
+    return f'{request.path}?{urlencode(args)}'
+
+
+def _cacheable() -> bool:
+    return (request.method in ('GET', 'HEAD') and
+            not current_user.is_authenticated and
+            not session.get('_flashes') and
+            not session.get('cart'))
+
+
+def _csrf_token() -> str | None:
+    """Returns the visitor's CSRF token, if CSRF protection is set up."""
+    if 'csrf' not in current_app.extensions:
+        return None
+    return generate_csrf()
+
+
+def _private(response):
+    response.cache_control.public = False
+    response.cache_control.max_age = None
+    response.cache_control.private = True
+    response.cache_control.no_cache = True
+    return response
+
+
+def cached_response(tags_of):
+    """Decorator for views whose responses to anonymous visitors can be
+    cached.
+
+    Pages carry the visitor's CSRF token (see base.html), so it's replaced
+    with a placeholder in the cached copy, and the placeholder with the
+    next visitor's own token when the copy is served.
+
+    Args:
+        tags_of (Callable[..., List[str]]): Called with the view's keyword
+          arguments, returns the tags of the data the page is built from.
+
+    Returns:
+        Callable: The decorator.
+    """
+    def decorator(view):
+        @wraps(view)
+        def wrapped(*args, **kwargs):
+            backend = response_cache()
+            if backend is None or not _cacheable():
+                response = make_response(view(*args, **kwargs))
+                return response if backend is None else _private(response)
+
+            # Making a token for a new visitor writes to the session, which
+            # shouldn't stop the page being cached.
+            token = _csrf_token()
+            new_token, session.modified = session.modified, False
+            key = cache_key()
+            tags = backend.tag_versions(tags_of(**kwargs))
+            entry = backend.get(key)
+            if entry is not None and entry.expires > time.time() and \
+                    entry.tags == tags:
+                body = entry.body
+                if token is not None:
+                    body = body.replace(_CSRF_PLACEHOLDER, token.encode())
+                response = current_app.response_class(
+                    body, entry.status, entry.headers)
+                response.headers['X-Cache'] = 'HIT'
+                session.modified = new_token
+                # A page that comes with a new session cookie is this
+                # visitor's alone.
+                return _private(response) if new_token else response
+
+            response = make_response(view(*args, **kwargs))
+            # Anything else that wrote to the session is particular to this
+            # visitor.
+            if response.status_code != 200 or session.modified or \
+                    'Set-Cookie' in response.headers:
+                session.modified = session.modified or new_token
+                return _private(response)
+            session.modified = new_token
+            response.cache_control.public = True
+            response.cache_control.max_age = \
+                current_app.config['RESPONSE_CACHE_MAX_AGE']
+            body = response.get_data()
+            if token is not None:
+                body = body.replace(token.encode(), _CSRF_PLACEHOLDER)
+            timeout = current_app.config['RESPONSE_CACHE_TIMEOUT']
+            backend.set(key, CachedResponse(
+                response.status_code,
+                [(name, value) for name, value in response.headers.items()
+                 if name != 'Content-Length'],
+                body, tags, time.time() + timeout))
+            response.headers['X-Cache'] = 'MISS'
+            return _private(response) if new_token else response
+        return wrapped
+    return decorator
+
+
+@products_changed.connect
+def _invalidate_products(app, changes):
+    """Gives the tags of products changed by a commit new versions."""
+    backend = app.extensions.get('response_cache')
+    if backend is not None:
+        backend.bump_tags(['products'] +
+                          [f'product:{product_id}' for product_id in changes])
@@ -1,30 +1,164 @@
+import os
+import uuid
 from urllib.parse import urlsplit
 
-from flask import Response, render_template, flash, redirect, session, url_for, request
+from flask import Response, abort, current_app, jsonify, make_response, render_template, flash, redirect, send_file, session, stream_with_context, url_for, request
 from flask_login import current_user, login_required, login_user, logout_user
+from flask_wtf.csrf import generate_csrf
+from markupsafe import Markup
 import sqlalchemy as sa
+from sqlalchemy.exc import SQLAlchemyError
 
 from .forms import CheckoutForm, DeleteUserForm, LoginForm, RegistrationForm, \
     UpdateProfileForm
 from .extensions import db
-from .models import Order, Product, User, Cart, CartItem
+from .analytics import sales_analytics
+from .cache import cached_product, fragment_cache, product_cache
+from .catalog import SORTS, CatalogFilters, catalog_snapshot
+from .conditional import conditional, product_versions
+from .report_jobs import report_jobs
+from .response_cache import cached_response
+from .models import Order, Product, Reservation, SalesDaily, User, Cart, \
+    CartItem
+from .search import search_index
+from .session_cart import SessionCart, SessionCartItem
+from .suggest import suggestions
 from .utils import admin_required
 
-from datetime import datetime
+from datetime import date, datetime, timedelta
+
+def cart_line(item) -> dict:
+    """Returns a cart item (or session cart item) as JSON-friendly values."""
+    return {'id': item.id, 'product_id': item.product.id,
+            'name': item.product.name, 'price': item.product.price,
+            'quantity': item.quantity,
+            'total': round(item.quantity * item.product.price, 2)}
+
+
+def cart_state(cart) -> dict:
+    """Returns a cart's items and totals as JSON-friendly values."""
+    return {'items': [cart_line(item) for item in cart.items],
+            'item_count': cart.item_count,
+            'subtotal': round(cart.subtotal, 2)}
+
+
+def cart_change(cart, item=None) -> dict:
+    """Returns the item a cart API call changed (None if it was removed)
+    and the cart's new totals, as JSON-friendly values."""
+    return {'line': cart_line(item) if item is not None else None,
+            'item_count': cart.item_count,
+            'subtotal': round(cart.subtotal, 2)}
+
+
+def api_error(message: str, status: int):
+    """Returns a JSON error response."""
+    return make_response(jsonify({'error': message}), status)
+
+
+def json_quantity(minimum: int) -> int | None:
+    """Returns the quantity in a JSON request body, or None if it's missing,
+    not a whole number, or less than minimum."""
+    data = request.get_json(silent=True) or {}
+    quantity = data.get('quantity', 1 if minimum > 0 else None)
+    if isinstance(quantity, bool) or not isinstance(quantity, int) or \
+            quantity < minimum:
+        return None
+    return quantity
+
+
+def sales_report_query():
+    """Returns the conditions picking the orders for the sales report asked
+    for by the query string (see sales_report), and the id of the last of
+    them. Orders placed after this are left for the next report.
+
+    Order ids are given out before orders are committed, so an order can
+    commit after one with a greater id. The report only goes up to the last
+    order placed SALES_REPORT_CURSOR_LAG seconds ago, by which time every
+    order with a smaller id has been committed (or rolled back), so
+    resuming from its id never skips one.
+
+    Raises:
+        ValueError: If a date or since_id isn't valid.
+    """
+    start, end = (report_date(request.args.get(name))
+                  for name in ('from', 'to'))
+    since_id = request.args.get('since_id', type=int)
+    if request.args.get('since_id') and since_id is None:
+        raise ValueError('since_id must be a number.')
+    conditions = Order.report_conditions(start, end, since_id)
+    settled = datetime.now() - timedelta(
+        seconds=current_app.config['SALES_REPORT_CURSOR_LAG'])
+    last_id = Order.last_id(conditions + [Order.order_date <= settled])
+    cursor = last_id if last_id is not None else since_id or 0
+    return conditions + [Order.id <= cursor], cursor
+
+
+def report_job_status(job) -> dict:
+    """Returns a report job's status as JSON-friendly values."""
+    status = {'id': job.id, 'status': job.status,
+              'status_url': url_for('report_job', job_id=job.id)}
+    if job.status == 'done':
+        status['download_url'] = url_for('report_job_download',
+                                         job_id=job.id)
+    if job.error:
+        status['error'] = job.error
+    return status
+
+
+def report_date(value: str | None) -> date | None:
+    """Parses a YYYY-MM-DD date from the query string, if there is one.
+
+    Raises:
+        ValueError: If the date isn't valid.
+    """
+    return date.fromisoformat(value) if value else None
+
+
+def order_placed(order):
+    """Shows the order success page for an order."""
+    session['order_number'] = order.id
+    session['order_date'] = order.order_date
+    flash('Order placed successfully.')
+    return redirect(url_for('order_success'))
+
+
+def product_page(filters, query=None):
+    """Returns the page of products requested by the ``after``/``before``
+    cursors and ``per_page`` in the query string."""
+    per_page = request.args.get('per_page', type=int) or \
+        current_app.config['PRODUCTS_PER_PAGE']
+    per_page = max(1, min(per_page, current_app.config['MAX_PRODUCTS_PER_PAGE']))
+    return filters.paginate(query if query is not None else Product.query,
+                            after=request.args.get('after'),
+                            before=request.args.get('before'),
+                            per_page=per_page)
+
+
+def page_args():
+    """Returns the query string arguments to carry over to the next or
+    previous page."""
+    return {key: value for key, value in request.args.items()
+            if key not in ('after', 'before')}
+
 
 def init_routes(app):
     @app.route('/')
     @app.route('/index')
     def index():
-        # featured products on homepage (3 ids, hardcoded for demonstration)
-        # only three please!
-        featured_ids = [34, 42, 13]
-
-        featured_products = []
-        for product_id in featured_ids:
-            featured_products.append(Product.query.get_or_404(product_id))
-
-        return render_template('index.html', title='Home', featured=featured_products)
+        # featured products on homepage (see FEATURED_PRODUCT_IDS)
+        # The rendered list is cached, so a warm home page needs no queries.
+        featured_html = fragment_cache().get('featured')
+        if featured_html is None:
+            featured_ids = current_app.config['FEATURED_PRODUCT_IDS']
+            featured_html = render_template(
+                '_featured_products.html',
+                featured=Product.get_many(featured_ids))
+            fragment_cache().set('featured', featured_html,
+                                 current_app.config['FRAGMENT_CACHE_TTL'],
+                                 product_ids=featured_ids)
+
+        return render_template('index.html', title='Home',
+                               featured_html=Markup(featured_html))
 
     @app.route('/login', methods = ['GET', 'POST'])
     def login():
@@ -96,65 +230,134 @@ def init_routes(app):
 
     # test the db
     @app.route('/catalog')
+    @conditional(lambda: product_versions().catalog())
+    @cached_response(lambda: ['products'])
     def catalog():
 
-        results = Product.query.all()
+        filters = CatalogFilters.from_args(request.args)
+        page = product_page(filters)
+        facets = catalog_snapshot().price_facets(filters.in_stock)
 
-        return render_template('search_results.html', title="Products Catalog", results=results)
+        return render_template('search_results.html', title="Products Catalog",
+                               results=page.items, page=page,
+                               page_args=page_args(), filters=filters,
+                               facets=facets, sorts=SORTS)
     
    
     
     @app.route('/search', methods=['GET', 'POST'])
+    @conditional(lambda: product_versions().catalog())
+    @cached_response(lambda: ['products'])
     def search():
 
         search_term = request.args.get('query', '')
+        filters = CatalogFilters.from_args(request.args)
+        fuzzy = False
+        page = None
 
         if search_term:
+            index = search_index()
+            matches = index.search(search_term)
+            if not matches:
+                # Nothing matched exactly, maybe there's a typo.
+                matches = index.search(search_term, fuzzy=True)
+                fuzzy = bool(matches)
+            facets = catalog_snapshot().price_facets(filters.in_stock, matches)
+            if filters.sort:
+                page = product_page(filters, Product.query.filter(
+                    Product.id.in_(matches)))
+                results = page.items
+            else:
+                # Only the most relevant matches, so a common word like
+                # "wireless" doesn't render the whole catalog.
+                snapshot = catalog_snapshot()
+
+                def passes_filters(product_id):
+                    row = snapshot.row(product_id)
+                    return row is not None and filters.matches(*row)
 
-            results = Product.search(search_term)
+                product_ids, _ = index.top_k(
+                    search_term, current_app.config['SEARCH_RESULTS_LIMIT'],
+                    fuzzy=fuzzy, where=passes_filters)
+                results = Product.get_many(product_ids)
 
         else:
-            results = Product.query.all()
+            page = product_page(filters)
+            results = page.items
+            facets = catalog_snapshot().price_facets(filters.in_stock)
 
         return render_template('search_results.html', title=f'"{search_term}" Search Results',
                                results=results,
-                               search_term=search_term)
+                               search_term=search_term,
+                               fuzzy=fuzzy,
+                               page=page,
+                               page_args=page_args(),
+                               filters=filters,
+                               facets=facets,
+                               sorts=SORTS)
+
+    @app.route('/search/suggest')
+    def search_suggest():
+        """Product name completions for the search box, as JSON.
+
+        This is called on every keystroke, so it's answered from the
+        in-memory autocomplete index without touching the database.
+        """
+        prefix = request.args.get('q', '')
+        limit = request.args.get('limit', type=int)
+        if limit is not None:
+            # At least one, and at most SUGGEST_LIMIT (see PrefixIndex).
+            limit = max(1, limit)
+        return jsonify(query=prefix, suggestions=[
+            {'id': product_id, 'name': name,
+             'url': url_for('items_page', prod_id=product_id)}
+            for product_id, name in suggestions().suggest(prefix, limit)])
 
     @app.route('/items_page/<int:prod_id>')
+    @conditional(lambda prod_id: product_versions().product(prod_id))
+    @cached_response(lambda prod_id: [f'product:{prod_id}'])
     def items_page(prod_id):
 
-        product = Product.query.get_or_404(prod_id)
+        product = cached_product(prod_id)
 
         return render_template('items_page.html', title=product.name, results=product)
 
     @app.route('/cart')
-    @login_required
     def cart():
-        cart = None  
         if current_user.is_authenticated:
-           
-            user_id = current_user.id   
-            cart = Cart.query.filter_by(user_id=user_id).first_or_404()
-            
-        if not cart:
-            cart = Cart()  
-            cart.items = [] 
+            cart = Cart.get_for_user(current_user.id)
+            if cart is None:
+                abort(404)
+        else:
+            # Visitors who aren't logged in have a cart in their session.
+            cart = SessionCart()
         return render_template('cart.html', title='Cart', cart=cart)   
       
     
     @app.route('/add_to_cart/<int:product_id>', methods=['POST'])
     def add_to_cart(product_id):
-        quantity = int(request.form['quantity'])
-        user_id = current_user.id  
+        try:
+            quantity = int(request.form['quantity'])
+        except ValueError:
+            abort(400)
+        if quantity < 1:
+            flash('Enter a quantity of 1 or more.')
+            return redirect(url_for('cart'))
+        if not current_user.is_authenticated:
+            cached_product(product_id)  # 404 if there's no such product.
+            try:
+                SessionCart().add_product(product_id, quantity)
+            except ValueError as e:
+                flash(str(e))
+            else:
+                flash('Product added to cart successfully!')
+            return redirect(url_for('cart'))
+        user_id = current_user.id
 
-       
         cart = Cart.query.filter_by(user_id=user_id).first()
         if not cart:
-            user = User.query.get(user_id)
-            cart = Cart(user=user)
-            db.session.add(cart)
+            cart = Cart(user_id=user_id)
 
-    
         cart.add_product(product_id, quantity)
         db.session.commit()
         flash('Product added to cart successfully!')
@@ -162,7 +365,11 @@ def init_routes(app):
   
     @app.route('/remove_from_cart/<int:product_id>', methods=['POST'])
     def remove_from_cart(product_id):
-        user_id = current_user.id  
+        if not current_user.is_authenticated:
+            SessionCart().remove_product(product_id)
+            flash('Product removed from cart successfully!')
+            return redirect(url_for('cart'))
+        user_id = current_user.id
         cart = Cart.query.filter_by(user_id=user_id).first()
         if cart:
             cart.remove_product(product_id)
@@ -176,16 +383,145 @@ def init_routes(app):
     @app.route('/update_cart_item/<int:item_id>', methods=['POST'])
     def update_cart_item(item_id):
         quantity = int(request.form['quantity'])
+        if not current_user.is_authenticated:
+            # Session cart items are identified by their product id.
+            SessionCart().update_quantity(item_id, quantity)
+            flash('Quantity updated successfully!' if quantity > 0
+                  else 'Item removed from the cart!')
+            return redirect(url_for('cart'))
         cart_item = CartItem.query.get_or_404(item_id)
+        cart_item.update_quantity(quantity)
         if quantity > 0:
-            cart_item.update_quantity(quantity)
             flash('Quantity updated successfully!')
         else:
-            db.session.delete(cart_item)
-            db.session.commit()
             flash('Item removed from the cart!')
         return redirect(url_for('cart'))
 
+    @app.route('/update_cart', methods=['POST'])
+    def update_cart():
+        """Sets the quantities of several cart items at once, in one
+        transaction.
+
+        Takes quantity-<item id> form fields, and redirects to the cart, or a
+        JSON body of the form {"quantities": {"<item id>": quantity}}, in
+        which case the updated cart is returned as JSON. Items set to 0 are
+        removed.
+        """
+        try:
+            if request.is_json:
+                fields = (request.get_json().get('quantities') or {}).items()
+            else:
+                fields = ((name.removeprefix('quantity-'), value)
+                          for name, value in request.form.items()
+                          if name.startswith('quantity-'))
+            quantities = {int(item_id): int(quantity)
+                          for item_id, quantity in fields}
+        except (AttributeError, TypeError, ValueError):
+            abort(400)
+
+        if current_user.is_authenticated:
+            cart = Cart.query.filter_by(user_id=current_user.id).first_or_404()
+        else:
+            # Session cart items are identified by their product id.
+            cart = SessionCart()
+        try:
+            cart.update_quantities(quantities)
+        except ValueError:
+            abort(404)
+        db.session.commit()
+
+        if request.is_json:
+            if current_user.is_authenticated:
+                cart = Cart.get_for_user(current_user.id)
+            return jsonify(cart_state(cart))
+        flash('Cart updated successfully!')
+        return redirect(url_for('cart'))
+
+    @app.route('/api/csrf_token')
+    def api_csrf_token():
+        """Returns a fresh CSRF token for the visitor's session as JSON, for
+        pages that have been open longer than WTF_CSRF_TIME_LIMIT."""
+        response = jsonify(csrf_token=generate_csrf())
+        response.cache_control.no_store = True
+        return response
+
+    @app.route('/api/cart')
+    def api_cart():
+        """Returns the visitor's cart as JSON."""
+        if not current_user.is_authenticated:
+            return jsonify(cart_state(SessionCart()))
+        cart = Cart.get_for_user(current_user.id)
+        if cart is None:
+            return jsonify(items=[], item_count=0, subtotal=0)
+        return jsonify(cart_state(cart))
+
+    @app.route('/api/cart/items', methods=['POST'])
+    def api_cart_add():
+        """Adds {"product_id": id, "quantity": n} to the visitor's cart and
+        returns the changed line and the new totals as JSON."""
+        data = request.get_json(silent=True) or {}
+        product_id = data.get('product_id')
+        quantity = json_quantity(minimum=1)
+        if not isinstance(product_id, int) or quantity is None:
+            return api_error('A product_id and a positive quantity are '
+                             'required.', 400)
+        product = db.session.get(Product, product_id)
+        if product is None:
+            return api_error('No such product.', 404)
+
+        if not current_user.is_authenticated:
+            cart = SessionCart()
+            try:
+                cart.add_product(product_id, quantity)
+            except ValueError as e:
+                return api_error(str(e), 400)
+            return jsonify(cart_change(cart, SessionCartItem(
+                product.id, product, cart.quantities[product_id])))
+
+        cart = Cart.query.filter_by(user_id=current_user.id).first() or \
+            Cart(user_id=current_user.id)
+        cart.add_product(product_id, quantity)
+        db.session.commit()
+        item = CartItem.query.filter_by(cart_id=cart.id,
+                                        product_id=product_id).one()
+        return jsonify(cart_change(cart, item))
+
+    @app.route('/api/cart/items/<int:item_id>', methods=['PATCH', 'DELETE'])
+    def api_cart_item(item_id):
+        """Sets the quantity of an item in the visitor's cart, from
+        {"quantity": n} (0 removes it), or removes it (DELETE). Returns the
+        changed line and the new totals as JSON.
+
+        In a session cart, items are identified by their product id.
+        """
+        if request.method == 'DELETE':
+            quantity = 0
+        else:
+            quantity = json_quantity(minimum=0)
+            if quantity is None:
+                return api_error('A quantity of 0 or more is required.', 400)
+
+        if not current_user.is_authenticated:
+            cart = SessionCart()
+            try:
+                cart.update_quantities({item_id: quantity})
+            except ValueError:
+                return api_error('No such item in your cart.', 404)
+            item = next((item for item in cart.items if item.id == item_id),
+                        None)
+            return jsonify(cart_change(cart, item))
+
+        cart = Cart.query.filter_by(user_id=current_user.id).first()
+        try:
+            if cart is None:
+                raise ValueError
+            cart.update_quantities({item_id: quantity})
+        except ValueError:
+            return api_error('No such item in your cart.', 404)
+        db.session.commit()
+        item = db.session.get(CartItem, item_id) if quantity > 0 else None
+        return jsonify(cart_change(cart, item))
+
     @app.route('/profile', methods=['GET', 'POST'])
     @login_required
     def profile():
@@ -219,39 +555,178 @@ def init_routes(app):
             db.session.commit()
             flash('User has been deleted.')
             return redirect(url_for('admin'))
+        cache = product_cache()
         return render_template('admin.html',
-                               title='Admin Dashboard', form=form)
+                               title='Admin Dashboard', form=form,
+                               cache_stats=cache.stats() if cache else None)
 
     @app.route('/admin/sales_report')
     @admin_required
     @login_required
     def sales_report():
-        """Returns a CSV file for all orders."""
-        data = Order.get_all_orders_in_csv_format()
-        return Response(data, mimetype='text/csv',
+        """Returns a CSV file for all orders, streamed as it's read.
+
+        The orders can be narrowed down to those placed ``from`` and ``to``
+        given days (YYYY-MM-DD, both included), and to those placed after
+        the one with id ``since_id``. The X-Resume-Cursor header has the id
+        of the last order in the report, to pass as since_id next time.
+        Orders placed in the last SALES_REPORT_CURSOR_LAG seconds are left
+        for the next report (see sales_report_query).
+        """
+        try:
+            conditions, cursor = sales_report_query()
+        except ValueError:
+            abort(400)
+        data = Order.stream_csv(current_app.config['SALES_REPORT_BATCH_SIZE'],
+                                conditions)
+        return Response(stream_with_context(data), mimetype='text/csv',
                         headers={'Content-Disposition':
-                                 'attachment; filename=orders.csv'})
+                                 'attachment; filename=orders.csv',
+                                 'X-Resume-Cursor': str(cursor)})
 
+    @app.route('/admin/report_jobs/sales_report', methods=['POST'])
+    @admin_required
+    @login_required
+    def sales_report_job():
+        """Starts writing the sales report, with the same query string as
+        /admin/sales_report, in the background, and returns the job's
+        status as JSON. The same report is only written once until new
+        orders are placed."""
+        try:
+            conditions, cursor = sales_report_query()
+        except ValueError:
+            return api_error('from and to must be YYYY-MM-DD dates, and '
+                             'since_id a number.', 400)
+        params = {name: request.args.get(name) or None
+                  for name in ('from', 'to', 'since_id')}
+        params['cursor'] = cursor
+        batch_size = current_app.config['SALES_REPORT_BATCH_SIZE']
+        job = report_jobs().submit(
+            'sales_report', params,
+            lambda: Order.stream_csv(batch_size, conditions))
+        response = jsonify(report_job_status(job))
+        response.status_code = 200 if job.status == 'done' else 202
+        response.headers['Location'] = url_for('report_job', job_id=job.id)
+        return response
+
+    @app.route('/admin/report_jobs/<job_id>')
+    @admin_required
+    @login_required
+    def report_job(job_id):
+        """Returns a report job's status as JSON."""
+        job = report_jobs().get(job_id)
+        if job is None:
+            return api_error('No such report job.', 404)
+        return jsonify(report_job_status(job))
+
+    @app.route('/admin/report_jobs/<job_id>/download')
+    @admin_required
+    @login_required
+    def report_job_download(job_id):
+        """Sends a finished report job's gzip-compressed file."""
+        job = report_jobs().get(job_id)
+        if job is None or job.status != 'done' or \
+                not os.path.exists(job.path):
+            abort(404)
+        return send_file(job.path, mimetype='application/gzip',
+                         as_attachment=True,
+                         download_name=f'{job.id}.csv.gz')
+
+    @app.route('/admin/reports/revenue')
+    @admin_required
+    @login_required
+    def revenue_report():
+        """Returns units sold and revenue by ``period`` (day, week or month)
+        between the ``from`` and ``to`` days, as JSON, from the daily sales
+        rollup."""
+        period = request.args.get('period', 'day')
+        try:
+            start, end = (report_date(request.args.get(name))
+                          for name in ('from', 'to'))
+            rows = SalesDaily.revenue_by(period, start, end)
+        except ValueError:
+            return api_error('period must be day, week or month, and from '
+                             'and to YYYY-MM-DD dates.', 400)
+        return jsonify(period=period, rows=[
+            {'start': day.isoformat(), 'units': units, 'revenue': revenue}
+            for day, units, revenue in rows])
+
+    @app.route('/admin/reports/top_products')
+    @admin_required
+    @login_required
+    def top_products_report():
+        """Returns the ``n`` (10 by default) products with the most revenue
+        between the ``from`` and ``to`` days, as JSON, from the daily sales
+        rollup."""
+        try:
+            n = int(request.args.get('n', 10))
+            start, end = (report_date(request.args.get(name))
+                          for name in ('from', 'to'))
+            if n < 1:
+                raise ValueError
+        except ValueError:
+            return api_error('n must be a positive number, and from and to '
+                             'YYYY-MM-DD dates.', 400)
+        return jsonify(products=[
+            {'id': product.id, 'name': product.name, 'units': units,
+             'revenue': revenue}
+            for product, units, revenue in SalesDaily.top_products(
+                n, start, end)])
+
+    @app.route('/admin/reports/analytics')
+    @admin_required
+    @login_required
+    def analytics_report():
+        """Returns the dashboard's sales analytics as JSON: revenue by
+        ``period`` (day, week or month), the average basket, each product's
+        sell-through and the share of repeat customers, over all orders."""
+        try:
+            summary = sales_analytics().summary(
+                request.args.get('period', 'day'))
+        except ValueError:
+            return api_error('period must be day, week or month.', 400)
+        return jsonify(summary)
 
     @app.route('/checkout', methods=['GET', 'POST'])
     @login_required
     def checkout():
         """Checkout page for the user's cart"""
         user = current_user
-        cart = Cart.query.filter_by(user_id=user.id).first()
+        cart = Cart.get_for_user(user.id)
+        if request.method == 'POST':
+            # The form was submitted again, after the order was placed.
+            order = Order.get_by_idempotency_key(
+                user.id, request.form.get('idempotency_key'))
+            if order is not None:
+                return order_placed(order)
         # If there's no cart or an empty cart, redirect.
         if not cart or not cart.items:
             flash('Your cart is empty.')
             return redirect(url_for('catalog'))
         form = CheckoutForm(obj=user)
+        if request.method == 'GET':
+            form.idempotency_key.data = uuid.uuid4().hex
+            # Hold the stock while the user fills in the form, so it's
+            # still there when they submit it.
+            try:
+                short = Reservation.hold_cart(
+                    cart, current_app.config['RESERVATION_TTL'])
+                db.session.commit()
+            except SQLAlchemyError:
+                db.session.rollback()
+                short = []
+            # Reload the cart, which the commit expired, in one query.
+            cart = Cart.get_for_user(user.id)
+            for item in cart.items:
+                if item.product_id in short:
+                    flash(f'Only {item.product.stock} of '
+                          f'{item.product.name} left in stock.')
         if form.validate_on_submit():
             # Payment processing would occur here...
             try:
-                order = Order.create_order_from_cart(cart)
-                session['order_number'] = order.id
-                session['order_date'] = order.order_date
-                flash('Order placed successfully.')
-                return redirect(url_for('order_success'))
+                order = Order.create_order_from_cart(
+                    cart, form.idempotency_key.data)
+                return order_placed(order)
             # If product was out of stock...
             except ValueError as e:
                 flash(str(e))
@@ -0,0 +1,490 @@
+"""Full-text search over the product catalog.
+
+Product.search used to run ``ILIKE '%term%'`` against the name and
+description columns, which can't use an index and scans the whole product
+table on every request. Instead, each app keeps an inverted index (token ->
+product ids) in memory. It is built from the product table the first time
+it's needed and is then kept up to date from SQLAlchemy session events as
+products are inserted, updated or deleted. Changes committed through other
+worker processes don't reach this one, so once the index is
+SEARCH_INDEX_MAX_AGE seconds old a new one is built in a background thread
+and swapped in. Matches are ranked with BM25F so
+/search only has to load and render the most relevant few. Misspelled words
+("hedphones") are matched through a character-trigram index over the words
+in the search index.
+
+Example:
+    >>> index = InvertedIndex(weights=(2.0, 1.0))
+    >>> index.add(1, 'Bluetooth Speaker', 'Portable Wireless Speaker')
+    >>> index.add(2, 'Wireless Mouse', 'Ergonomic Wireless Mouse')
+    >>> index.search('wireless speaker')
+    {1}
+    >>> index.top_k('wireless', k=10)
+    ([2, 1], 2)
+"""
+from __future__ import annotations
+import heapq
+import math
+import re
+import threading
+from collections import defaultdict
+
+import sqlalchemy as sa
+from flask import current_app
+
+from .extensions import db
+from .models import Product
+from .signals import ProductChange, products_changed
+from .utils import BackgroundRebuild
+
+# Words are runs of letters and digits, so "Wi-Fi" becomes "wi" and "fi",
+# and "test_product_1" becomes "test", "product" and "1".
+_TOKEN_RE = re.compile(r'[^\W_]+')
+
+
+def tokenize(text: str) -> list[str]:
+    """Splits text into lowercase word tokens.
+
+    Args:
+        text (str): The text to split.
+
+    Returns:
+        List[str]: The tokens in the order they appear in the text.
+
+    Example:
+        >>> tokenize('Wi-Fi Smart Plug')
+        ['wi', 'fi', 'smart', 'plug']
+    """
+    return _TOKEN_RE.findall(text.lower())
+
+
+def trigrams(word: str) -> set[str]:
+    """Splits a word into its character trigrams.
+
+    The word is padded with two spaces at the front and one at the back (like
+    PostgreSQL's pg_trgm), so the start of a word counts for more than its
+    middle and short words still have a few trigrams.
+
+    Example:
+        >>> sorted(trigrams('tv'))
+        ['  t', ' tv', 'tv ']
+    """
+    padded = f'  {word} '
+    return {padded[i:i + 3] for i in range(len(padded) - 2)}
+
+
+class TrigramIndex:
+    """An in-memory index from character trigrams to the words containing
+    them, used to find words that are spelled similarly to a misspelled one.
+
+    Similarity is the Jaccard similarity of two words' trigram sets: the
+    number of trigrams they share divided by the number in either word.
+
+    Attributes:
+        postings (Dict[str, Set[str]]): The words containing each trigram.
+        words (Dict[str, int]): The number of trigrams in each word.
+
+    Methods:
+        add: Adds a word to the index.
+        remove: Removes a word from the index.
+        similar: Finds the indexed words similar to a given word.
+
+    Example:
+        >>> index = TrigramIndex()
+        >>> index.add('headphones')
+        >>> index.add('phone')
+        >>> index.similar('hedphones', threshold=0.3)
+        [(0.615..., 'headphones')]
+    """
+
+    def __init__(self):
+        self.postings: dict[str, set[str]] = defaultdict(set)
+        self.words: dict[str, int] = {}
+
+    def add(self, word: str):
+        """Adds a word to the index."""
+        grams = trigrams(word)
+        self.words[word] = len(grams)
+        for gram in grams:
+            self.postings[gram].add(word)
+
+    def remove(self, word: str):
+        """Removes a word from the index. Unknown words are ignored."""
+        if self.words.pop(word, None) is None:
+            return
+        for gram in trigrams(word):
+            posting = self.postings[gram]
+            posting.discard(word)
+            if not posting:
+                del self.postings[gram]
+
+    def similar(self, word: str, threshold: float) -> list[tuple[float, str]]:
+        """Finds the indexed words whose similarity to a word meets a
+        threshold.
+
+        Candidates are found by merging the posting lists of the word's
+        trigrams and counting how many trigrams each candidate shares with
+        it, so only words sharing at least one trigram are ever considered.
+        A word sharing c of the query's q trigrams can be at most c / q
+        similar, so candidates with too few shared trigrams are dropped
+        before their similarity is calculated.
+
+        Args:
+            word (str): The (possibly misspelled) word to look up.
+            threshold (float): The minimum similarity, between 0 and 1.
+
+        Returns:
+            List[Tuple[float, str]]: The similar words and their similarity,
+              most similar first.
+        """
+        grams = trigrams(word)
+        shared = defaultdict(int)
+        for gram in grams:
+            for candidate in self.postings.get(gram, ()):
+                shared[candidate] += 1
+        min_shared = threshold * len(grams)
+        matches = []
+        for candidate, count in shared.items():
+            if count < min_shared:
+                continue
+            similarity = count / (len(grams) + self.words[candidate] - count)
+            if similarity >= threshold:
+                matches.append((similarity, candidate))
+        matches.sort(key=lambda m: (-m[0], m[1]))
+        return matches
+
+
+class InvertedIndex:
+    """An in-memory inverted index mapping tokens to document ids.
+
+    Documents are made up of one or more text fields (for products, the name
+    and the description). The index keeps each token's frequency per field
+    and each field's length so matches can be ranked with BM25F, a version of
+    BM25 where a match in a heavily weighted field (the name) counts for more
+    than a match in a lightly weighted one (the description).
+
+    Attributes:
+        postings (Dict[str, Dict[int, Tuple[int, ...]]]): For each token, the
+          ids of the documents that contain it and how many times it appears
+          in each of their fields.
+        documents (Dict[int, Tuple[int, ...]]): The length of each field of
+          each document, in tokens.
+        weights (Tuple[float, ...]): How much a match in each field counts.
+        trigrams (TrigramIndex): The trigrams of every indexed token, for
+          typo-tolerant searches.
+
+    Methods:
+        add: Indexes (or re-indexes) a document.
+        remove: Removes a document from the index.
+        search: Finds the documents containing every term of a query.
+        top_k: Finds the k best matches for a query, ranked with BM25F.
+        fuzzy_top_k: Like top_k, but also matches misspelled terms.
+    """
+    # Standard BM25 parameters: k1 controls how quickly repeated terms stop
+    # adding to the score, b how much long fields are penalized.
+    k1 = 1.2
+    b = 0.75
+    # The most similar words a misspelled query term is expanded to.
+    max_expansions = 5
+
+    def __init__(self, weights: tuple[float, ...] = (1.0,)):
+        self.weights = weights
+        self.postings: dict[str, dict[int, tuple[int, ...]]] = \
+            defaultdict(dict)
+        self.documents: dict[int, tuple[int, ...]] = {}
+        self._tokens: dict[int, list[str]] = {}
+        self._total_lengths = [0] * len(weights)
+        self.trigrams = TrigramIndex()
+
+    def __len__(self) -> int:
+        return len(self.documents)
+
+    def add(self, doc_id: int, *fields: str):
+        """Indexes a document, replacing it if it's already indexed.
+
+        Args:
+            doc_id (int): The document's unique identifier.
+            *fields (str): The text fields to index for the document, in the
+              same order as the index's weights.
+        """
+        self.remove(doc_id)
+        frequencies = defaultdict(lambda: [0] * len(self.weights))
+        lengths = []
+        for i, field in enumerate(fields):
+            tokens = tokenize(field)
+            for token in tokens:
+                frequencies[token][i] += 1
+            lengths.append(len(tokens))
+            self._total_lengths[i] += len(tokens)
+        self.documents[doc_id] = tuple(lengths)
+        self._tokens[doc_id] = list(frequencies)
+        for token, counts in frequencies.items():
+            if token not in self.postings:
+                self.trigrams.add(token)
+            self.postings[token][doc_id] = tuple(counts)
+
+    def remove(self, doc_id: int):
+        """Removes a document from the index.
+
+        If the document isn't indexed, nothing happens.
+
+        Args:
+            doc_id (int): The document's unique identifier.
+        """
+        lengths = self.documents.pop(doc_id, None)
+        if lengths is None:
+            return
+        for i, length in enumerate(lengths):
+            self._total_lengths[i] -= length
+        for token in self._tokens.pop(doc_id):
+            posting = self.postings[token]
+            del posting[doc_id]
+            if not posting:
+                del self.postings[token]
+                self.trigrams.remove(token)
+
+    def search(self, query: str) -> set[int]:
+        """Finds the documents that contain every term in the query.
+
+        Posting lists are intersected from shortest to longest, so a rare
+        term quickly narrows down the candidates for the common ones.
+
+        Args:
+            query (str): The search query.
+
+        Returns:
+            Set[int]: The ids of the matching documents.
+        """
+        terms = set(tokenize(query))
+        if not terms:
+            return set()
+        postings = sorted((self.postings.get(term, {}) for term in terms),
+                          key=len)
+        result = set(postings[0])
+        for posting in postings[1:]:
+            if not result:
+                break
+            result.intersection_update(posting)
+        return result
+
+    def top_k(self, query: str, k: int,
+              where=None) -> tuple[list[int], int]:
+        """Finds the best matches for a query, ranked by BM25F score.
+
+        Only documents containing every term in the query are scored, and
+        only the best k are kept (with a bounded heap), so the cost of
+        ranking doesn't depend on how many documents match beyond scoring
+        them once.
+
+        Args:
+            query (str): The search query.
+            k (int): The maximum number of results to return.
+            where (Callable[[int], bool]): If given, only documents whose id
+              passes this check are returned (and counted).
+
+        Returns:
+            Tuple[List[int], int]: The ids of the best matches, best first,
+              and the total number of documents that matched.
+        """
+        terms = {term: 1.0 for term in tokenize(query)}
+        return self._rank(self.search(query), [terms], k, where)
+
+    def expand(self, query: str,
+               threshold: float) -> list[dict[str, float]] | None:
+        """Finds the indexed terms each query term could be a misspelling of.
+
+        Args:
+            query (str): The search query.
+            threshold (float): The minimum similarity for a replacement.
+
+        Returns:
+            List[Dict[str, float]] | None: For each query term, the indexed
+              terms that can stand in for it and their similarity to it. A
+              term that's in the index only stands in for itself. None if
+              some query term is nothing like any indexed term.
+        """
+        alternatives = []
+        for term in set(tokenize(query)):
+            if term in self.postings:
+                alternatives.append({term: 1.0})
+                continue
+            similar = self.trigrams.similar(term, threshold)
+            if not similar:
+                return None
+            alternatives.append({word: sim for sim, word
+                                 in similar[:self.max_expansions]})
+        return alternatives
+
+    def fuzzy_search(self, query: str, threshold: float) -> set[int]:
+        """Like search, but also matches misspelled terms.
+
+        A document matches if, for every query term, it contains the term or
+        one of the indexed terms spelled similarly to it (see expand).
+        """
+        return self._fuzzy_matches(self.expand(query, threshold))
+
+    def _fuzzy_matches(self, alternatives) -> set[int]:
+        if not alternatives:
+            return set()
+        candidate_sets = []
+        for words in alternatives:
+            docs = set()
+            for word in words:
+                docs.update(self.postings[word])
+            candidate_sets.append(docs)
+        candidate_sets.sort(key=len)
+        matches = candidate_sets[0]
+        for candidates in candidate_sets[1:]:
+            matches &= candidates
+        return matches
+
+    def fuzzy_top_k(self, query: str, k: int, threshold: float,
+                    where=None) -> tuple[list[int], int]:
+        """Finds the best matches for a query, allowing for misspellings.
+
+        Documents match as in fuzzy_search, and are scored as in top_k with
+        each replacement term's score scaled by how similar it is to the
+        query term it replaces.
+
+        Args:
+            query (str): The search query.
+            k (int): The maximum number of results to return.
+            threshold (float): The minimum similarity for a replacement.
+            where (Callable[[int], bool]): If given, only documents whose id
+              passes this check are returned (and counted).
+
+        Returns:
+            Tuple[List[int], int]: The ids of the best matches, best first,
+              and the total number of documents that matched.
+        """
+        alternatives = self.expand(query, threshold)
+        return self._rank(self._fuzzy_matches(alternatives), alternatives,
+                          k, where)
+
+    def _rank(self, matches, alternatives, k, where):
+        if where is not None:
+            matches = [doc_id for doc_id in matches if where(doc_id)]
+        if not matches:
+            return [], 0
+
+        def score(doc_id):
+            return sum(max(sim * self.score(doc_id, {word})
+                           for word, sim in words.items())
+                       for words in alternatives)
+
+        scores = ((score(doc_id), doc_id) for doc_id in matches)
+        # Ties go to the oldest (lowest id) document.
+        best = heapq.nlargest(k, scores, key=lambda s: (s[0], -s[1]))
+        return [doc_id for _, doc_id in best], len(matches)
+
+    def score(self, doc_id: int, terms: set[str]) -> float:
+        """Calculates a document's BM25F score for a set of query terms."""
+        n = len(self.documents)
+        lengths = self.documents[doc_id]
+        averages = [total / n or 1 for total in self._total_lengths]
+        score = 0.0
+        for term in terms:
+            posting = self.postings.get(term)
+            if not posting or doc_id not in posting:
+                continue
+            # Each field's term frequency is normalized by the field's length
+            # before the weighted fields are combined into one frequency.
+            tf = sum(weight * count / (1 - self.b + self.b * length / avg)
+                     for weight, count, length, avg
+                     in zip(self.weights, posting[doc_id], lengths, averages))
+            idf = math.log(1 + (n - len(posting) + 0.5) / (len(posting) + 0.5))
+            score += idf * tf / (self.k1 + tf)
+        return score
+
+
+class ProductSearchIndex:
+    """The search index for one app's product table.
+
+    The index is built lazily on the first search and is then updated
+    incrementally by ``apply_changes`` after each commit that touches a
+    product's name or description. Once it's max_age seconds old, a new one
+    is built in the background, to pick up commits made through other
+    processes, while searches keep using the old one.
+    """
+
+    def __init__(self, weights: tuple[float, float] = (1.0, 1.0),
+                 fuzzy_threshold: float = 0.3, max_age: float = 300):
+        self.weights = weights
+        self.fuzzy_threshold = fuzzy_threshold
+        self._lock = threading.RLock()
+        # Builds the index, and builds it again once it's too old.
+        self.rebuild = BackgroundRebuild(self._build, _apply_changes,
+                                         self._lock, max_age)
+
+    def search(self, query: str, fuzzy: bool = False) -> set[int]:
+        """Returns the ids of the products matching every term in the query,
+        allowing for misspellings if fuzzy is set."""
+        with self._lock:
+            index = self.rebuild.get()
+            if fuzzy:
+                return index.fuzzy_search(query, self.fuzzy_threshold)
+            return index.search(query)
+
+    def top_k(self, query: str, k: int, fuzzy: bool = False,
+              where=None) -> tuple[list[int], int]:
+        """Returns the ids of the k most relevant products, best first, and
+        the total number of products that matched.
+
+        Args:
+            query (str): The search query.
+            k (int): The maximum number of results to return.
+            fuzzy (bool): Whether to match misspelled words.
+            where (Callable[[int], bool]): If given, only the products whose
+              id passes this check are returned.
+        """
+        with self._lock:
+            index = self.rebuild.get()
+            if fuzzy:
+                return index.fuzzy_top_k(query, k, self.fuzzy_threshold,
+                                         where)
+            return index.top_k(query, k, where)
+
+    def apply_changes(self, changes: dict[int, ProductChange]):
+        """Updates the index with products changed by a commit.
+
+        Args:
+            changes (Dict[int, ProductChange]): How each product changed.
+        """
+        with self._lock:
+            self.rebuild.update(changes)
+
+    def _build(self) -> InvertedIndex:
+        index = InvertedIndex(self.weights)
+        rows = db.session.execute(
+            sa.select(Product.id, Product.name, Product.description))
+        for product_id, name, description in rows:
+            index.add(product_id, name, description)
+        return index
+
+
+def _apply_changes(index: InvertedIndex, changes: dict[int, ProductChange]):
+    for product_id, change in changes.items():
+        if change.row is None:
+            index.remove(product_id)
+        elif change.fields & {'name', 'description'}:
+            index.add(product_id, change.row.name, change.row.description)
+
+
+def init_search(app):
+    """Attaches an empty product search index to the app."""
+    app.extensions['search'] = ProductSearchIndex(
+        app.config['SEARCH_FIELD_WEIGHTS'],
+        app.config['SEARCH_FUZZY_THRESHOLD'],
+        app.config['SEARCH_INDEX_MAX_AGE'])
+
+
+def search_index() -> ProductSearchIndex:
+    """Returns the current app's product search index."""
+    return current_app.extensions['search']
+
+
+@products_changed.connect
+def _apply_product_changes(app, changes):
+    """Updates the app's search index after a commit changes products."""
+    if 'search' in app.extensions:
+        app.extensions['search'].apply_changes(changes)
@@ -0,0 +1,195 @@
+"""A cart kept in the session for visitors who aren't logged in.
+
+Giving every anonymous visitor a ``cart`` row (and ``cart_item`` rows) would
+fill those tables with carts nobody comes back to. Instead, an anonymous
+visitor's cart is just a mapping of product id to quantity in Flask's
+session, which is a signed cookie, so it can't be tampered with and costs
+the database nothing. It's shown with the same ``cart.html`` as a user's
+cart, and when the visitor logs in it's merged into their cart with one
+upsert.
+
+Example:
+    >>> cart = SessionCart()
+    >>> cart.add_product(42, 2)
+    >>> session['cart']
+    {'42': 2}
+    >>> cart.items[0].product.name, cart.item_count
+    ('Wireless Mouse', 2)
+"""
+from __future__ import annotations
+from typing import NamedTuple
+
+import sqlalchemy as sa
+from flask import current_app, session
+from flask_login import current_user, user_logged_in
+
+from .extensions import db
+from .models import Cart, Product
+
+
+class SessionCartItem(NamedTuple):
+    """An item in a session cart.
+
+    Attributes:
+        id (int): The product's id, which the cart page's forms use to
+          identify the item.
+        product (Product): The product.
+        quantity (int): The quantity of the product in the cart.
+    """
+    id: int
+    product: Product
+    quantity: int
+
+
+class SessionCart:
+    """The current visitor's session cart.
+
+    Quantities are stored in ``session['cart']``, keyed by product id (as a
+    string, since the session is serialized as JSON).
+
+    Attributes:
+        quantities (Dict[int, int]): The quantity of each product in the cart.
+
+    Methods:
+        add_product: Adds a product to the cart.
+        remove_product: Removes a product from the cart.
+        update_quantity: Sets the quantity of a product in the cart.
+        update_quantities: Sets the quantities of several products at once.
+        clear_cart: Removes all items from the cart.
+    """
+
+    def __init__(self):
+        # Carts saved before quantities were checked may hold some below 1.
+        self.quantities = {int(product_id): quantity for product_id, quantity
+                           in session.get('cart', {}).items() if quantity > 0}
+        self._items = None
+
+    def _save(self):
+        self._items = None
+        if self.quantities:
+            session['cart'] = {str(product_id): quantity for product_id,
+                               quantity in self.quantities.items()}
+        else:
+            session.pop('cart', None)
+
+    @property
+    def items(self) -> list[SessionCartItem]:
+        """The items in the cart, with their products loaded in one query.
+        Products that no longer exist are left out."""
+        if self._items is None:
+            self._items = [
+                SessionCartItem(product.id, product,
+                                self.quantities[product.id])
+                for product in Product.get_many(list(self.quantities))]
+        return self._items
+
+    @property
+    def item_count(self) -> int:
+        """How many items (counting quantities) are in the cart."""
+        return sum(self.quantities.values())
+
+    @property
+    def subtotal(self) -> float:
+        """The total price of the items in the cart."""
+        return sum(item.quantity * item.product.price for item in self.items)
+
+    def add_product(self, product_id: int, quantity: int = 1):
+        """Adds a product to the cart, or adds to its quantity if it's
+        already there.
+
+        Args:
+            product_id (int): The id of the product to add.
+            quantity (int): The quantity to add.
+
+        Raises:
+            ValueError: If the quantity is less than 1, or the cart already
+              holds SESSION_CART_MAX_PRODUCTS other products.
+        """
+        if quantity < 1:
+            raise ValueError('Enter a quantity of 1 or more.')
+        if product_id not in self.quantities and len(self.quantities) >= \
+                current_app.config['SESSION_CART_MAX_PRODUCTS']:
+            raise ValueError('Your cart is full. Log in to add more products.')
+        self.quantities[product_id] = \
+            self.quantities.get(product_id, 0) + quantity
+        self._save()
+
+    def remove_product(self, product_id: int):
+        """Removes a product from the cart, if it's there."""
+        if self.quantities.pop(product_id, None) is not None:
+            self._save()
+
+    def update_quantity(self, product_id: int, quantity: int):
+        """Sets the quantity of a product in the cart, removing it if the
+        quantity is 0 or less."""
+        if product_id not in self.quantities:
+            return
+        if quantity <= 0:
+            del self.quantities[product_id]
+        else:
+            self.quantities[product_id] = quantity
+        self._save()
+
+    def update_quantities(self, quantities: dict[int, int]):
+        """Sets the quantities of several products in the cart at once,
+        removing those whose quantity is 0 or less.
+
+        Raises:
+            ValueError: If any of the products isn't in the cart. Nothing is
+              changed.
+        """
+        if not quantities.keys() <= self.quantities.keys():
+            raise ValueError('Some of the items are not in this cart.')
+        for product_id, quantity in quantities.items():
+            if quantity <= 0:
+                del self.quantities[product_id]
+            else:
+                self.quantities[product_id] = quantity
+        self._save()
+
+    def clear_cart(self):
+        """Removes all items from the cart."""
+        self.quantities.clear()
+        self._save()
+
+
+def cart_item_count() -> int:
+    """Returns how many items are in the current visitor's cart: their
+    stored cart if they're logged in, otherwise their session cart."""
+    if current_user.is_authenticated:
+        cart = current_user.cart
+        return cart.item_count if cart else 0
+    return sum(session.get('cart', {}).values())
+
+
+def merge_session_cart(user):
+    """Moves the items in the session cart into a user's cart, with one
+    upsert, and commits.
+
+    Args:
+        user (User): The user whose cart the items are added to.
+    """
+    quantities = SessionCart().quantities
+    session.pop('cart', None)
+    if not quantities:
+        return
+    existing = db.session.scalars(
+        sa.select(Product.id).where(Product.id.in_(quantities)))
+    quantities = {product_id: quantities[product_id]
+                  for product_id in existing}
+    if not quantities:
+        return
+    cart = user.cart or Cart(user=user)
+    cart.add_products(quantities)
+    db.session.commit()
+
+
+def init_session_cart(app):
+    """Makes cart_item_count available to templates."""
+    app.context_processor(lambda: {'cart_item_count': cart_item_count})
+
+
+@user_logged_in.connect
+def _merge_on_login(app, user):
+    """Merges the session cart into the user's cart when they log in."""
+    merge_session_cart(user)
@@ -0,0 +1,194 @@
+"""Signals sent after a commit changes products or adds order items.
+
+Several parts of the app keep in-memory copies of product data (the search
+and autocomplete indexes, the catalog snapshot, the product cache) that have
+to be updated when products change. Rather than each of them hooking into
+SQLAlchemy, the changes made in a transaction are collected here from the
+session's flush events and sent out once, after the transaction commits, so
+a rolled back transaction is never seen. Releasing or rolling back a
+savepoint (``begin_nested``) doesn't send or discard anything.
+
+Changes made with Core statements (``UPDATE product SET stock = ...``) don't
+go through the ORM's flush, so whoever runs them has to report them with
+``mark_products_changed``; the changed rows are read back just before the
+transaction commits.
+
+Every product a commit changes also has its ``version`` bumped, in the same
+transaction, so other processes can tell that it changed.
+
+Example:
+    >>> @products_changed.connect
+    ... def on_products_changed(app, changes):
+    ...     for product_id, change in changes.items():
+    ...         if change.row is None:
+    ...             print(f'{product_id} was deleted')
+    ...         elif 'price' in change.fields:
+    ...             print(f'{product_id} now costs {change.row.price}')
+"""
+from __future__ import annotations
+from typing import NamedTuple
+
+import sqlalchemy as sa
+from blinker import Namespace
+from flask import current_app, has_app_context
+
+from .extensions import db
+from .models import OrderItem, Product
+
+_signals = Namespace()
+
+# Sent with changes=Dict[int, ProductChange], keyed by product id.
+products_changed = _signals.signal('products-changed')
+# Sent with items=List[Tuple[int, int]], the (product id, quantity) of each
+# order item added.
+order_items_added = _signals.signal('order-items-added')
+
+PRODUCT_FIELDS = ('name', 'description', 'price', 'stock')
+
+
+class ProductRow(NamedTuple):
+    """A product's values after a commit."""
+    id: int
+    name: str
+    description: str
+    price: float
+    stock: int
+
+
+class ProductChange(NamedTuple):
+    """How a commit changed a product.
+
+    Attributes:
+        fields (FrozenSet[str]): The names of the fields that changed. Every
+          field of a new or deleted product counts as changed.
+        row (ProductRow | None): The product's new values, or None if the
+          product was deleted.
+    """
+    fields: frozenset
+    row: ProductRow | None
+
+
+def mark_products_changed(session, product_ids, fields):
+    """Reports products changed outside of the ORM's flush.
+
+    Args:
+        session (Session): The session whose transaction changed them.
+        product_ids (Iterable[int]): The ids of the changed products.
+        fields (Iterable[str]): The names of the fields that changed.
+    """
+    stale = session.info.setdefault('stale_products', {})
+    for product_id in product_ids:
+        stale[product_id] = stale.get(product_id, frozenset()) | set(fields)
+
+
+def mark_order_items_added(session, items):
+    """Reports order items added outside of the ORM's flush.
+
+    Args:
+        session (Session): The session whose transaction added them.
+        items (Iterable[Tuple[int, int]]): The product id and quantity of
+          each order item.
+    """
+    session.info.setdefault('new_order_items', []).extend(items)
+
+
+def _row(product: Product) -> ProductRow:
+    return ProductRow(*(getattr(product, field)
+                        for field in ('id',) + PRODUCT_FIELDS))
+
+
+@sa.event.listens_for(db.session, 'after_flush')
+def _record_changes(session, flush_context):
+    changes = session.info.setdefault('product_changes', {})
+    for obj in session.new:
+        if isinstance(obj, Product):
+            changes[obj.id] = ProductChange(frozenset(PRODUCT_FIELDS),
+                                            _row(obj))
+        elif isinstance(obj, OrderItem):
+            mark_order_items_added(session, [(obj.product_id, obj.quantity)])
+    for obj in session.dirty:
+        if not isinstance(obj, Product):
+            continue
+        state = sa.inspect(obj)
+        fields = frozenset(field for field in PRODUCT_FIELDS
+                           if state.attrs[field].history.has_changes())
+        if fields:
+            previous = changes.get(obj.id)
+            if previous is not None:
+                fields |= previous.fields
+            changes[obj.id] = ProductChange(fields, _row(obj))
+    for obj in session.deleted:
+        if isinstance(obj, Product):
+            changes[obj.id] = ProductChange(frozenset(PRODUCT_FIELDS), None)
+
+
+@sa.event.listens_for(db.session, 'before_commit')
+def _read_stale_products(session):
+    """Reads back the products changed by Core statements while the
+    transaction can still see its own changes."""
+    if session.in_nested_transaction():
+        # A savepoint is being released; the transaction isn't committed.
+        return
+    # Flushing can report more (see models._release_deleted_carts).
+    session.flush()
+    stale = session.info.pop('stale_products', None)
+    if not stale:
+        return
+    changes = session.info.setdefault('product_changes', {})
+    rows = session.execute(
+        sa.select(Product.id, *(getattr(Product, field)
+                                for field in PRODUCT_FIELDS))
+        .where(Product.id.in_(stale)))
+    found = {row.id: ProductRow(*row) for row in rows}
+    for product_id, fields in stale.items():
+        previous = changes.get(product_id)
+        if previous is not None:
+            fields |= previous.fields
+        changes[product_id] = ProductChange(fields, found.get(product_id))
+
+
+@sa.event.listens_for(db.session, 'before_commit')
+def _bump_versions(session):
+    """Bumps the version of every product the transaction changed, for
+    conditional GETs (see conditional.py)."""
+    if session.in_nested_transaction():
+        return
+    changes = session.info.get('product_changes')
+    if not changes:
+        return
+    product_ids = [product_id for product_id, change in changes.items()
+                   if change.row is not None]
+    if product_ids:
+        session.execute(
+            sa.update(Product).where(Product.id.in_(product_ids))
+            .values(version=Product.version + 1),
+            execution_options={'synchronize_session': False})
+
+
+@sa.event.listens_for(db.session, 'after_commit')
+def _send_changes(session):
+    if session.in_nested_transaction():
+        return
+    changes = session.info.pop('product_changes', None)
+    items = session.info.pop('new_order_items', None)
+    if not has_app_context():
+        return
+    app = current_app._get_current_object()
+    if changes:
+        products_changed.send(app, changes=changes)
+    if items:
+        order_items_added.send(app, items=items)
+
+
+@sa.event.listens_for(db.session, 'after_rollback')
+def _discard_changes(session):
+    if session.in_nested_transaction():
+        # Rolling back to a savepoint keeps what was done before it, so the
+        # changes recorded so far are kept. The products among them are read
+        # back at commit, in case the savepoint undid some of their changes.
+        changes = session.info.pop('product_changes', {})
+        for product_id, change in changes.items():
+            mark_products_changed(session, [product_id], change.fields)
+        return
+    for key in ('product_changes', 'stale_products', 'new_order_items'):
+        session.info.pop(key, None)
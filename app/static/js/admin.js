@@ -0,0 +1,48 @@
+// Fills the admin dashboard's sales analytics from the analytics report,
+// and fetches it again when another period is picked.
+document.addEventListener('DOMContentLoaded', function () {
+    var section = document.querySelector('.sales-analytics[data-url]');
+    if (!section) {
+        return;
+    }
+    var period = section.querySelector('.analytics-period');
+
+    function fill(table, rows) {
+        var body = table.querySelector('tbody');
+        body.innerHTML = '';
+        rows.forEach(function (cells) {
+            var row = document.createElement('tr');
+            cells.forEach(function (cell) {
+                var column = document.createElement('td');
+                column.textContent = cell;
+                row.appendChild(column);
+            });
+            body.appendChild(row);
+        });
+    }
+
+    function load() {
+        fetch(section.dataset.url + '?period=' + period.value)
+            .then(function (response) { return response.json(); })
+            .then(function (data) {
+                section.querySelector('.analytics-summary').textContent =
+                    data.orders + ' orders, averaging ' +
+                    data.average_basket.units + ' items and $' +
+                    data.average_basket.value.toFixed(2) + '. ' +
+                    (data.repeat_customer_rate * 100).toFixed(1) + '% of ' +
+                    data.customers + ' customers ordered more than once.';
+                fill(section.querySelector('.analytics-revenue'),
+                     data.revenue.map(function (row) {
+                         return [row.start, row.units, '$' + row.revenue.toFixed(2)];
+                     }));
+                fill(section.querySelector('.analytics-sell-through'),
+                     data.sell_through.map(function (row) {
+                         return [row.name, row.sold, row.stock,
+                                 (row.rate * 100).toFixed(1) + '%'];
+                     }));
+            });
+    }
+
+    period.addEventListener('change', load);
+    load();
+});
@@ -0,0 +1,115 @@
+// Changes the cart through the JSON cart API, so adding, updating and
+// removing items doesn't reload the page. Without JavaScript the forms post
+// as usual.
+document.addEventListener('DOMContentLoaded', function () {
+    var meta = document.querySelector('meta[name="csrf-token"]');
+
+    // CSRF tokens expire, so a page that's been open a while gets a fresh
+    // one, for its forms too, and tries again.
+    function refreshToken() {
+        return fetch(meta.dataset.refreshUrl).then(function (response) {
+            return response.json();
+        }).then(function (data) {
+            meta.content = data.csrf_token;
+            document.querySelectorAll('input[name="csrf_token"]').forEach(function (input) {
+                input.value = data.csrf_token;
+            });
+        });
+    }
+
+    function send(url, method, body, retried) {
+        return fetch(url, {
+            method: method,
+            headers: {'Content-Type': 'application/json', 'X-CSRFToken': meta.content},
+            body: body === undefined ? undefined : JSON.stringify(body)
+        }).then(function (response) {
+            if (response.status === 400 && !retried) {
+                return refreshToken().then(function () {
+                    return send(url, method, body, true);
+                });
+            }
+            if (!response.ok) {
+                throw new Error(response.status);
+            }
+            return response.json();
+        });
+    }
+
+    function showTotals(data) {
+        var link = document.querySelector('.cart-link');
+        var badge = link.querySelector('.cart-badge');
+        if (data.item_count && !badge) {
+            badge = document.createElement('span');
+            badge.className = 'cart-badge';
+            link.appendChild(badge);
+        }
+        if (badge) {
+            if (data.item_count) {
+                badge.textContent = data.item_count;
+            } else {
+                badge.remove();
+            }
+        }
+        var subtotal = document.querySelector('.cart-subtotal');
+        if (subtotal) {
+            subtotal.textContent = '$' + data.subtotal.toFixed(2);
+        }
+    }
+
+    function showMessage(message) {
+        var container = document.querySelector('.flash-messages');
+        var list = container.querySelector('ul') || document.createElement('ul');
+        list.className = 'messages';
+        list.innerHTML = '';
+        var item = document.createElement('li');
+        item.textContent = message;
+        list.appendChild(item);
+        container.appendChild(list);
+    }
+
+    var addForm = document.querySelector('.add-to-cart-form');
+    if (addForm) {
+        addForm.addEventListener('submit', function (event) {
+            event.preventDefault();
+            send(addForm.dataset.apiUrl, 'POST', {
+                product_id: parseInt(addForm.elements.product_id.value, 10),
+                quantity: parseInt(addForm.elements.quantity.value, 10)
+            }).then(function (data) {
+                showTotals(data);
+                showMessage('Product added to cart successfully!');
+            }).catch(function () {
+                addForm.submit();
+            });
+        });
+    }
+
+    document.querySelectorAll('.cart-item[data-api-url]').forEach(function (line) {
+        var url = line.dataset.apiUrl;
+
+        function update(request) {
+            request.then(function (data) {
+                showTotals(data);
+                if (!data.line) {
+                    line.remove();
+                }
+                if (!data.item_count) {
+                    // Show the empty cart page.
+                    window.location.reload();
+                }
+            }).catch(function () {
+                window.location.reload();
+            });
+        }
+
+        line.querySelector('.quantity-input').addEventListener('change', function (event) {
+            var quantity = parseInt(event.target.value, 10);
+            if (quantity >= 0) {
+                update(send(url, 'PATCH', {quantity: quantity}));
+            }
+        });
+        line.querySelector('.btn-danger').addEventListener('click', function (event) {
+            event.preventDefault();
+            update(send(url, 'DELETE'));
+        });
+    });
+});
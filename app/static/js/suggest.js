@@ -0,0 +1,33 @@
+// Fills the search box's suggestion list with product names as you type.
+document.addEventListener('DOMContentLoaded', function () {
+    var input = document.querySelector('.search-input[data-suggest-url]');
+    if (!input) {
+        return;
+    }
+    var list = document.getElementById(input.getAttribute('list'));
+    var latest = 0;
+
+    input.addEventListener('input', function () {
+        var prefix = input.value.trim();
+        var request = ++latest;
+        if (!prefix) {
+            list.innerHTML = '';
+            return;
+        }
+        var url = input.dataset.suggestUrl + '?q=' + encodeURIComponent(prefix);
+        fetch(url)
+            .then(function (response) { return response.json(); })
+            .then(function (data) {
+                // Ignore answers to keystrokes that have been typed over.
+                if (request !== latest) {
+                    return;
+                }
+                list.innerHTML = '';
+                data.suggestions.forEach(function (suggestion) {
+                    var option = document.createElement('option');
+                    option.value = suggestion.name;
+                    list.appendChild(option);
+                });
+            });
+    });
+});
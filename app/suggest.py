@@ -0,0 +1,299 @@
+"""Search box autocomplete.
+
+Suggestions are served from an in-memory trie of product names so that
+answering a keystroke never touches the database. Each trie node caches the
+best few products below it, ranked by how many units of them have sold, so a
+lookup only has to walk the typed prefix. Like the search index, the trie is
+built the first time it's needed and then kept up to date from SQLAlchemy
+session events as products change and orders are placed. Once it's
+SUGGEST_MAX_AGE seconds old, a new one is built in a background thread, so
+answering a keystroke still doesn't wait for the database.
+
+Example:
+    >>> index = PrefixIndex(limit=10)
+    >>> index.add(1, 'Bluetooth Speaker', sales=20)
+    >>> index.add(2, 'Bluetooth Headphones', sales=50)
+    >>> index.suggest('blue')
+    [(2, 'Bluetooth Headphones'), (1, 'Bluetooth Speaker')]
+    >>> index.suggest('head')
+    [(2, 'Bluetooth Headphones')]
+"""
+from __future__ import annotations
+import heapq
+import re
+import threading
+
+import sqlalchemy as sa
+from flask import current_app
+
+from .extensions import db
+from .models import OrderItem, Product
+from .signals import ProductChange, order_items_added, products_changed
+from .utils import BackgroundRebuild
+
+_WORD_RE = re.compile(r'[^\W_]+')
+
+
+def completion_keys(name: str) -> set[str]:
+    """Returns the strings a product name can be completed from.
+
+    A name can be completed from its start or from the start of any word in
+    it, so "head" suggests "Bluetooth Headphones".
+
+    Example:
+        >>> sorted(completion_keys('Wi-Fi Router'))
+        ['fi router', 'router', 'wi-fi router']
+    """
+    name = ' '.join(name.lower().split())
+    return {name[match.start():] for match in _WORD_RE.finditer(name)}
+
+
+class _Node:
+    __slots__ = ('children', 'ids', 'top')
+
+    def __init__(self):
+        self.children: dict[str, _Node] = {}
+        # Products whose completion key ends at this node.
+        self.ids: set[int] = set()
+        # The best products anywhere below this node, best first.
+        self.top: list[int] = []
+
+
+class PrefixIndex:
+    """A trie of product names for prefix completion, ranked by sales.
+
+    Every node keeps the ``limit`` best-selling products in its subtree, so
+    suggestions for a prefix are read straight from the prefix's node.
+    Updates walk the paths of the product's completion keys and fix up those
+    cached lists on the way.
+
+    Attributes:
+        limit (int): The most suggestions that can be returned for a prefix.
+
+    Methods:
+        add: Adds (or updates) a product.
+        remove: Removes a product.
+        add_sales: Records that units of a product have sold.
+        suggest: Finds the best completions for a prefix.
+    """
+
+    def __init__(self, limit: int = 10):
+        self.limit = limit
+        self._root = _Node()
+        self._names: dict[int, str] = {}
+        self._sales: dict[int, int] = {}
+
+    def __len__(self) -> int:
+        return len(self._names)
+
+    def _rank(self, product_id: int):
+        # Best sellers first, then alphabetically.
+        return (-self._sales.get(product_id, 0),
+                self._names[product_id].lower(), product_id)
+
+    def _paths(self, product_id: int, create: bool = False):
+        """Yields the nodes on each of a product's completion key paths,
+        from the root down."""
+        for key in completion_keys(self._names[product_id]):
+            node = self._root
+            path = [node]
+            for char in key:
+                child = node.children.get(char)
+                if child is None:
+                    if not create:
+                        break
+                    child = node.children[char] = _Node()
+                node = child
+                path.append(node)
+            yield key, path
+
+    def _offer(self, node: _Node, product_id: int):
+        """Puts a product into a node's cached top list if it belongs."""
+        if product_id not in node.top:
+            if (len(node.top) >= self.limit and
+                    self._rank(product_id) > self._rank(node.top[-1])):
+                return
+            node.top.append(product_id)
+        node.top.sort(key=self._rank)
+        del node.top[self.limit:]
+
+    def _recompute(self, node: _Node, removed: int | None = None):
+        """Rebuilds a node's top list from its own and its children's."""
+        candidates = set(node.ids)
+        for child in node.children.values():
+            candidates.update(child.top)
+        candidates.discard(removed)
+        node.top = heapq.nsmallest(self.limit, candidates, key=self._rank)
+
+    def add(self, product_id: int, name: str, sales: int | None = None):
+        """Adds a product, or updates its name (and sales, if given).
+
+        Args:
+            product_id (int): The product's unique identifier.
+            name (str): The product's name.
+            sales (int): The number of units of the product sold so far.
+        """
+        if product_id in self._names:
+            if sales is None:
+                sales = self._sales.get(product_id, 0)
+            self.remove(product_id)
+        self._names[product_id] = name
+        self._sales[product_id] = sales or 0
+        for _, path in self._paths(product_id, create=True):
+            path[-1].ids.add(product_id)
+            for node in path:
+                self._offer(node, product_id)
+
+    def remove(self, product_id: int):
+        """Removes a product. Unknown products are ignored."""
+        if product_id not in self._names:
+            return
+        # A product's key paths can share nodes (e.g. "smart smartwatch" and
+        # "smartwatch"), so gather each node once, with its parent, and
+        # rebuild the top lists deepest first so every node sees its
+        # children's new lists.
+        nodes = {}
+        for key, path in self._paths(product_id):
+            path[-1].ids.discard(product_id)
+            for depth, node in enumerate(path):
+                parent = (path[depth - 1], key[depth - 1]) if depth else None
+                nodes[id(node)] = (depth, node, parent)
+        for _, node, parent in sorted(nodes.values(), key=lambda n: -n[0]):
+            if product_id in node.top:
+                self._recompute(node, removed=product_id)
+            if parent and not node.ids and not node.children:
+                # Nothing is left below this node.
+                parent[0].children.pop(parent[1], None)
+        del self._names[product_id]
+        del self._sales[product_id]
+
+    def add_sales(self, product_id: int, quantity: int):
+        """Records that more units of a product have sold.
+
+        Sales only go up, so the product can only move up in the top lists.
+        """
+        if product_id not in self._names:
+            return
+        self._sales[product_id] += quantity
+        for _, path in self._paths(product_id):
+            for node in path:
+                self._offer(node, product_id)
+
+    def suggest(self, prefix: str, n: int | None = None) -> list[tuple[int, str]]:
+        """Finds the best-selling products that complete a prefix.
+
+        Args:
+            prefix (str): What's been typed so far.
+            n (int): The most suggestions to return, up to the index's
+              limit. None returns that many, and less than 1 none.
+
+        Returns:
+            List[Tuple[int, str]]: The id and name of each suggestion, best
+              first.
+        """
+        prefix = ' '.join(prefix.lower().split())
+        if not prefix:
+            return []
+        node = self._root
+        for char in prefix:
+            node = node.children.get(char)
+            if node is None:
+                return []
+        n = self.limit if n is None else max(0, min(n, self.limit))
+        return [(product_id, self._names[product_id])
+                for product_id in node.top[:n]]
+
+
+class ProductSuggestions:
+    """The autocomplete index for one app's product table.
+
+    The index is built lazily on the first lookup, with product sales summed
+    from the order_item table, and is then updated after each commit that
+    changes a product's name or adds order items. Once it's max_age seconds
+    old, a new one is built in the background, to pick up commits made
+    through other processes, so lookups never wait on the database.
+    """
+
+    def __init__(self, limit: int = 10, max_age: float = 300):
+        self.limit = limit
+        self._lock = threading.RLock()
+        # Builds the index, and builds it again once it's too old.
+        self.rebuild = BackgroundRebuild(self._build, _apply, self._lock,
+                                         max_age)
+
+    def suggest(self, prefix: str, n: int | None = None) -> list[tuple[int, str]]:
+        """Returns the id and name of the best completions of a prefix."""
+        with self._lock:
+            return self.rebuild.get().suggest(prefix, n)
+
+    def apply_changes(self, changes: dict[int, ProductChange]):
+        """Updates the index with products changed by a commit.
+
+        Args:
+            changes (Dict[int, ProductChange]): How each product changed.
+        """
+        with self._lock:
+            self.rebuild.update(_apply_changes, changes)
+
+    def add_sales(self, items: list[tuple[int, int]]):
+        """Updates the rankings with the order items added by a commit.
+
+        Args:
+            items (List[Tuple[int, int]]): The product id and quantity of
+              each order item.
+        """
+        with self._lock:
+            self.rebuild.update(_add_sales, items)
+
+    def _build(self) -> PrefixIndex:
+        index = PrefixIndex(self.limit)
+        sales = dict(db.session.execute(
+            sa.select(OrderItem.product_id, sa.func.sum(OrderItem.quantity))
+            .group_by(OrderItem.product_id)).all())
+        for product_id, name in db.session.execute(
+                sa.select(Product.id, Product.name)):
+            index.add(product_id, name, sales.get(product_id, 0))
+        return index
+
+
+def _apply(index: PrefixIndex, update, *args):
+    update(index, *args)
+
+
+def _apply_changes(index: PrefixIndex, changes: dict[int, ProductChange]):
+    for product_id, change in changes.items():
+        if change.row is None:
+            index.remove(product_id)
+        elif 'name' in change.fields:
+            index.add(product_id, change.row.name)
+
+
+def _add_sales(index: PrefixIndex, items: list[tuple[int, int]]):
+    for product_id, quantity in items:
+        index.add_sales(product_id, quantity)
+
+
+def init_suggest(app):
+    """Attaches an empty autocomplete index to the app."""
+    app.extensions['suggest'] = ProductSuggestions(
+        app.config['SUGGEST_LIMIT'], app.config['SUGGEST_MAX_AGE'])
+
+
+def suggestions() -> ProductSuggestions:
+    """Returns the current app's autocomplete index."""
+    return current_app.extensions['suggest']
+
+
+@products_changed.connect
+def _apply_product_changes(app, changes):
+    """Updates the app's autocomplete index after a commit changes
+    products."""
+    if 'suggest' in app.extensions:
+        app.extensions['suggest'].apply_changes(changes)
+
+
+@order_items_added.connect
+def _apply_sales(app, items):
+    """Updates the app's autocomplete rankings after orders are placed."""
+    if 'suggest' in app.extensions:
+        app.extensions['suggest'].add_sales(items)
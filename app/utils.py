@@ -1,6 +1,10 @@
-﻿from functools import wraps
+﻿import os
+import threading
+import time
+from functools import wraps
 
-from flask import flash, jsonify, make_response, redirect, url_for
+from flask import (current_app, flash, jsonify, make_response, redirect,
+                   url_for)
 from flask_login import current_user
 
 
@@ -19,3 +23,114 @@ def admin_required(inner):
                 {'error': 'Access forbidden'}), 403)
         return inner(*args, **kwargs)
     return wrapped
+
+
+def private_directory(path: str) -> str:
+    """Creates a directory only the current user can use, or checks that an
+    existing one is, for files the app reads back and trusts.
+
+    Args:
+        path (str): The directory.
+
+    Returns:
+        str: The directory.
+
+    Raises:
+        RuntimeError: If the directory belongs to another user, or other
+          users can write to it.
+    """
+    os.makedirs(path, mode=0o700, exist_ok=True)
+    info = os.stat(path)
+    if (hasattr(os, 'getuid') and info.st_uid != os.getuid()) or \
+            info.st_mode & 0o022:
+        raise RuntimeError(f'{path} must belong to this user, and no one '
+                           f'else may write to it.')
+    return path
+
+
+class BackgroundRebuild:
+    """Keeps something built from the database, like a search index, fresh
+    without making requests wait for it.
+
+    It's built the first time it's needed and is then kept up to date by the
+    owner, through update, with the commits made by this process. Commits
+    made through other processes aren't seen, so once it's max_age seconds
+    old a replacement is built in a background thread and swapped in. Until
+    then the old one is used, and updates are made to both.
+
+    get and update must be called with the owner's lock held, which is also
+    taken to swap the replacement in.
+
+    Args:
+        build (Callable[[], Any]): Builds it, in an app context.
+        update (Callable): Called with it and update's arguments, to apply a
+          change to it in place.
+        lock (threading.RLock): The owner's lock.
+        max_age (float): How many seconds to go before building it again.
+
+    Methods:
+        get: Returns it, building it the first time.
+        update: Applies a change to it.
+        join: Waits for a replacement being built, if any.
+    """
+
+    def __init__(self, build, update, lock, max_age: float = 300):
+        self.max_age = max_age
+        self._build = build
+        self._update = update
+        self._lock = lock
+        self._value = None
+        self._built = 0.0
+        self._thread: threading.Thread | None = None
+        self._pending: list | None = None
+
+    def get(self):
+        """Returns it, building it the first time it's needed, and starts
+        building a replacement if it's too old."""
+        if self._value is None:
+            self._value = self._build()
+            self._built = time.monotonic()
+        elif self._thread is None and \
+                time.monotonic() - self._built > self.max_age:
+            self._pending = []
+            self._thread = threading.Thread(
+                target=self._rebuild, args=(current_app._get_current_object(),),
+                daemon=True)
+            self._thread.start()
+        return self._value
+
+    def update(self, *args):
+        """Applies a change to it, if it's been built, and to the replacement
+        being built, if any."""
+        if self._value is None:
+            # Nothing to update, the next lookup builds it afresh.
+            return
+        self._update(self._value, *args)
+        if self._pending is not None:
+            self._pending.append(args)
+
+    def join(self):
+        """Waits for the replacement being built, if any, to be swapped in.
+        Call without the lock held."""
+        thread = self._thread
+        if thread is not None:
+            thread.join()
+
+    def _rebuild(self, app):
+        value = None
+        try:
+            with app.app_context():
+                value = self._build()
+        except Exception:
+            app.logger.exception('Rebuilding in the background failed')
+        with self._lock:
+            if value is not None:
+                # Changes committed while it was being built may not be in
+                # it, so they're applied again.
+                for args in self._pending:
+                    self._update(value, *args)
+                self._value = value
+            # Tried again after max_age if it failed.
+            self._built = time.monotonic()
+            self._pending = None
+            self._thread = None
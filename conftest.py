@@ -1,6 +1,9 @@
+import contextlib
 import pytest
 import sqlite3
 
+import sqlalchemy as sa
+
 from app import create_app
 from app.extensions import db
 from app.models import Cart, Order, Product, User
@@ -38,6 +41,42 @@ def client(test_app):
         yield test_app.test_client()
 
 
+class Statements(list):
+    """The SQL statements run, in order, with the parameters each was run
+    with in ``parameters``."""
+
+    def __init__(self):
+        super().__init__()
+        self.parameters = []
+
+
+@pytest.fixture(scope='function')
+def count_queries():
+    """Records the SQL statements run inside a with block.
+
+    Example:
+        with count_queries() as statements:
+            client.get('/cart')
+        assert len(statements) == 3
+    """
+    @contextlib.contextmanager
+    def count_queries():
+        statements = Statements()
+        engine = db.engine
+
+        def record(conn, cursor, statement, parameters, *args):
+            statements.append(statement)
+            statements.parameters.append(parameters)
+
+        sa.event.listen(engine, 'before_cursor_execute', record)
+        try:
+            yield statements
+        finally:
+            sa.event.remove(engine, 'before_cursor_execute', record)
+
+    return count_queries
+
+
 @pytest.fixture(scope='function')
 def user(session):
     """Add a simple test user to the database."""
@@ -0,0 +1,36 @@
+from app.cache import FragmentCache
+
+
+def test_fragments_expire_and_are_invalidated_by_product():
+    cache = FragmentCache()
+    cache.set('featured', '<ul></ul>', ttl=60, product_ids=[1, 2])
+    cache.set('expired', '<ul></ul>', ttl=0, product_ids=[3])
+    assert cache.get('featured') == '<ul></ul>'
+    assert cache.get('expired') is None
+
+    cache.invalidate_products({3})
+    assert cache.get('featured') == '<ul></ul>'
+    cache.invalidate_products({2})
+    assert cache.get('featured') is None
+
+
+def test_missing_featured_products_are_skipped(session, client, test_app,
+                                                product):
+    test_app.config['FEATURED_PRODUCT_IDS'] = (9999, product.id)
+    response = client.get('/')
+    assert response.status_code == 200
+    assert b'test_product' in response.data
+
+
+def test_warm_home_page_needs_no_queries(session, client, test_app, product,
+                                        count_queries):
+    test_app.config['FEATURED_PRODUCT_IDS'] = (product.id,)
+    client.get('/')
+    with count_queries() as statements:
+        response = client.get('/')
+    assert b'test_product' in response.data
+    assert statements == []
+
+    product.price = 12.5
+    session.commit()
+    assert b'$12.50' in client.get('/').data
@@ -0,0 +1,91 @@
+import time
+
+import sqlalchemy as sa
+
+from app.cache import LRUCache, cached_product, product_cache
+from app.models import Product
+
+
+def test_lru_eviction_and_counters():
+    cache = LRUCache(maxsize=2)
+    cache.set('a', 1)
+    cache.set('b', 2)
+    assert cache.get('a') == 1
+    cache.set('c', 3)
+    # 'b' was the least recently used.
+    assert cache.get('b') is None
+    assert cache.get('c') == 3
+    assert cache.stats() == {'hits': 2, 'misses': 1, 'size': 2, 'maxsize': 2}
+
+
+def test_entries_expire_after_ttl(monkeypatch):
+    cache = LRUCache(ttl=60)
+    cache.set('a', 1)
+    assert cache.get('a') == 1
+    later = time.monotonic() + 61
+    monkeypatch.setattr(time, 'monotonic', lambda: later)
+    assert cache.get('a') is None
+    assert len(cache) == 0
+    assert cache.get_or_load('a', lambda: 2) == 2
+    assert cache.get('a') == 2
+
+
+def test_load_racing_an_invalidation_is_not_cached():
+    cache = LRUCache()
+
+    def load():
+        # The entry is invalidated while the old value is being loaded.
+        cache.delete('key')
+        return 'stale'
+
+    assert cache.get_or_load('key', load) == 'stale'
+    assert cache.get('key') is None
+    assert cache.get_or_load('key', lambda: 'fresh') == 'fresh'
+    assert cache.get('key') == 'fresh'
+
+
+def test_cached_product_is_invalidated_on_commit(session, product):
+    assert cached_product(product.id).price == 5.99
+    assert cached_product(product.id).price == 5.99
+    assert product_cache().stats()['hits'] == 1
+
+    product.price = 7.5
+    session.commit()
+    assert cached_product(product.id).price == 7.5
+
+    product.description = 'not committed'
+    session.flush()
+    session.rollback()
+    assert cached_product(product.id).description == 'test_description'
+
+
+def test_cached_product_sees_other_processes_commits(session, product,
+                                                   monkeypatch):
+    assert cached_product(product.id).price == 5.99
+    # A Core update isn't reported, like a commit made by another process.
+    session.execute(sa.update(Product).where(Product.id == product.id)
+                    .values(price=7.5))
+    session.commit()
+    assert cached_product(product.id).price == 5.99
+    later = time.monotonic() + product_cache().ttl + 1
+    monkeypatch.setattr(time, 'monotonic', lambda: later)
+    assert cached_product(product.id).price == 7.5
+
+
+def test_product_page_served_from_cache(session, client, product,
+                                        count_queries):
+    client.get(f'/items_page/{product.id}')
+    with count_queries() as statements:
+        response = client.get(f'/items_page/{product.id}')
+    assert b'test_product' in response.data
+    # Only the product's version is read, for its ETag.
+    assert [statement for statement in statements
+            if 'FROM product' in statement] == [
+        'SELECT product.version \nFROM product \nWHERE product.id = ?']
+    assert client.get('/items_page/9999').status_code == 404
+
+
+def test_cache_can_be_disabled(session, test_app, product):
+    del test_app.extensions['product_cache']
+    assert product_cache() is None
+    assert cached_product(product.id).name == 'test_product'
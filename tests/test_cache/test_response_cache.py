@@ -0,0 +1,124 @@
+import os
+import pickle
+import time
+
+import pytest
+
+from app.response_cache import CachedResponse, FileSystemBackend, \
+    response_cache
+
+
+def test_anonymous_pages_are_cached(session, client, product):
+    response = client.get('/catalog?sort=price&in_stock=1')
+    assert response.headers['X-Cache'] == 'MISS'
+    # It came with a new session cookie.
+    assert response.cache_control.private
+
+    # The same arguments in another order, plus an empty one.
+    response = client.get('/catalog?in_stock=1&sort=price&min_price=')
+    assert response.headers['X-Cache'] == 'HIT'
+    assert response.cache_control.public
+    assert response.cache_control.max_age == 60
+    assert b'test_product' in response.data
+    assert client.get('/catalog?sort=name').headers['X-Cache'] == 'MISS'
+
+
+def test_product_writes_invalidate_tagged_pages(session, client, product):
+    client.get(f'/items_page/{product.id}')
+    client.get('/catalog')
+    assert client.get(f'/items_page/{product.id}').headers['X-Cache'] == 'HIT'
+
+    product.price = 8.25
+    session.commit()
+    response = client.get(f'/items_page/{product.id}')
+    assert response.headers['X-Cache'] == 'MISS'
+    assert b'8.25' in response.data
+    assert client.get('/catalog').headers['X-Cache'] == 'MISS'
+
+
+def test_logged_in_users_are_not_cached(session, client, user, product):
+    client.get('/catalog')
+    client.post('/login', data=dict(username='test_username',
+                                    password='correct_password'),
+                follow_redirects=True)
+    response = client.get('/catalog')
+    assert 'X-Cache' not in response.headers
+    assert response.cache_control.private
+    assert response.cache_control.no_cache
+
+
+def test_filesystem_backend_is_shared(tmp_path):
+    first = FileSystemBackend(str(tmp_path), maxsize=2)
+    second = FileSystemBackend(str(tmp_path), maxsize=2)
+    tags = first.tag_versions(['products'])
+    first.set('/catalog?', CachedResponse(200, [], b'page', tags,
+                                          time.time() + 60))
+    entry = second.get('/catalog?')
+    assert entry.body == b'page'
+    assert entry.tags == second.tag_versions(['products'])
+
+    second.bump_tags(['products'])
+    assert first.tag_versions(['products']) != tags
+
+    for i in range(3):
+        first.set(f'/items_page/{i}?', CachedResponse(
+            200, [], b'page', {}, time.time() + 60))
+    assert len(first._entry_paths()) == 2
+
+
+def test_filesystem_backend_prunes_without_reading_entries(tmp_path,
+                                                           monkeypatch):
+    backend = FileSystemBackend(str(tmp_path), maxsize=10)
+    now = time.time()
+    for i in range(10):
+        backend.set(f'/items_page/{i}?', CachedResponse(
+            200, [], b'page', {}, now + 60 + i))
+    monkeypatch.setattr('app.response_cache._read_entry', None)
+    backend.set('/expired?', CachedResponse(200, [], b'page', {}, now - 1))
+    # The expired entry went, and then the one expiring soonest, to leave a
+    # tenth of the room free.
+    paths = set(backend._entry_paths())
+    assert len(paths) == 9
+    for key in ('/expired?', '/items_page/0?'):
+        assert backend._path(backend.directory, key) not in paths
+    backend.set('/catalog?', CachedResponse(200, [], b'page', {}, now + 600))
+    assert len(backend._entry_paths()) == 10
+
+
+def test_filesystem_backend_never_unpickles(tmp_path):
+    backend = FileSystemBackend(str(tmp_path))
+    backend.set('/catalog?', CachedResponse(
+        200, [('Content-Type', 'text/html')], b'page\nmore', {}, 1.5))
+    assert backend.get('/catalog?') == CachedResponse(
+        200, [('Content-Type', 'text/html')], b'page\nmore', {}, 1.5)
+
+    # A pickle planted in the directory is just a file that can't be read.
+    ran = []
+
+    class Exploit:
+        def __reduce__(self):
+            return ran.append, ('ran',)
+
+    with open(backend._path(backend.directory, '/catalog?'), 'wb') as file:
+        pickle.dump(Exploit(), file)
+    assert backend.get('/catalog?') is None
+    assert ran == []
+
+
+def test_filesystem_backend_needs_a_private_directory(tmp_path):
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    shared.chmod(0o777)
+    with pytest.raises(RuntimeError):
+        FileSystemBackend(str(shared))
+    assert (os.stat(FileSystemBackend(str(tmp_path / 'new')).directory)
+            .st_mode & 0o777) == 0o700
+
+
+def test_response_cache_can_be_disabled(session, client, test_app, product):
+    del test_app.extensions['response_cache']
+    with test_app.test_request_context():
+        assert response_cache() is None
+    response = client.get('/catalog')
+    assert response.status_code == 200
+    assert 'X-Cache' not in response.headers
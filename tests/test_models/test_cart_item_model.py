@@ -1,4 +1,4 @@
-from app.models import CartItem
+from app.models import CartItem, _update_then_insert
 
 
 class TestCartItemModel:
@@ -12,4 +12,19 @@ class TestCartItemModel:
         cart_item.update_quantity(10)
         session.commit()
         fetched_cart_item = CartItem.query.first()
-        assert fetched_cart_item.quantity == 10
\ No newline at end of file
+        assert fetched_cart_item.quantity == 10
+    def test_update_then_insert(self, session, cart, products, cart_item):
+        """Databases without an upsert statement update the rows that are
+        there and insert the rest."""
+        _update_then_insert(
+            CartItem.__table__,
+            [{'cart_id': cart.id, 'product_id': cart_item.product_id,
+              'quantity': 2},
+             {'cart_id': cart.id, 'product_id': products[1].id,
+              'quantity': 3}],
+            ('cart_id', 'product_id'), ('quantity',))
+        session.commit()
+        session.expire_all()
+        assert sorted((item.product_id, item.quantity)
+                      for item in CartItem.query) == sorted([
+            (cart_item.product_id, 3), (products[1].id, 3)])
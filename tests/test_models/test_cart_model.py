@@ -1,6 +1,7 @@
 import pytest
+from sqlalchemy.exc import IntegrityError
 
-from app.models import Cart, Product, User
+from app.models import Cart, CartItem, Product, User
 
 
 class TestCartModel:
@@ -55,3 +56,79 @@ class TestCartModel:
         session.commit()
         fetched_cart = Cart.query.filter(Cart.user_id == cart.user.id).first()
         assert fetched_cart.items == []
+
+    def test_add_product_merges_with_existing_item(self, session, cart,
+                                                   product):
+        cart.add_product(product.id, quantity=2)
+        assert cart.items[0].quantity == 2
+        cart.add_product(product.id, quantity=3)
+        session.commit()
+        assert len(cart.items) == 1
+        assert cart.items[0].quantity == 5
+        assert CartItem.query.count() == 1
+
+    def test_add_product_to_new_cart(self, session, user, product):
+        product_id = product.id
+        cart = Cart(user=user)
+        cart.add_product(product_id)
+        session.commit()
+        assert cart.id is not None
+        assert cart.items[0].product_id == product_id
+
+    def test_add_quantities_in_one_statement(self, session, cart, products):
+        cart.add_product(products[0].id)
+        session.commit()
+        CartItem.add_quantities([(cart.id, products[0].id, 2),
+                                 (cart.id, products[1].id, 1),
+                                 (cart.id, products[1].id, 4)])
+        session.commit()
+        session.expire_all()
+        assert {item.product_id: item.quantity for item in cart.items} == {
+            products[0].id: 3, products[1].id: 5}
+
+    def test_add_quantities_below_one(self, session, cart, products):
+        for quantity in (0, -5):
+            with pytest.raises(ValueError):
+                cart.add_products({products[0].id: 1,
+                                   products[1].id: quantity})
+        session.commit()
+        assert cart.items == []
+
+    def test_cart_items_are_unique(self, session, cart, product):
+        session.add_all([CartItem(cart=cart, product=product),
+                         CartItem(cart=cart, product=product)])
+        with pytest.raises(IntegrityError):
+            session.commit()
+
+    def test_totals_follow_item_changes(self, session, cart, products):
+        cart.add_product(products[0].id, quantity=2)
+        cart.add_product(products[1].id)
+        cart.add_product(products[0].id)
+        session.commit()
+        assert cart.item_count == 4
+        assert cart.subtotal == pytest.approx(5.99 * 3 + 10.99)
+
+        item = next(item for item in cart.items
+                    if item.product_id == products[1].id)
+        item.update_quantity(3)
+        assert cart.item_count == 6
+        assert cart.subtotal == pytest.approx(5.99 * 3 + 10.99 * 3)
+
+        cart.remove_product(products[0].id)
+        assert cart.item_count == 3
+        assert cart.subtotal == pytest.approx(10.99 * 3)
+
+        cart.items[0].update_quantity(0)
+        assert (cart.item_count, cart.subtotal) == (0, 0)
+
+        cart.add_product(products[0].id)
+        cart.clear_cart()
+        assert (cart.item_count, cart.subtotal) == (0, 0)
+
+    def test_totals_follow_price_changes(self, session, cart, products):
+        cart.add_product(products[0].id, quantity=2)
+        session.commit()
+        products[0].price = 7.25
+        session.commit()
+        assert cart.subtotal == pytest.approx(14.5)
+        assert cart.subtotal == pytest.approx(cart.get_total_price())
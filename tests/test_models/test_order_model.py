@@ -1,6 +1,15 @@
+import sqlite3
+import threading
+import time
+from datetime import date
+
 import pytest
+import sqlalchemy as sa
 
-from app.models import Cart, Order
+from app import create_app
+from app.config import TestingConfig
+from app.extensions import db
+from app.models import Cart, Order, OrderItem, Product, User
 
 
 class TestOrderModel:
@@ -42,9 +51,10 @@ class TestOrderModel:
 
     def test_order_creation_fails(self, session, cart, product):
         previous_stock = product.stock
+        cart.add_product(product.id, quantity=200)
+        session.commit()
         # ValueError should be raised because there isn't enough stock.
         with pytest.raises(ValueError):
-            cart.add_product(product.id, quantity=200)
             new_order = Order.create_order_from_cart(cart)
             session.add(new_order)
             session.commit()
@@ -53,7 +63,184 @@ class TestOrderModel:
         assert len(cart.items) == 1
         assert Order.query.count() == 0
 
+    def test_stream_csv(self, session, order, products):
+        chunks = list(Order.stream_csv(batch_size=1))
+        # The header, then one chunk per row.
+        assert len(chunks) == 3
+        assert chunks[0] == \
+            'order_id,user_id,order_date,product_id,quantity,price\n'
+        assert chunks[1:] == [
+            f'{order.id},{order.user_id},{order.order_date},'
+            f'{item.product_id},{item.quantity},{item.price}\n'
+            for item in sorted(order.items, key=lambda item: item.id)]
+        assert Order.get_all_orders_in_csv_format() == ''.join(chunks)
+
+    def test_date_range_report_uses_indexes(self, session, count_queries):
+        conditions = Order.report_conditions(date(2026, 3, 10),
+                                             date(2026, 3, 10))
+        with count_queries() as statements:
+            list(Order.stream_csv(conditions=conditions))
+        statement, parameters = statements[0], statements.parameters[0]
+        plan = ' '.join(row[-1] for row in session.connection()
+                        .exec_driver_sql('EXPLAIN QUERY PLAN ' + statement,
+                                         parameters))
+        assert 'ix_order_order_date' in plan
+        assert 'ix_order_item_order_id' in plan
+
     def test_order_total_price(self, session, order, products):
         fetched_order = Order.query.first()
         price = order.get_total_price()
         assert fetched_order.get_total_price() == price
+
+
+def test_order_creation_is_idempotent(session, cart, product):
+    cart.add_product(product.id, 2)
+    session.commit()
+    order = Order.create_order_from_cart(cart, 'key')
+    cart.add_product(product.id, 2)
+    session.commit()
+    assert Order.create_order_from_cart(cart, 'key') is order
+    assert product.stock == 98
+    assert len(cart.items) == 1
+    assert Order.query.count() == 1
+
+
+def test_concurrent_duplicate_order(session, cart, product, monkeypatch):
+    cart.add_product(product.id, 2)
+    session.commit()
+    first = Order.create_order_from_cart(cart, 'key')
+    cart.add_product(product.id, 2)
+    session.commit()
+    # The duplicate checked for the key before the first order was placed.
+    lookups = []
+    get_by_idempotency_key = Order.get_by_idempotency_key
+
+    def late_lookup(user_id, idempotency_key):
+        lookups.append(idempotency_key)
+        if len(lookups) == 1:
+            return None
+        return get_by_idempotency_key(user_id, idempotency_key)
+
+    monkeypatch.setattr(Order, 'get_by_idempotency_key', late_lookup)
+    assert Order.create_order_from_cart(cart, 'key') is first
+    assert len(lookups) == 2
+    assert product.stock == 98
+    assert len(cart.items) == 1
+    assert Order.query.count() == 1
+
+
+def lock_error(code):
+    orig = sqlite3.OperationalError('database is locked')
+    orig.sqlite_errorcode = code
+    return sa.exc.OperationalError('UPDATE product ...', {}, orig)
+
+
+def test_order_creation_retries_lock_conflicts(session, cart, product,
+                                               monkeypatch):
+    cart.add_product(product.id, 2)
+    session.commit()
+    place_order = Order._place_order
+    attempts, waits = [], []
+
+    def collide_once(cart, idempotency_key):
+        attempts.append(cart)
+        if len(attempts) == 1:
+            raise lock_error(5)
+        return place_order(cart, idempotency_key)
+
+    monkeypatch.setattr(Order, '_place_order', collide_once)
+    monkeypatch.setattr(time, 'sleep', waits.append)
+    order = Order.create_order_from_cart(cart)
+    assert len(attempts) == 2
+    assert len(waits) == 1 and 0 <= waits[0] <= 0.05
+    assert [(item.product_id, item.quantity) for item in order.items] == \
+        [(product.id, 2)]
+    assert product.stock == 98
+
+
+def test_order_creation_gives_up(session, cart, product, monkeypatch):
+    cart.add_product(product.id, 2)
+    session.commit()
+    attempts = []
+
+    def collide(error):
+        def place_order(cart, idempotency_key):
+            attempts.append(cart)
+            raise error
+        return place_order
+
+    monkeypatch.setattr(time, 'sleep', lambda seconds: None)
+    monkeypatch.setattr(Order, '_place_order', collide(lock_error(517)))
+    with pytest.raises(RuntimeError):
+        Order.create_order_from_cart(cart)
+    assert len(attempts) == 3
+
+    # Other errors aren't retried.
+    attempts.clear()
+    monkeypatch.setattr(Order, '_place_order', collide(lock_error(19)))
+    with pytest.raises(RuntimeError):
+        Order.create_order_from_cart(cart)
+    assert len(attempts) == 1
+
+
+def test_concurrent_checkouts_never_oversell(tmp_path):
+    """Many threads check out carts holding the same product at once, from
+    a SQLite database file, and exactly the product's stock is sold."""
+    class StressConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "shop.db"}'
+        # Wait for the write lock instead of failing straight away.
+        SQLALCHEMY_ENGINE_OPTIONS = {'connect_args': {'timeout': 30}}
+
+    app = create_app(StressConfig)
+    stock, threads, carts_per_thread = 50, 8, 10
+    with app.app_context():
+        db.create_all()
+        product = Product(name='stress', description='', price=1.0,
+                          stock=stock)
+        db.session.add(product)
+        users = [User(username=f'user_{i}', name='', email=f'user_{i}',
+                      address='')
+                 for i in range(threads * carts_per_thread)]
+        db.session.add_all(users)
+        db.session.commit()
+        carts = [Cart(user=user) for user in users]
+        db.session.add_all(carts)
+        for cart in carts:
+            cart.add_product(product.id, 2)
+        db.session.commit()
+        product_id = product.id
+        user_ids = [user.id for user in users]
+
+    placed, sold_out, failed = [], [], []
+
+    def checkout(user_ids):
+        with app.app_context():
+            for user_id in user_ids:
+                try:
+                    Order.create_order_from_cart(Cart.get_for_user(user_id))
+                    placed.append(user_id)
+                except ValueError:
+                    sold_out.append(user_id)
+                except RuntimeError:
+                    failed.append(user_id)
+            db.session.remove()
+
+    workers = [threading.Thread(target=checkout,
+                                args=(user_ids[i::threads],))
+               for i in range(threads)]
+    start = time.perf_counter()
+    for worker in workers:
+        worker.start()
+    for worker in workers:
+        worker.join()
+    elapsed = time.perf_counter() - start
+    print(f'{len(placed) / elapsed:.0f} orders/s')
+
+    with app.app_context():
+        assert failed == []
+        assert len(placed) == stock // 2
+        assert len(placed) + len(sold_out) == len(user_ids)
+        assert db.session.get(Product, product_id).stock == 0
+        assert db.session.scalar(
+            sa.select(sa.func.sum(OrderItem.quantity))) == stock
+        db.drop_all()
@@ -23,6 +23,12 @@ class TestProductModel:
             product.subtract_stock(1000)
             session.commit()
 
+    def test_product_take_stock(self, session, product):
+        assert Product.take_stock(product.id, 60)
+        assert not Product.take_stock(product.id, 60)
+        session.commit()
+        assert product.stock == 40
+
     def test_product_search(self, session, product):
         retrieved = Product.search(product.name)
         assert len(retrieved) == 1
@@ -0,0 +1,211 @@
+from datetime import datetime, timedelta
+
+import pytest
+import sqlalchemy as sa
+
+from app.catalog import catalog_snapshot
+from app.models import Cart, CartItem, Order, Product, Reservation, User
+
+
+class TestReservationModel:
+    def test_hold_cart(self, session, cart, products):
+        cart.add_products({products[0].id: 2, products[1].id: 3})
+        session.commit()
+        assert Reservation.hold_cart(cart, ttl=600) == []
+        session.commit()
+        assert products[0].stock == 98
+        assert products[1].stock == 97
+        holds = {hold.product_id: hold.quantity
+                 for hold in Reservation.query.filter_by(cart_id=cart.id)}
+        assert holds == {products[0].id: 2, products[1].id: 3}
+
+        # Loading the page again holds what the cart holds now.
+        cart.remove_product(products[1].id)
+        cart.update_quantities({cart.items[0].id: 5})
+        session.commit()
+        assert Reservation.hold_cart(cart, ttl=600) == []
+        session.commit()
+        assert products[0].stock == 95
+        assert products[1].stock == 100
+        assert [(hold.product_id, hold.quantity) for hold in
+                Reservation.query.all()] == [(products[0].id, 5)]
+
+    def test_hold_cart_short_of_stock(self, session, cart, products):
+        cart.add_products({products[0].id: 2, products[1].id: 150})
+        session.commit()
+        assert Reservation.hold_cart(cart, ttl=600) == [products[1].id]
+        session.commit()
+        assert products[0].stock == 98
+        assert products[1].stock == 100
+        assert [hold.product_id for hold in Reservation.query.all()] == \
+            [products[0].id]
+
+    def test_hold_cart_skips_quantities_below_one(self, session, cart,
+                                                  products):
+        # Items saved before quantities were checked.
+        session.add_all([CartItem(cart=cart, product=products[0],
+                                  quantity=-5),
+                         CartItem(cart=cart, product=products[1],
+                                  quantity=0)])
+        session.commit()
+        assert Reservation.hold_cart(cart, ttl=600) == []
+        session.commit()
+        assert Reservation.query.count() == 0
+        assert [product.stock for product in products] == [100, 100]
+        with pytest.raises(ValueError):
+            Order.create_order_from_cart(cart)
+        assert [product.stock for product in products] == [100, 100]
+
+    def test_hold_cart_extends_expired_holds(self, session, cart, products):
+        cart.add_products({products[0].id: 2})
+        session.commit()
+        Reservation.hold_cart(cart, ttl=600)
+        session.commit()
+        hold = Reservation.query.one()
+        hold.expires_at = datetime.now() - timedelta(seconds=1)
+        session.commit()
+        # The stock is still held, so it's held again rather than given back
+        # by the sweeper as well.
+        assert Reservation.hold_cart(cart, ttl=600) == []
+        session.commit()
+        assert Reservation.sweep_expired() == 0
+        assert products[0].stock == 98
+
+    def test_expired_holds_give_way(self, session, cart, products):
+        other = Cart(user=User(username='other', name='', email='other',
+                               address=''))
+        other.add_products({products[1].id: 98})
+        cart.add_products({products[1].id: 3})
+        session.commit()
+        Reservation.hold_cart(other, ttl=600)
+        session.commit()
+        assert Reservation.hold_cart(cart, ttl=600) == [products[1].id]
+        session.commit()
+
+        # Once the other cart's hold has expired, it's given back rather
+        # than waiting for the sweeper.
+        hold = Reservation.query.filter_by(cart_id=other.id).one()
+        hold.expires_at = datetime.now() - timedelta(seconds=1)
+        session.commit()
+        assert Reservation.hold_cart(cart, ttl=600) == []
+        session.commit()
+        assert products[1].stock == 97
+        assert [(hold.cart_id, hold.quantity) for hold in
+                Reservation.query.all()] == [(cart.id, 3)]
+
+        # Placing an order does the same.
+        other.update_quantities({other.items[0].id: 97})
+        session.commit()
+        Reservation.hold_cart(other, ttl=-1)
+        cart.add_product(products[1].id, 2)
+        session.commit()
+        assert products[1].stock == 0
+        Order.create_order_from_cart(cart)
+        assert products[1].stock == 95
+        assert Reservation.query.count() == 0
+        with pytest.raises(ValueError):
+            Order.create_order_from_cart(other)
+
+    def test_failed_order_leaves_snapshot_alone(self, session, cart,
+                                                products):
+        other = Cart(user=User(username='other', name='', email='other',
+                               address=''))
+        other.add_products({products[0].id: 99})
+        cart.add_products({products[0].id: 2, products[1].id: 101})
+        session.commit()
+        Reservation.hold_cart(other, ttl=-1)
+        session.commit()
+        snapshot = catalog_snapshot()
+        assert snapshot.row(products[0].id) == (5.99, 1)
+
+        # The other cart's expired hold is given back in a savepoint, then
+        # the order fails on the second product and everything rolls back.
+        with pytest.raises(ValueError):
+            Order.create_order_from_cart(cart)
+        assert products[0].stock == 1
+        assert snapshot.row(products[0].id) == (5.99, 1)
+        assert snapshot.row(products[1].id) == (10.99, 100)
+
+    def test_order_claims_holds(self, session, cart, products,
+                                count_queries):
+        cart.add_products({products[0].id: 2, products[1].id: 3})
+        session.commit()
+        Reservation.hold_cart(cart, ttl=600)
+        session.commit()
+        with count_queries() as statements:
+            order = Order.create_order_from_cart(cart)
+        # The products aren't touched again.
+        assert not [statement for statement in statements
+                    if statement.startswith('UPDATE product')]
+        assert sorted((item.product_id, item.quantity)
+                      for item in order.items) == \
+            [(products[0].id, 2), (products[1].id, 3)]
+        assert products[0].stock == 98
+        assert products[1].stock == 97
+        assert Reservation.query.count() == 0
+
+    def test_order_after_cart_changed(self, session, cart, products):
+        cart.add_products({products[0].id: 2, products[1].id: 3})
+        session.commit()
+        Reservation.hold_cart(cart, ttl=600)
+        session.commit()
+        cart.remove_product(products[1].id)
+        cart.add_product(products[0].id, 4)
+        session.commit()
+        Order.create_order_from_cart(cart)
+        assert products[0].stock == 94
+        assert products[1].stock == 100
+        assert Reservation.query.count() == 0
+
+    def test_deleting_a_cart_releases_its_holds(self, session, user, cart,
+                                                products):
+        session.execute(sa.text('PRAGMA foreign_keys = ON'))
+        cart.add_products({products[0].id: 2, products[1].id: 3})
+        session.commit()
+        Reservation.hold_cart(cart, ttl=600)
+        session.commit()
+        snapshot = catalog_snapshot()
+        assert snapshot.row(products[0].id) == (5.99, 98)
+
+        # With its user.
+        session.delete(user)
+        session.commit()
+        assert Reservation.query.count() == 0
+        assert [product.stock for product in products] == [100, 100]
+        assert snapshot.row(products[0].id) == (5.99, 100)
+
+    def test_sweep_expired(self, session, cart, products):
+        cart.add_products({products[0].id: 2, products[1].id: 3})
+        session.commit()
+        Reservation.hold_cart(cart, ttl=600)
+        session.commit()
+        hold = Reservation.query.filter_by(product_id=products[1].id).one()
+        hold.expires_at = datetime.now() - timedelta(seconds=1)
+        session.commit()
+        assert Reservation.sweep_expired(batch_size=1) == 1
+        assert products[0].stock == 98
+        assert products[1].stock == 100
+        assert Reservation.query.count() == 1
+
+        # An order made after a hold was swept takes the stock again.
+        Order.create_order_from_cart(cart)
+        assert products[1].stock == 97
+        assert Reservation.query.count() == 0
+
+    def test_take_stocks(self, session, products):
+        ids = [product.id for product in products]
+        assert not Product.take_stocks({ids[0]: 10, ids[1]: 101})
+        assert Product.take_stocks({ids[0]: 10, ids[1]: 100})
+        session.commit()
+        assert [product.stock for product in products] == [90, 0]
+
+    def test_failed_take_stocks_keeps_earlier_changes(self, session,
+                                                      products):
+        snapshot = catalog_snapshot()
+        assert snapshot.row(products[0].id) == (5.99, 100)
+        products[0].price = 4.5
+        session.flush()
+        # The savepoint is rolled back, but the price change isn't.
+        assert not Product.take_stocks({products[1].id: 101})
+        session.commit()
+        assert snapshot.row(products[0].id) == (4.5, 100)
@@ -0,0 +1,157 @@
+import random
+import time
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.analytics import load_columns, sales_analytics, summarize
+from app.extensions import db
+from app.models import Order, OrderItem, Product, User
+
+
+def add_order(session, user, products, day, quantities):
+    session.add(Order(user_id=user.id, order_date=day, items=[
+        OrderItem(product_id=product.id, quantity=quantity,
+                  price=product.price)
+        for product, quantity in zip(products, quantities) if quantity]))
+
+
+def naive_summary(period):
+    """Works out the same figures as summarize, a Python object at a time."""
+    revenue, baskets, orders_per_customer, sold = {}, [], {}, {}
+    for order in Order.query.all():
+        day = order.order_date.date()
+        if period == 'week':
+            day -= timedelta(days=day.weekday())
+        elif period == 'month':
+            day = day.replace(day=1)
+        units = value = 0
+        for item in order.items:
+            units += item.quantity
+            value += item.quantity * item.price
+            sold[item.product_id] = sold.get(item.product_id, 0) + \
+                item.quantity
+            previous = revenue.get(day, (0, 0))
+            revenue[day] = (previous[0] + item.quantity,
+                            previous[1] + item.quantity * item.price)
+        baskets.append((units, value))
+        orders_per_customer[order.user_id] = \
+            orders_per_customer.get(order.user_id, 0) + 1
+    sell_through = []
+    for product in Product.query.order_by(Product.id):
+        count = sold.get(product.id, 0)
+        available = count + product.stock
+        sell_through.append({
+            'id': product.id, 'name': product.name, 'sold': count,
+            'stock': product.stock,
+            'rate': round(count / available, 4) if available else 0.0})
+    sell_through.sort(key=lambda row: -row['rate'])
+    repeat = sum(count > 1 for count in orders_per_customer.values())
+    return {
+        'period': period,
+        'revenue': [{'start': day.isoformat(), 'units': units,
+                     'revenue': round(total, 2)}
+                    for day, (units, total) in sorted(revenue.items())],
+        'orders': len(baskets),
+        'average_basket': {
+            'units': round(sum(units for units, _ in baskets) /
+                           len(baskets), 2),
+            'value': round(sum(value for _, value in baskets) /
+                           len(baskets), 2)},
+        'customers': len(orders_per_customer),
+        'repeat_customer_rate': round(repeat / len(orders_per_customer), 4),
+        'sell_through': sell_through}
+
+
+class TestSalesAnalytics:
+    @pytest.fixture
+    def orders(self, session, user, products):
+        other = User(username='other', name='other', email='other',
+                     address='')
+        session.add(other)
+        session.commit()
+        # Monday 9 March, Tuesday 10 March and Monday 16 March.
+        add_order(session, user, products, datetime(2026, 3, 9, 23), [1, 2])
+        add_order(session, user, products, datetime(2026, 3, 10, 1), [3, 0])
+        add_order(session, other, products, datetime(2026, 3, 16), [0, 1])
+        session.commit()
+
+    def test_summarize(self, orders, products):
+        columns = load_columns()
+        summary = summarize(columns, 'day')
+        assert summary['revenue'] == [
+            {'start': '2026-03-09', 'units': 3, 'revenue': 27.97},
+            {'start': '2026-03-10', 'units': 3, 'revenue': 17.97},
+            {'start': '2026-03-16', 'units': 1, 'revenue': 10.99}]
+        assert summary['orders'] == 3
+        assert summary['average_basket'] == {'units': 2.33, 'value': 18.98}
+        assert summary['customers'] == 2
+        assert summary['repeat_customer_rate'] == 0.5
+        assert summary['sell_through'] == [
+            {'id': products[0].id, 'name': 'test_product_1', 'sold': 4,
+             'stock': 100, 'rate': 0.0385},
+            {'id': products[1].id, 'name': 'test_product_2', 'sold': 3,
+             'stock': 100, 'rate': 0.0291}]
+        assert summarize(columns, 'week')['revenue'] == [
+            {'start': '2026-03-09', 'units': 6, 'revenue': 45.94},
+            {'start': '2026-03-16', 'units': 1, 'revenue': 10.99}]
+        assert summarize(columns, 'month')['revenue'] == [
+            {'start': '2026-03-01', 'units': 7, 'revenue': 56.93}]
+        with pytest.raises(ValueError):
+            summarize(columns, 'year')
+
+    def test_no_orders(self, session):
+        summary = summarize(load_columns())
+        assert summary['revenue'] == []
+        assert summary['orders'] == summary['customers'] == 0
+        assert summary['average_basket'] == {'units': 0.0, 'value': 0.0}
+        assert summary['repeat_customer_rate'] == 0.0
+        assert summary['sell_through'] == []
+
+    def test_kept_until_orders_are_added(self, session, orders, user,
+                                         products):
+        assert sales_analytics().summary()['sell_through'][0]['stock'] == 100
+        products[0].stock = 50
+        session.commit()
+        assert sales_analytics().summary()['sell_through'][0]['stock'] == 100
+        add_order(session, user, products, datetime(2026, 3, 17), [1, 0])
+        session.commit()
+        summary = sales_analytics().summary()
+        assert summary['orders'] == 4
+        assert summary['sell_through'][0]['stock'] == 50
+        assert summary['sell_through'][0]['sold'] == 5
+
+
+def test_benchmark_against_orm(session):
+    """Works out the figures for a few thousand orders both ways, checks
+    they agree, and prints how long each took."""
+    random.seed(7)
+    users = [User(username=f'user_{i}', name='', email=f'user_{i}',
+                  address='') for i in range(200)]
+    products = [Product(name=f'product_{i}', description='',
+                        price=round(random.uniform(1, 100), 2),
+                        stock=random.randint(0, 500)) for i in range(50)]
+    session.add_all(users + products)
+    session.commit()
+    start = datetime(2026, 1, 1)
+    for _ in range(2000):
+        add_order(session, random.choice(users),
+                  random.sample(products, 3),
+                  start + timedelta(minutes=random.randint(0, 120 * 24 * 60)),
+                  [random.randint(1, 4) for _ in range(3)])
+    session.commit()
+
+    began = time.perf_counter()
+    vectorized = summarize(load_columns(), 'week')
+    vectorized_time = time.perf_counter() - began
+    db.session.expunge_all()
+    began = time.perf_counter()
+    naive = naive_summary('week')
+    naive_time = time.perf_counter() - began
+    print(f'NumPy {vectorized_time * 1000:.0f} ms, '
+          f'ORM {naive_time * 1000:.0f} ms')
+
+    assert vectorized['orders'] == naive['orders'] == 2000
+    for key in ('revenue', 'average_basket', 'customers',
+                'repeat_customer_rate', 'sell_through'):
+        assert vectorized[key] == naive[key]
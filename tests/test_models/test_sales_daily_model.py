@@ -0,0 +1,101 @@
+from datetime import date, datetime
+
+import pytest
+import sqlalchemy as sa
+
+from app.models import Order, OrderItem, SalesDaily
+
+
+def add_order(session, user, products, day, quantities):
+    session.add(Order(user_id=user.id, order_date=day, items=[
+        OrderItem(product_id=product.id, quantity=quantity,
+                  price=product.price)
+        for product, quantity in zip(products, quantities) if quantity]))
+
+
+class TestSalesDailyModel:
+    def test_orders_add_to_rollup(self, session, cart, products):
+        cart.add_products({products[0].id: 2, products[1].id: 1})
+        session.commit()
+        order = Order.create_order_from_cart(cart)
+        cart.add_product(products[0].id, 3)
+        session.commit()
+        Order.create_order_from_cart(cart)
+        rows = sorted((row.day, row.product_id, row.units,
+                       round(row.revenue, 2))
+                      for row in SalesDaily.query.all())
+        today = order.order_date.date()
+        assert rows == [(today, products[0].id, 5, 29.95),
+                        (today, products[1].id, 1, 10.99)]
+
+    def test_rebuild(self, session, user, products):
+        add_order(session, user, products, datetime(2026, 3, 9, 23), [1, 2])
+        add_order(session, user, products, datetime(2026, 3, 10, 1), [3, 0])
+        add_order(session, user, products, datetime(2026, 3, 10, 9), [1, 1])
+        session.commit()
+        assert SalesDaily.rebuild(batch_size=2) == 3
+        rows = sorted((row.day, row.product_id, row.units,
+                       round(row.revenue, 2))
+                      for row in SalesDaily.query.all())
+        assert rows == [
+            (date(2026, 3, 9), products[0].id, 1, 5.99),
+            (date(2026, 3, 9), products[1].id, 2, 21.98),
+            (date(2026, 3, 10), products[0].id, 4, 23.96),
+            (date(2026, 3, 10), products[1].id, 1, 10.99)]
+        # Rebuilding again starts over.
+        assert SalesDaily.rebuild() == 3
+        assert SalesDaily.query.count() == 4
+
+    def test_rebuild_commits_each_range_of_days(self, session, user,
+                                                products):
+        """Each range of days is rebuilt in a short transaction, so
+        checkouts aren't held up for the whole rebuild."""
+        for day in (9, 10, 10, 11):
+            add_order(session, user, products, datetime(2026, 3, day), [1, 1])
+        session.add(SalesDaily(day=date(2026, 3, 1), product_id=products[0].id,
+                               units=5, revenue=1.0))
+        session.commit()
+        commits = []
+
+        def record(session):
+            commits.append(session)
+
+        sa.event.listen(session(), 'after_commit', record)
+        try:
+            assert SalesDaily.rebuild(batch_size=2) == 4
+        finally:
+            sa.event.remove(session(), 'after_commit', record)
+        # Up to 10 March (the second order's day), then 11 March onwards.
+        assert len(commits) == 2
+        assert sorted((row.day.day, row.product_id, row.units)
+                      for row in SalesDaily.query.all()) == [
+            (9, products[0].id, 1), (9, products[1].id, 1),
+            (10, products[0].id, 2), (10, products[1].id, 2),
+            (11, products[0].id, 1), (11, products[1].id, 1)]
+
+    def test_revenue_by(self, session, user, products):
+        # Monday 2 March, Sunday 8 March, Monday 9 March and 1 April.
+        for day in (2, 8, 9):
+            add_order(session, user, products, datetime(2026, 3, day), [1, 0])
+        add_order(session, user, products, datetime(2026, 4, 1), [0, 1])
+        session.commit()
+        SalesDaily.rebuild()
+        assert SalesDaily.revenue_by('day', end=date(2026, 3, 8)) == [
+            (date(2026, 3, 2), 1, 5.99), (date(2026, 3, 8), 1, 5.99)]
+        assert SalesDaily.revenue_by('week') == [
+            (date(2026, 3, 2), 2, 11.98), (date(2026, 3, 9), 1, 5.99),
+            (date(2026, 3, 30), 1, 10.99)]
+        assert SalesDaily.revenue_by('month', date(2026, 3, 3)) == [
+            (date(2026, 3, 1), 2, 11.98), (date(2026, 4, 1), 1, 10.99)]
+        with pytest.raises(ValueError):
+            SalesDaily.revenue_by('year')
+
+    def test_top_products(self, session, user, products):
+        add_order(session, user, products, datetime(2026, 3, 9), [3, 1])
+        add_order(session, user, products, datetime(2026, 3, 10), [0, 1])
+        session.commit()
+        SalesDaily.rebuild()
+        assert SalesDaily.top_products() == [
+            (products[1], 2, 21.98), (products[0], 3, 17.97)]
+        assert SalesDaily.top_products(1, start=date(2026, 3, 10)) == [
+            (products[1], 1, 10.99)]
@@ -1,6 +1,13 @@
 ﻿"""Test access to the admin dashboard, ability to delete users, and
 the sales report."""
-from app.models import User
+import gzip
+import os
+from datetime import datetime, timedelta
+
+import pytest
+
+from app.models import Order, OrderItem, SalesDaily, User
+from app.report_jobs import ReportJobs
 
 
 def test_admin_page_success(session, client, admin):
@@ -69,3 +76,218 @@ def test_sales_report(session, client, admin, order):
         date = order.order_date.strftime('%Y-%m-%d')
         assert bytes(date, 'utf-8') in response.data
 
+
+def test_sales_report_is_streamed(session, client, admin, test_app,
+                                  products, count_queries):
+    """Test the sales report is sent in chunks, read with one query."""
+    test_app.config['SALES_REPORT_BATCH_SIZE'] = 2
+    for i in range(5):
+        session.add(Order(user_id=admin.id, order_date=datetime.now(),
+                          items=[OrderItem(product_id=products[0].id,
+                                           quantity=i + 1, price=5.99)]))
+    session.commit()
+    with client:
+        client.post('/login', data=dict(username='test_admin_username',
+                                        password='password'),
+                    follow_redirects=True)
+        with count_queries() as statements:
+            response = client.get('/admin/sales_report')
+            assert response.is_streamed
+            chunks = list(response.response)
+        # The header, then three batches of rows.
+        assert len(chunks) == 4
+        assert b''.join(chunks).count(b'\n') == 6
+        assert len([statement for statement in statements
+                    if 'order_item' in statement]) == 1
+
+
+def test_sales_report_filters(session, client, admin, products):
+    """Test the sales report can be narrowed down by date and resumed."""
+    day = datetime(2026, 3, 10, 12)
+    orders = [Order(user_id=admin.id, order_date=day + timedelta(days=i),
+                    items=[OrderItem(product_id=products[0].id, quantity=1,
+                                     price=5.99)])
+              for i in (-1, 0, 0, 1)]
+    session.add_all(orders)
+    session.commit()
+
+    def report(query):
+        response = client.get(f'/admin/sales_report?{query}')
+        order_ids = [int(line.split(',')[0]) for line in
+                     response.data.decode().splitlines()[1:]]
+        return order_ids, response.headers['X-Resume-Cursor']
+
+    with client:
+        client.post('/login', data=dict(username='test_admin_username',
+                                        password='password'),
+                    follow_redirects=True)
+        ids = [order.id for order in orders]
+        assert report('from=2026-03-10&to=2026-03-10') == \
+            (ids[1:3], str(ids[2]))
+        assert report('from=2026-03-10') == (ids[1:], str(ids[3]))
+        assert report('to=2026-03-09') == (ids[:1], str(ids[0]))
+        assert report(f'since_id={ids[1]}') == (ids[2:], str(ids[3]))
+        assert report(f'since_id={ids[3]}') == ([], str(ids[3]))
+        assert report('from=2026-04-01') == ([], '0')
+        for query in ('from=10/03/2026', 'since_id=last'):
+            response = client.get(f'/admin/sales_report?{query}')
+            assert response.status_code == 400
+
+
+def test_sales_report_leaves_recent_orders(session, client, admin, test_app,
+                                           products):
+    """Test orders that may not all be committed yet are left for the next
+    report, so resuming from the cursor can't skip one."""
+    test_app.config['SALES_REPORT_CURSOR_LAG'] = 60
+    orders = [Order(user_id=admin.id, order_date=datetime.now() - ago,
+                    items=[OrderItem(product_id=products[0].id, quantity=1,
+                                     price=5.99)])
+              for ago in (timedelta(minutes=2), timedelta(0))]
+    session.add_all(orders)
+    session.commit()
+    with client:
+        client.post('/login', data=dict(username='test_admin_username',
+                                        password='password'),
+                    follow_redirects=True)
+        response = client.get('/admin/sales_report')
+        assert response.headers['X-Resume-Cursor'] == str(orders[0].id)
+        assert response.data.decode().count('\n') == 2
+
+        test_app.config['SALES_REPORT_CURSOR_LAG'] = 0
+        response = client.get(f'/admin/sales_report?since_id={orders[0].id}')
+        assert response.headers['X-Resume-Cursor'] == str(orders[1].id)
+        assert response.data.decode().splitlines()[1].startswith(
+            f'{orders[1].id},')
+
+
+def test_sales_rollup_reports(session, client, admin, products,
+                              count_queries):
+    """Test the revenue and top product reports read the daily rollup."""
+    for day, quantity in ((9, 1), (10, 2), (16, 3)):
+        session.add(Order(user_id=admin.id,
+                          order_date=datetime(2026, 3, day),
+                          items=[OrderItem(product_id=products[0].id,
+                                           quantity=quantity, price=5.99)]))
+    session.commit()
+    SalesDaily.rebuild()
+    with client:
+        client.post('/login', data=dict(username='test_admin_username',
+                                        password='password'),
+                    follow_redirects=True)
+        with count_queries() as statements:
+            weekly = client.get('/admin/reports/revenue?period=week'
+                                '&from=2026-03-01&to=2026-03-31')
+            top = client.get('/admin/reports/top_products?n=5')
+        assert weekly.json == {'period': 'week', 'rows': [
+            {'start': '2026-03-09', 'units': 3, 'revenue': 17.97},
+            {'start': '2026-03-16', 'units': 3, 'revenue': 17.97}]}
+        assert top.json == {'products': [
+            {'id': products[0].id, 'name': 'test_product_1', 'units': 6,
+             'revenue': 35.94}]}
+        assert not [statement for statement in statements
+                    if 'order_item' in statement]
+
+        for path in ('revenue?period=year', 'revenue?from=soon',
+                     'top_products?n=0', 'top_products?n=all'):
+            response = client.get(f'/admin/reports/{path}')
+            assert response.status_code == 400
+            assert 'error' in response.json
+
+
+def test_sales_report_job(session, client, admin, test_app, order,
+                          tmp_path):
+    """Test the sales report can be written in the background, and is
+    written again once there are new orders."""
+    jobs = test_app.extensions['report_jobs'] = ReportJobs(test_app,
+                                                           str(tmp_path))
+    with client:
+        client.post('/login', data=dict(username='test_admin_username',
+                                        password='password'),
+                    follow_redirects=True)
+        response = client.post('/admin/report_jobs/sales_report')
+        assert response.status_code == 202
+        job_id = response.json['id']
+        jobs.get(job_id).future.result(timeout=10)
+
+        status = client.get(response.headers['Location']).json
+        assert status['status'] == 'done'
+        download = client.get(status['download_url'])
+        assert download.mimetype == 'application/gzip'
+        assert gzip.decompress(download.data) == \
+            client.get('/admin/sales_report').data
+
+        # The same report is served from the same file.
+        response = client.post('/admin/report_jobs/sales_report')
+        assert response.status_code == 200
+        assert response.json['id'] == job_id
+
+        # A new order means a new report, but one of an earlier day doesn't
+        # change.
+        earlier = (order.order_date - timedelta(days=1)).date()
+        response = client.post(f'/admin/report_jobs/sales_report?to={earlier}')
+        earlier_id = response.json['id']
+        jobs.get(earlier_id).future.result(timeout=10)
+        session.add(Order(user_id=admin.id, order_date=datetime.now(),
+                          items=[OrderItem(product_id=order.items[0]
+                                           .product_id,
+                                           quantity=1, price=5.99)]))
+        session.commit()
+        response = client.post('/admin/report_jobs/sales_report')
+        assert response.json['id'] != job_id
+        jobs.get(response.json['id']).future.result(timeout=10)
+        response = client.post(f'/admin/report_jobs/sales_report?to={earlier}')
+        assert response.json['id'] == earlier_id
+
+        assert client.get('/admin/report_jobs/nope').status_code == 404
+        assert client.get('/admin/report_jobs/nope/download'
+                          ).status_code == 404
+        assert client.post('/admin/report_jobs/sales_report?from=soon'
+                           ).status_code == 400
+
+
+def test_report_jobs_need_a_private_directory(test_app, tmp_path):
+    """Test report files are kept apart from other users' files."""
+    # The directory isn't made until a report needs it.
+    jobs = ReportJobs(test_app, str(tmp_path / 'jobs'))
+    assert not os.path.exists(tmp_path / 'jobs')
+    assert jobs.get('nope') is None
+    assert os.stat(tmp_path / 'jobs').st_mode & 0o777 == 0o700
+    shared = tmp_path / 'shared'
+    shared.mkdir()
+    shared.chmod(0o777)
+    with pytest.raises(RuntimeError):
+        ReportJobs(test_app, str(shared)).get('nope')
+
+
+def test_analytics_report(session, client, admin, order, count_queries):
+    """Test the sales analytics are sent as JSON, and read again only once
+    new orders are placed."""
+    with client:
+        client.post('/login', data=dict(username='test_admin_username',
+                                        password='password'),
+                    follow_redirects=True)
+        response = client.get('/admin/reports/analytics?period=month')
+        assert response.status_code == 200
+        assert response.json['orders'] == 1
+        assert response.json['revenue'] == [
+            {'start': order.order_date.strftime('%Y-%m-01'), 'units': 2,
+             'revenue': 16.98}]
+        with count_queries() as statements:
+            response = client.get('/admin/reports/analytics?period=week')
+        assert response.json['average_basket'] == {'units': 2.0,
+                                                   'value': 16.98}
+        assert not [statement for statement in statements
+                    if 'order_item' in statement]
+
+        session.add(Order(user_id=admin.id, order_date=datetime.now(),
+                          items=[OrderItem(product_id=order.items[0]
+                                           .product_id,
+                                           quantity=1, price=5.99)]))
+        session.commit()
+        response = client.get('/admin/reports/analytics')
+        assert response.json['orders'] == 2
+        assert response.json['repeat_customer_rate'] == 0.0
+
+        response = client.get('/admin/reports/analytics?period=year')
+        assert response.status_code == 400
+        assert 'error' in response.json
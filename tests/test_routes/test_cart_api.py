@@ -0,0 +1,121 @@
+import re
+import time
+
+from app.models import Cart
+
+
+def login(client):
+    client.post('/login', data=dict(username='test_username',
+                                    password='correct_password'))
+
+
+def test_cart_api(session, client, user, products):
+    login(client)
+    assert client.get('/api/cart').json == {
+        'items': [], 'item_count': 0, 'subtotal': 0}
+
+    response = client.post('/api/cart/items', json={
+        'product_id': products[0].id, 'quantity': 2})
+    line = response.json['line']
+    assert line['product_id'] == products[0].id
+    assert line['quantity'] == 2
+    assert response.json['item_count'] == 2
+    assert response.json['subtotal'] == 11.98
+
+    response = client.patch(f'/api/cart/items/{line["id"]}',
+                            json={'quantity': 3})
+    assert response.json['line']['total'] == 17.97
+    assert response.json['item_count'] == 3
+
+    client.post('/api/cart/items', json={'product_id': products[1].id})
+    response = client.delete(f'/api/cart/items/{line["id"]}')
+    assert response.json == {'line': None, 'item_count': 1,
+                             'subtotal': 10.99}
+    assert len(client.get('/api/cart').json['items']) == 1
+
+
+def test_cart_api_errors(session, client, user, admin, products):
+    other_cart = Cart(user=admin)
+    session.add(other_cart)
+    other_cart.add_product(products[0].id)
+    session.commit()
+    login(client)
+    assert client.post('/api/cart/items', json={
+        'product_id': products[0].id, 'quantity': 0}).status_code == 400
+    response = client.post('/api/cart/items', json={'product_id': 9999})
+    assert response.status_code == 404
+    assert response.json == {'error': 'No such product.'}
+    response = client.patch(f'/api/cart/items/{other_cart.items[0].id}',
+                            json={'quantity': 5})
+    assert response.status_code == 404
+    assert other_cart.items[0].quantity == 1
+
+
+def test_session_cart_api(session, client, products):
+    response = client.post('/api/cart/items', json={
+        'product_id': products[1].id, 'quantity': 2})
+    assert response.json['line']['id'] == products[1].id
+    assert response.json['subtotal'] == 21.98
+    response = client.patch(f'/api/cart/items/{products[1].id}',
+                            json={'quantity': 1})
+    assert response.json['line']['quantity'] == 1
+    assert client.delete(f'/api/cart/items/{products[0].id}'
+                         ).status_code == 404
+    response = client.delete(f'/api/cart/items/{products[1].id}')
+    assert response.json == {'line': None, 'item_count': 0, 'subtotal': 0}
+
+
+def csrf_token(response):
+    return re.search(rb'name="csrf-token" content="([^"]+)"',
+                     response.data).group(1).decode()
+
+
+def test_cart_api_requires_csrf_token(session, test_app, client, product):
+    test_app.config['WTF_CSRF_ENABLED'] = True
+    token = csrf_token(client.get('/catalog'))
+    assert client.post('/api/cart/items', json={
+        'product_id': product.id}).status_code == 400
+    assert client.post('/api/cart/items', json={'product_id': product.id},
+                       headers={'X-CSRFToken': token}).status_code == 200
+    assert client.post(f'/add_to_cart/{product.id}',
+                       data={'quantity': 1}).status_code == 400
+
+
+def test_expired_csrf_token_can_be_refreshed(session, test_app, product,
+                                             monkeypatch):
+    test_app.config['WTF_CSRF_ENABLED'] = True
+    client = test_app.test_client()
+    data = {'product_id': product.id}
+    # Each request gets its own app context, so the token Flask-WTF keeps
+    # on g isn't reused.
+    with test_app.app_context():
+        token = csrf_token(client.get('/catalog'))
+    # An hour later (WTF_CSRF_TIME_LIMIT), the page's token has expired.
+    later = time.time() + test_app.config['WTF_CSRF_TIME_LIMIT'] + 1
+    monkeypatch.setattr('itsdangerous.timed.time.time', lambda: later)
+    with test_app.app_context():
+        assert client.post('/api/cart/items', json=data,
+                           headers={'X-CSRFToken': token}).status_code == 400
+    with test_app.app_context():
+        response = client.get('/api/csrf_token')
+        assert 'no-store' in response.headers['Cache-Control']
+    with test_app.app_context():
+        assert client.post('/api/cart/items', json=data, headers={
+            'X-CSRFToken': response.json['csrf_token']}).status_code == 200
+
+
+def test_cached_pages_carry_each_visitors_token(session, test_app, product):
+    test_app.config['WTF_CSRF_ENABLED'] = True
+    first, second = test_app.test_client(), test_app.test_client()
+    # Each visitor gets their own app context, as they would in a server,
+    # so the token Flask-WTF keeps on g isn't shared between them.
+    with test_app.app_context():
+        first.get(f'/items_page/{product.id}')
+    with test_app.app_context():
+        second.get('/')
+        response = second.get(f'/items_page/{product.id}')
+        assert response.headers['X-Cache'] == 'HIT'
+        assert b'__response_cache_csrf_token__' not in response.data
+        token = csrf_token(response)
+        assert second.post(f'/add_to_cart/{product.id}', data={
+            'quantity': 1, 'csrf_token': token}).status_code == 302
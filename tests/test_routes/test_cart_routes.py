@@ -1,4 +1,9 @@
-﻿def test_cart_route(session, client, user, cart, product):
+﻿import sqlalchemy as sa
+
+from app.models import Cart, Product, Reservation
+
+
+def test_cart_route(session, client, user, cart, product):
     """Test the cart route returns a page with the product info in it."""
     with client:
         client.post('/login', data=dict(username='test_username',
@@ -47,6 +52,17 @@ def test_add_to_cart(session, client, user, cart, product):
         assert cart.items[0].product.id == product.id
         assert cart.items[0].quantity == 2
 
+def test_add_to_cart_twice_merges_items(session, client, user, cart, product):
+    with client:
+        client.post('/login', data=dict(username='test_username',
+                                        password='correct_password'),
+                    follow_redirects=True)
+        client.post(f'/add_to_cart/{product.id}', data=dict(quantity=2))
+        client.post(f'/add_to_cart/{product.id}', data=dict(quantity=3))
+        session.expire_all()
+        assert len(cart.items) == 1
+        assert cart.items[0].quantity == 5
+
 def test_remove_from_cart(session, client, user, cart, product):
     with client:
         client.post('/login', data=dict(username='test_username',
@@ -75,3 +91,90 @@ def test_update_cart_item(session, client, user, cart, product):
                                follow_redirects=True)
         assert response.status_code == 200
         assert cart.items[0].quantity == 5
+
+def test_cart_page_query_count_is_fixed(session, client, user, cart,
+                                       count_queries):
+    def page_queries(path):
+        with count_queries() as statements:
+            assert client.get(path).status_code == 200
+        return len(statements)
+
+    with client:
+        client.post('/login', data=dict(username='test_username',
+                                        password='correct_password'),
+                    follow_redirects=True)
+        counts = []
+        for size in (1, 5):
+            products = [Product(name=f'product_{size}_{i}', description='',
+                                price=1.0, stock=10) for i in range(size)]
+            session.add_all(products)
+            session.commit()
+            cart.clear_cart()
+            # Drop the stock held by the last round's checkout page.
+            session.execute(sa.delete(Reservation))
+            for product in products:
+                cart.add_product(product.id)
+            session.commit()
+            counts.append((page_queries('/cart'),
+                           page_queries('/checkout')))
+        assert counts[0] == counts[1]
+
+def test_nav_shows_cart_item_count(session, client, user, cart, product):
+    with client:
+        client.post('/login', data=dict(username='test_username',
+                                        password='correct_password'),
+                    follow_redirects=True)
+        assert b'cart-badge' not in client.get('/catalog').data
+        client.post(f'/add_to_cart/{product.id}', data=dict(quantity=3))
+        response = client.get('/catalog')
+        assert b'<span class="cart-badge">3</span>' in response.data
+
+def test_update_cart_many_items(session, client, user, cart, products):
+    with client:
+        client.post('/login', data=dict(username='test_username',
+                                        password='correct_password'),
+                    follow_redirects=True)
+        cart.add_products({products[0].id: 1, products[1].id: 1})
+        session.commit()
+        first, second = sorted(cart.items, key=lambda item: item.product_id)
+        response = client.post('/update_cart', data={
+            f'quantity-{first.id}': '4', f'quantity-{second.id}': '0'})
+        assert response.status_code == 302
+        assert response.location == '/cart'
+        response = client.get('/cart')
+        assert b'$23.96' in response.data
+
+        response = client.post('/update_cart', json={
+            'quantities': {str(first.id): 2}})
+        assert response.json == {
+            'items': [{'id': first.id, 'product_id': products[0].id,
+                       'name': 'test_product_1', 'price': 5.99,
+                       'quantity': 2, 'total': 11.98}],
+            'item_count': 2, 'subtotal': 11.98}
+
+def test_update_cart_checks_ownership(session, client, user, admin, cart,
+                                      products):
+    other_cart = Cart(user=admin)
+    session.add(other_cart)
+    other_cart.add_product(products[1].id)
+    cart.add_product(products[0].id)
+    session.commit()
+    mine, theirs = cart.items[0], other_cart.items[0]
+    with client:
+        client.post('/login', data=dict(username='test_username',
+                                        password='correct_password'),
+                    follow_redirects=True)
+        response = client.post('/update_cart', data={
+            f'quantity-{mine.id}': '5', f'quantity-{theirs.id}': '0'})
+        assert response.status_code == 404
+        session.expire_all()
+        assert mine.quantity == 1
+        assert theirs.quantity == 1
+
+def test_update_session_cart(session, client, products):
+    client.post(f'/add_to_cart/{products[0].id}', data=dict(quantity=1))
+    client.post(f'/add_to_cart/{products[1].id}', data=dict(quantity=1))
+    response = client.post('/update_cart', json={'quantities': {
+        str(products[0].id): 3, str(products[1].id): 0}})
+    assert response.json['item_count'] == 3
+    assert response.json['subtotal'] == 17.97
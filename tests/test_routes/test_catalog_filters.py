@@ -0,0 +1,111 @@
+import time
+
+import sqlalchemy as sa
+
+from app.catalog import CatalogFilters, PriceFacet, catalog_snapshot
+from app.models import Product
+
+
+def add_products(session):
+    products = [
+        Product(name='Smart Plug', description='Mini Wi-Fi Smart Plug',
+                price=14.5, stock=100),
+        Product(name='Wireless Mouse', description='Ergonomic Wireless Mouse',
+                price=19.75, stock=0),
+        Product(name='Wireless Charger', description='Wireless Charging Pad',
+                price=19.75, stock=150),
+        Product(name='Smart Doorbell', description='Wi-Fi Video Doorbell',
+                price=119.9, stock=50),
+        Product(name='Smart TV', description='55" 4K Ultra HD LED TV',
+                price=599.99, stock=3),
+    ]
+    session.add_all(products)
+    session.commit()
+    return products
+
+
+def test_paginate_by_price(session):
+    add_products(session)
+    filters = CatalogFilters(sort='price')
+    first = filters.paginate(Product.query, per_page=2)
+    assert [p.name for p in first.items] == ['Smart Plug', 'Wireless Mouse']
+    # Equal prices are paged through by id.
+    second = filters.paginate(Product.query, after=first.next_cursor,
+                              per_page=2)
+    assert [p.name for p in second.items] == ['Wireless Charger',
+                                              'Smart Doorbell']
+    back = filters.paginate(Product.query, before=second.prev_cursor,
+                            per_page=2)
+    assert back == first
+
+    descending = CatalogFilters(sort='-stock', in_stock=True, max_price=200)
+    page = descending.paginate(Product.query, per_page=10)
+    assert [p.name for p in page.items] == ['Wireless Charger', 'Smart Plug',
+                                            'Smart Doorbell']
+
+
+def test_from_args_ignores_bad_values():
+    filters = CatalogFilters.from_args({'min_price': 'cheap', 'max_price': '-1',
+                                        'in_stock': '1', 'sort': 'drop table'})
+    assert filters == CatalogFilters(in_stock=True)
+
+
+def test_price_facets(session):
+    products = add_products(session)
+    snapshot = catalog_snapshot()
+    snapshot.buckets = (0, 25, 200)
+    assert snapshot.price_facets() == [PriceFacet(0, 25, 3),
+                                       PriceFacet(25, 200, 1),
+                                       PriceFacet(200, None, 1)]
+    assert snapshot.price_facets(in_stock=True)[0].count == 2
+    assert snapshot.price_facets(product_ids=[products[0].id])[0].count == 1
+
+    # The snapshot follows committed changes.
+    products[1].stock = 5
+    products[4].price = 20.0
+    session.delete(products[3])
+    session.commit()
+    assert snapshot.price_facets(in_stock=True) == [PriceFacet(0, 25, 4),
+                                                    PriceFacet(25, 200, 0),
+                                                    PriceFacet(200, None, 0)]
+
+
+def test_snapshot_is_read_again_in_background_when_old(session, monkeypatch):
+    products = add_products(session)
+    snapshot = catalog_snapshot()
+    assert snapshot.row(products[0].id) == (14.5, 100)
+    # A Core update isn't reported, like a commit made by another process.
+    session.execute(sa.update(Product).where(Product.id == products[0].id)
+                    .values(stock=0))
+    session.commit()
+    assert snapshot.row(products[0].id) == (14.5, 100)
+    later = time.monotonic() + snapshot.rebuild.max_age + 1
+    monkeypatch.setattr(time, 'monotonic', lambda: later)
+    # The old snapshot is used while the new one is read in the background.
+    assert snapshot.row(products[0].id) == (14.5, 100)
+    snapshot.rebuild.join()
+    assert snapshot.row(products[0].id) == (14.5, 0)
+
+
+def test_catalog_filters_and_facets(session, client):
+    add_products(session)
+    response = client.get('/catalog?in_stock=1&sort=-price&max_price=200')
+    assert response.status_code == 200
+    html = response.data.decode()
+    assert 'Wireless Mouse' not in html
+    assert 'Smart TV' not in html
+    assert html.index('Smart Doorbell') < html.index('Smart Plug')
+    # $0 - $24.99 has the plug and charger in stock.
+    assert '(2)' in html
+
+
+def test_search_filters_and_sort(session, client):
+    add_products(session)
+    response = client.get('/search?query=wireless&in_stock=1')
+    assert b'Wireless Charger' in response.data
+    assert b'Wireless Mouse' not in response.data
+
+    response = client.get('/search?query=smart&sort=-price')
+    html = response.data.decode()
+    assert (html.index('Smart TV') < html.index('Smart Doorbell') <
+            html.index('Smart Plug'))
@@ -1,4 +1,6 @@
-﻿from app.models import Order
+﻿import re
+
+from app.models import Order, Reservation
 
 
 def test_checkout_no_cart(session, client, user):
@@ -98,3 +100,38 @@ def test_checkout_order_success_page_failure(session, client, user):
         response = client.get('/order_success', follow_redirects=True)
         assert response.status_code == 200
         assert b'No order number found' in response.data
+
+def test_checkout_page_holds_stock(session, client, user, cart, products):
+    with client:
+        client.post('/login', data=dict(username='test_username',
+                                        password='correct_password'),
+                    follow_redirects=True)
+        cart.add_products({products[0].id: 2, products[1].id: 150})
+        session.commit()
+        response = client.get('/checkout')
+        assert b'Only 100 of test_product_2 left in stock.' in response.data
+        assert products[0].stock == 98
+        assert Reservation.query.filter_by(cart_id=cart.id).count() == 1
+
+def test_checkout_submitted_twice(session, client, user, cart, product):
+    with client:
+        client.post('/login', data=dict(username='test_username',
+                                        password='correct_password'),
+                    follow_redirects=True)
+        cart.add_product(product.id, 2)
+        session.commit()
+        page = client.get('/checkout').data.decode()
+        key = re.search(r'name="idempotency_key" type="hidden" '
+                        r'value="([0-9a-f]+)"', page).group(1)
+        data = {'name': user.name, 'address': user.address,
+                'card_type': 'visa', 'card_number': '1234567890123456',
+                'exp_month': '1', 'exp_year': '2032', 'cvv': '123',
+                'idempotency_key': key}
+        first = client.post('/checkout', data=data, follow_redirects=True)
+        second = client.post('/checkout', data=data, follow_redirects=True)
+        order = Order.query.filter_by(user_id=user.id).one()
+        assert order.idempotency_key == key
+        for response in (first, second):
+            assert b'Order placed successfully.' in response.data
+            assert bytes(str(order.id), 'utf-8') in response.data
+        assert product.stock == 98
@@ -0,0 +1,137 @@
+from flask import template_rendered
+
+from app import create_app
+from app.config import TestingConfig
+from app.extensions import db
+from app.models import Product
+
+
+def rendered_templates(app):
+    templates = []
+    template_rendered.connect(
+        lambda sender, template, context, **extra: templates.append(template),
+        app, weak=False)
+    return templates
+
+
+def test_catalog_not_modified(session, client, test_app, product):
+    response = client.get('/catalog')
+    etag = response.headers['ETag']
+    assert response.status_code == 200
+    assert 'Last-Modified' not in response.headers
+
+    templates = rendered_templates(test_app)
+    response = client.get('/catalog', headers={'If-None-Match': etag})
+    assert response.status_code == 304
+    assert response.data == b''
+    assert response.headers['ETag'] == etag
+    assert templates == []
+
+    response = client.get('/search?query=test',
+                          headers={'If-None-Match': etag})
+    assert response.status_code == 304
+
+
+def test_product_change_changes_etags(session, client, product):
+    other = Product(name='other', description='other', price=1.0, stock=1)
+    session.add(other)
+    session.commit()
+    catalog_etag = client.get('/catalog').headers['ETag']
+    product_etag = client.get(f'/items_page/{product.id}').headers['ETag']
+    other_etag = client.get(f'/items_page/{other.id}').headers['ETag']
+
+    product.stock = 3
+    session.commit()
+    assert client.get('/catalog', headers={
+        'If-None-Match': catalog_etag}).status_code == 200
+    response = client.get(f'/items_page/{product.id}',
+                          headers={'If-None-Match': product_etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != product_etag
+    assert client.get(f'/items_page/{other.id}', headers={
+        'If-None-Match': other_etag}).status_code == 304
+
+
+def test_workers_send_the_same_etags(tmp_path):
+    """A revalidation that reaches another worker still gets a 304, and sees
+    changes committed through any of them."""
+    class WorkerConfig(TestingConfig):
+        SQLALCHEMY_DATABASE_URI = f'sqlite:///{tmp_path / "shop.db"}'
+
+    first, second = create_app(WorkerConfig), create_app(WorkerConfig)
+    with first.app_context():
+        db.create_all()
+        product = Product(name='test_product', description='test',
+                          price=9.99, stock=5)
+        db.session.add(product)
+        db.session.commit()
+        product_id = product.id
+    # The visitor's browser sends the same session cookie to both.
+    visitor, other_visitor = first.test_client(), second.test_client()
+    etag = visitor.get(f'/items_page/{product_id}').headers['ETag']
+    catalog_etag = visitor.get('/catalog').headers['ETag']
+    other_visitor.set_cookie('session', visitor.get_cookie('session').value)
+    assert other_visitor.get(f'/items_page/{product_id}', headers={
+        'If-None-Match': etag}).status_code == 304
+    assert other_visitor.get('/catalog', headers={
+        'If-None-Match': catalog_etag}).status_code == 304
+
+    with first.app_context():
+        db.session.get(Product, product_id).price = 1.0
+        db.session.commit()
+    assert other_visitor.get(f'/items_page/{product_id}', headers={
+        'If-None-Match': etag}).status_code == 200
+    assert other_visitor.get('/catalog', headers={
+        'If-None-Match': catalog_etag}).status_code == 200
+    with first.app_context():
+        db.engine.dispose()
+    with second.app_context():
+        db.engine.dispose()
+
+
+def test_catalog_etag_changes_when_products_are_deleted(session, client,
+                                                        products):
+    etag = client.get('/catalog').headers['ETag']
+    session.delete(products[0])
+    session.commit()
+    assert client.get('/catalog', headers={
+        'If-None-Match': etag}).status_code == 200
+
+
+def test_if_modified_since_is_ignored(session, client, user, product):
+    client.get(f'/items_page/{product.id}')
+    client.post('/login', data=dict(username='test_username',
+                                    password='correct_password'))
+    response = client.get(f'/items_page/{product.id}', headers={
+        'If-Modified-Since': 'Fri, 01 Jan 2100 00:00:00 GMT'})
+    assert response.status_code == 200
+    assert b'Logout' in response.data
+
+
+def test_etags_run_out(session, client, test_app, product, monkeypatch):
+    """Tags change every CONDITIONAL_MAX_AGE seconds, so the CSRF token in
+    a revalidated page is never older than that."""
+    now = 1_000_000 * test_app.config['CONDITIONAL_MAX_AGE']
+    monkeypatch.setattr('app.conditional.time.time', lambda: now)
+    etag = client.get('/catalog').headers['ETag']
+    now += test_app.config['CONDITIONAL_MAX_AGE'] - 1
+    assert client.get('/catalog', headers={
+        'If-None-Match': etag}).status_code == 304
+    now += 1
+    assert client.get('/catalog', headers={
+        'If-None-Match': etag}).status_code == 200
+
+
+def test_etag_depends_on_user(session, client, user, product):
+    etag = client.get('/catalog').headers['ETag']
+    client.post('/login', data=dict(username='test_username',
+                                    password='correct_password'))
+    response = client.get('/catalog', headers={'If-None-Match': etag})
+    assert response.status_code == 200
+    assert response.headers['ETag'] != etag
+
+
+def test_missing_product_has_no_etag(session, client):
+    response = client.get('/items_page/9999')
+    assert response.status_code == 404
+    assert 'ETag' not in response.headers
@@ -0,0 +1,60 @@
+from app.models import Product
+from app.pagination import paginate
+
+
+def add_products(session, count):
+    products = [Product(name=f'product_{i:03}', description='description',
+                        price=1.0, stock=1) for i in range(count)]
+    session.add_all(products)
+    session.commit()
+    return products
+
+
+def test_paginate_forwards_and_backwards(session):
+    products = add_products(session, 25)
+    ids = [p.id for p in products]
+
+    first = paginate(Product.query, Product.id, per_page=10)
+    assert [p.id for p in first.items] == ids[:10]
+    assert first.prev_cursor is None
+    assert first.next_cursor == ids[9]
+
+    second = paginate(Product.query, Product.id, after=first.next_cursor,
+                      per_page=10)
+    assert [p.id for p in second.items] == ids[10:20]
+    assert second.prev_cursor == ids[10]
+
+    last = paginate(Product.query, Product.id, after=second.next_cursor,
+                    per_page=10)
+    assert [p.id for p in last.items] == ids[20:]
+    assert last.next_cursor is None
+
+    back = paginate(Product.query, Product.id, before=second.prev_cursor,
+                    per_page=10)
+    assert back == first
+
+
+def test_catalog_pages(session, client, test_app):
+    """Test the catalog pages from the newest product down."""
+    test_app.config['PRODUCTS_PER_PAGE'] = 10
+    products = add_products(session, 15)
+    response = client.get('/catalog')
+    assert b'product_005' in response.data
+    assert b'product_004' not in response.data
+    assert f'after={products[5].id}'.encode() in response.data
+
+    response = client.get(f'/catalog?after={products[5].id}')
+    assert b'product_005' not in response.data
+    assert b'product_000' in response.data
+    assert f'before={products[4].id}'.encode() in response.data
+    assert b'Next' not in response.data
+
+
+def test_search_without_term_pages(session, client):
+    products = add_products(session, 5)
+    response = client.get(f'/search?per_page=2&after={products[3].id}')
+    assert b'product_003' not in response.data
+    assert b'product_002' in response.data
+    assert b'product_001' in response.data
+    assert b'product_000' not in response.data
+    assert b'per_page=2' in response.data
@@ -0,0 +1,83 @@
+from app.models import Cart
+
+
+def test_anonymous_cart(session, client, product):
+    response = client.post(f'/add_to_cart/{product.id}',
+                           data=dict(quantity=2), follow_redirects=True)
+    assert response.status_code == 200
+    assert b'test_product' in response.data
+    assert b'$11.98' in response.data
+    assert b'<span class="cart-badge">2</span>' in response.data
+    assert Cart.query.count() == 0
+
+    client.post(f'/update_cart_item/{product.id}', data=dict(quantity=5))
+    assert b'$29.95' in client.get('/cart').data
+
+    client.post(f'/remove_from_cart/{product.id}')
+    assert b'Your cart is currently empty.' in client.get('/cart').data
+
+
+def test_anonymous_cart_unknown_product(session, client):
+    response = client.post('/add_to_cart/9999', data=dict(quantity=1))
+    assert response.status_code == 404
+
+
+def test_anonymous_cart_rejects_quantities_below_one(session, client,
+                                                     product):
+    for quantity in (0, -5):
+        response = client.post(f'/add_to_cart/{product.id}',
+                               data=dict(quantity=quantity),
+                               follow_redirects=True)
+        assert b'Enter a quantity of 1 or more.' in response.data
+    assert b'Your cart is currently empty.' in client.get('/cart').data
+    response = client.post(f'/add_to_cart/{product.id}',
+                           data=dict(quantity='lots'))
+    assert response.status_code == 400
+
+
+def test_anonymous_cart_is_not_response_cached(session, client, product):
+    client.get('/catalog')
+    assert client.get('/catalog').headers['X-Cache'] == 'HIT'
+    client.post(f'/add_to_cart/{product.id}', data=dict(quantity=1))
+    response = client.get('/catalog')
+    assert 'X-Cache' not in response.headers
+    assert b'<span class="cart-badge">1</span>' in response.data
+
+
+def test_session_cart_is_merged_on_login(session, client, user, cart,
+                                         products, count_queries):
+    cart.add_product(products[0].id, 2)
+    session.commit()
+    client.post(f'/add_to_cart/{products[0].id}', data=dict(quantity=3))
+    client.post(f'/add_to_cart/{products[1].id}', data=dict(quantity=1))
+
+    with count_queries() as statements:
+        client.post('/login', data=dict(username='test_username',
+                                        password='correct_password'))
+    assert len([s for s in statements if 'INSERT INTO cart_item' in s]) == 1
+
+    session.expire_all()
+    assert {item.product_id: item.quantity for item in cart.items} == {
+        products[0].id: 5, products[1].id: 1}
+    assert cart.item_count == 6
+    with client.session_transaction() as client_session:
+        assert 'cart' not in client_session
+
+
+def test_session_cart_creates_cart_on_login(session, client, user, product):
+    client.post(f'/add_to_cart/{product.id}', data=dict(quantity=2))
+    client.post('/login', data=dict(username='test_username',
+                                    password='correct_password'))
+    response = client.get('/cart')
+    assert response.status_code == 200
+    assert b'$11.98' in response.data
+
+
+def test_quantities_below_one_are_not_merged(session, client, user, product):
+    # A session cart saved before quantities were checked.
+    with client.session_transaction() as visitor:
+        visitor['cart'] = {str(product.id): -5}
+    client.post('/login', data=dict(username='test_username',
+                                    password='correct_password'))
+    cart = Cart.get_for_user(user.id)
+    assert cart is None or cart.items == []
@@ -0,0 +1,60 @@
+from app.models import Product
+from app.search import InvertedIndex, TrigramIndex, trigrams
+
+
+def test_trigrams():
+    assert trigrams('tv') == {'  t', ' tv', 'tv '}
+
+
+def test_similar_words():
+    index = TrigramIndex()
+    for word in ['headphones', 'phone', 'bluetooth', 'speaker']:
+        index.add(word)
+    assert [w for _, w in index.similar('hedphones', 0.3)] == ['headphones']
+    assert [w for _, w in index.similar('blutooth', 0.3)] == ['bluetooth']
+    assert index.similar('xyz', 0.3) == []
+    index.remove('bluetooth')
+    assert index.similar('blutooth', 0.3) == []
+
+
+def test_vocabulary_follows_documents():
+    index = InvertedIndex(weights=(3.0, 1.0))
+    index.add(1, 'Bluetooth Headphones', 'Over-Ear Bluetooth Headphones')
+    assert 'headphones' in index.trigrams.words
+    index.add(1, 'Speaker', 'Portable Speaker')
+    assert 'headphones' not in index.trigrams.words
+    assert 'speaker' in index.trigrams.words
+
+
+def test_fuzzy_top_k():
+    index = InvertedIndex(weights=(3.0, 1.0))
+    index.add(1, 'Bluetooth Headphones', 'Over-Ear Bluetooth Headphones')
+    index.add(2, 'Noise-Canceling Headphones',
+              'Bluetooth Noise-Canceling Headphones')
+    index.add(3, 'Bluetooth Speaker', 'Portable Wireless Bluetooth Speaker')
+    assert index.top_k('blutooth hedphones', 10) == ([], 0)
+    ids, total = index.fuzzy_top_k('blutooth hedphones', 10, 0.3)
+    assert total == 2
+    assert ids == [1, 2]
+    assert index.fuzzy_top_k('blutooth', 10, 0.3)[1] == 3
+    assert index.fuzzy_top_k('qwzx', 10, 0.3) == ([], 0)
+
+
+def test_search_route_falls_back_to_fuzzy(session, client):
+    session.add_all([
+        Product(name='Bluetooth Headphones',
+                description='Over-Ear Bluetooth Headphones',
+                price=49.5, stock=100),
+        Product(name='Smart TV', description='55" 4K Ultra HD LED TV',
+                price=599.99, stock=50),
+    ])
+    session.commit()
+    response = client.get('/search?query=hedphones')
+    assert response.status_code == 200
+    assert b'Bluetooth Headphones' in response.data
+    assert b'Smart TV' not in response.data
+    assert b'similar words' in response.data
+
+    response = client.get('/search?query=headphones')
+    assert b'Bluetooth Headphones' in response.data
+    assert b'similar words' not in response.data
@@ -0,0 +1,123 @@
+import threading
+import time
+
+import sqlalchemy as sa
+from sqlalchemy import or_
+
+from app.models import Product
+from app.search import InvertedIndex, search_index, tokenize
+from app.utils import BackgroundRebuild
+
+
+def test_tokenize():
+    assert tokenize('Wi-Fi Smart Plug') == ['wi', 'fi', 'smart', 'plug']
+    assert tokenize('test_product_1') == ['test', 'product', '1']
+
+
+def test_multi_term_and_query():
+    index = InvertedIndex(weights=(1.0, 1.0))
+    index.add(1, 'Bluetooth Speaker', 'Portable Wireless Bluetooth Speaker')
+    index.add(2, 'Wireless Mouse', 'Ergonomic Wireless Mouse')
+    index.add(3, 'Smart TV', '55" 4K Ultra HD LED TV')
+    assert index.search('wireless') == {1, 2}
+    assert index.search('WIRELESS speaker') == {1}
+    assert index.search('wireless tv') == set()
+    assert index.search('  ') == set()
+    index.remove(1)
+    assert index.search('wireless') == {2}
+    assert 'speaker' not in index.postings
+
+
+def test_search_matches_substring_search_for_whole_words(session):
+    session.add_all([
+        Product(name='Smart TV', description='55" 4K Ultra HD LED TV',
+                price=599.99, stock=50),
+        Product(name='Wireless Earbuds',
+                description='True Wireless Bluetooth Earbuds',
+                price=59.25, stock=150),
+        Product(name='Bluetooth Car Kit',
+                description='Bluetooth Car Adapter with Hands-Free Calling',
+                price=24.75, stock=150),
+    ])
+    session.commit()
+    for word in ['tv', 'Bluetooth', 'wireless', 'car', 'hands']:
+        expected = Product.query.filter(or_(
+            Product.name.ilike(f'%{word}%'),
+            Product.description.ilike(f'%{word}%'))).order_by(Product.id)
+        assert Product.search(word) == expected.all()
+
+
+def test_index_updates_on_insert_update_and_delete(session, product):
+    assert Product.search('test_product') == [product]
+
+    new_product = Product(name='Robot Vacuum', description='Mapping vacuum',
+                          price=199.5, stock=60)
+    session.add(new_product)
+    session.commit()
+    assert Product.search('vacuum') == [new_product]
+
+    new_product.name = 'Robot Mop'
+    new_product.description = 'Mapping mop'
+    session.commit()
+    assert Product.search('vacuum') == []
+    assert Product.search('robot mop') == [new_product]
+
+    session.delete(new_product)
+    session.commit()
+    assert Product.search('robot') == []
+
+
+def test_rolled_back_changes_are_not_indexed(session, product):
+    assert Product.search('test_product') == [product]
+    session.add(Product(name='Phantom', description='Never committed',
+                        price=1.0, stock=1))
+    session.flush()
+    session.rollback()
+    assert Product.search('phantom') == []
+
+
+def test_index_is_rebuilt_in_background_when_old(session, product, monkeypatch):
+    assert Product.search('test_product') == [product]
+    # A Core update isn't reported, like a commit made by another process.
+    session.execute(sa.update(Product).where(Product.id == product.id)
+                    .values(name='Robot Vacuum'))
+    session.commit()
+    assert Product.search('vacuum') == []
+    rebuild = search_index().rebuild
+    later = time.monotonic() + rebuild.max_age + 1
+    monkeypatch.setattr(time, 'monotonic', lambda: later)
+    # The old index answers while the new one is built in the background.
+    assert Product.search('vacuum') == []
+    rebuild.join()
+    assert Product.search('vacuum') == [product]
+
+
+def test_changes_made_during_a_rebuild_are_kept(test_app, monkeypatch):
+    lock = threading.RLock()
+    building = threading.Event()
+    release = threading.Event()
+    builds = [{'a'}]
+
+    def build():
+        if len(builds) > 1:
+            building.set()
+            release.wait()
+        return set(builds[-1])
+
+    rebuild = BackgroundRebuild(build, set.add, lock, max_age=60)
+    with lock:
+        assert rebuild.get() == {'a'}
+    builds.append({'a', 'b'})
+    later = time.monotonic() + 61
+    monkeypatch.setattr(time, 'monotonic', lambda: later)
+    with lock:
+        assert rebuild.get() == {'a'}
+    building.wait()
+    with lock:
+        # Committed after the new one was read from the database.
+        rebuild.update('c')
+        assert rebuild.get() == {'a', 'c'}
+    release.set()
+    rebuild.join()
+    with lock:
+        assert rebuild.get() == {'a', 'b', 'c'}
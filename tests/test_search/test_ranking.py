@@ -0,0 +1,57 @@
+from app.models import Product
+from app.search import InvertedIndex
+
+
+def test_name_matches_rank_above_description_matches():
+    index = InvertedIndex(weights=(3.0, 1.0))
+    index.add(1, 'Bluetooth Speaker', 'Portable Wireless Bluetooth Speaker')
+    index.add(2, 'Wireless Earbuds', 'True Wireless Bluetooth Earbuds')
+    index.add(3, 'Wireless Mouse', 'Ergonomic Mouse with Silent Click')
+    ids, total = index.top_k('wireless', k=10)
+    assert total == 3
+    assert ids[-1] == 1
+    assert set(ids[:2]) == {2, 3}
+
+
+def test_rare_terms_outweigh_common_terms():
+    index = InvertedIndex(weights=(3.0, 1.0))
+    index.add(1, 'Wireless Mouse', 'Wireless')
+    index.add(2, 'Wireless Keyboard', 'Wireless')
+    index.add(3, 'Wireless Charger', 'Wireless')
+    assert index.score(3, {'charger'}) > index.score(3, {'wireless'})
+
+
+def test_top_k_is_bounded_and_breaks_ties_by_id():
+    index = InvertedIndex(weights=(3.0, 1.0))
+    for doc_id in range(100, 0, -1):
+        index.add(doc_id, 'Wireless Widget', 'A widget')
+    ids, total = index.top_k('wireless widget', k=5)
+    assert total == 100
+    assert ids == [1, 2, 3, 4, 5]
+    assert index.top_k('nothing', k=5) == ([], 0)
+
+
+def test_product_search_limit(session):
+    session.add_all([Product(name=f'Wireless Thing {i}',
+                             description='Wireless', price=1.0, stock=1)
+                     for i in range(10)])
+    session.add(Product(name='Speaker', description='Wireless speaker',
+                        price=1.0, stock=1))
+    session.commit()
+    results = Product.search('wireless', limit=3)
+    assert [p.name for p in results] == ['Wireless Thing 0',
+                                         'Wireless Thing 1',
+                                         'Wireless Thing 2']
+    assert len(Product.search('wireless')) == 11
+
+
+def test_search_route_renders_top_results(session, client, test_app):
+    test_app.config['SEARCH_RESULTS_LIMIT'] = 2
+    session.add_all([Product(name=f'Gadget {i}', description='Wireless',
+                             price=1.0, stock=1) for i in range(5)])
+    session.commit()
+    response = client.get('/search?query=gadget')
+    assert response.status_code == 200
+    assert b'Gadget 0' in response.data
+    assert b'Gadget 1' in response.data
+    assert b'Gadget 2' not in response.data
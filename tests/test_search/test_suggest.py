@@ -0,0 +1,128 @@
+import random
+import time
+
+import sqlalchemy as sa
+
+from app.models import Order, OrderItem, Product
+from app.suggest import PrefixIndex, completion_keys, suggestions
+
+
+def test_completion_keys():
+    assert completion_keys('Wi-Fi  Router') == {'wi-fi router', 'fi router',
+                                                'router'}
+
+
+def test_suggestions_ranked_by_sales():
+    index = PrefixIndex(limit=2)
+    index.add(1, 'Bluetooth Speaker', sales=20)
+    index.add(2, 'Bluetooth Headphones', sales=50)
+    index.add(3, 'Bluetooth Car Kit', sales=5)
+    assert index.suggest('Blue') == [(2, 'Bluetooth Headphones'),
+                                     (1, 'Bluetooth Speaker')]
+    assert index.suggest('b', n=1) == [(2, 'Bluetooth Headphones')]
+    assert index.suggest('car') == [(3, 'Bluetooth Car Kit')]
+    assert index.suggest('x') == []
+    assert index.suggest('') == []
+    assert index.suggest('blue', n=-1) == []
+
+    index.add_sales(3, 100)
+    assert index.suggest('blue') == [(3, 'Bluetooth Car Kit'),
+                                     (2, 'Bluetooth Headphones')]
+
+
+def test_remove_and_rename():
+    index = PrefixIndex(limit=2)
+    index.add(1, 'Smart Smartwatch', sales=10)
+    index.add(2, 'Smart TV', sales=5)
+    index.add(3, 'Smart Plug', sales=1)
+    assert index.suggest('smart') == [(1, 'Smart Smartwatch'),
+                                      (2, 'Smart TV')]
+    index.remove(1)
+    assert index.suggest('smart') == [(2, 'Smart TV'), (3, 'Smart Plug')]
+    assert index.suggest('smartw') == []
+    index.add(2, 'Television')
+    assert index.suggest('smart') == [(3, 'Smart Plug')]
+    assert index.suggest('tele') == [(2, 'Television')]
+    assert len(index) == 2
+
+
+def test_suggest_route(session, client, user):
+    headphones = Product(name='Bluetooth Headphones', description='Over-Ear',
+                         price=49.5, stock=100)
+    speaker = Product(name='Bluetooth Speaker', description='Portable',
+                      price=39.95, stock=100)
+    session.add_all([headphones, speaker])
+    session.commit()
+    response = client.get('/search/suggest?q=blu')
+    assert [s['name'] for s in response.json['suggestions']] == [
+        'Bluetooth Headphones', 'Bluetooth Speaker']
+
+    # Selling speakers moves them to the top.
+    order = Order(user_id=user.id, order_date=sa.func.now())
+    order.items.append(OrderItem(product_id=speaker.id, quantity=3,
+                                 price=speaker.price))
+    session.add(order)
+    session.commit()
+    response = client.get('/search/suggest?q=blu&limit=1')
+    assert response.json['suggestions'] == [
+        {'id': speaker.id, 'name': 'Bluetooth Speaker',
+         'url': f'/items_page/{speaker.id}'}]
+
+    # Limits are kept between 1 and SUGGEST_LIMIT.
+    for limit, count in (('-2', 1), ('0', 1), ('100', 2)):
+        response = client.get(f'/search/suggest?q=blu&limit={limit}')
+        assert len(response.json['suggestions']) == count
+
+
+def test_suggest_route_does_not_query_database(session, client, product,
+                                               count_queries):
+    client.get('/search/suggest?q=test')
+    with count_queries() as statements:
+        response = client.get('/search/suggest?q=test_p')
+    assert response.json['suggestions'][0]['name'] == 'test_product'
+    assert statements == []
+
+
+def test_index_is_rebuilt_in_background_when_old(session, product, monkeypatch):
+    assert suggestions().suggest('test') == [(product.id, 'test_product')]
+    # A Core update isn't reported, like a commit made by another process.
+    session.execute(sa.update(Product).where(Product.id == product.id)
+                    .values(name='Robot Vacuum'))
+    session.commit()
+    assert suggestions().suggest('robot') == []
+    rebuild = suggestions().rebuild
+    later = time.monotonic() + rebuild.max_age + 1
+    monkeypatch.setattr(time, 'monotonic', lambda: later)
+    # The old index answers while the new one is built in the background.
+    assert suggestions().suggest('robot') == []
+    rebuild.join()
+    assert suggestions().suggest('robot') == [(product.id, 'Robot Vacuum')]
+
+
+def test_matches_brute_force():
+    rng = random.Random(340)
+    words = ['smart', 'smartwatch', 'sm', 'tv', 'plug', 'tvs', 'smarter']
+    index = PrefixIndex(limit=3)
+    names, sales = {}, {}
+    for _ in range(500):
+        product_id = rng.randint(1, 20)
+        action = rng.random()
+        if action < 0.5:
+            names[product_id] = ' '.join(rng.choices(words, k=3))
+            sales.setdefault(product_id, 0)
+            index.add(product_id, names[product_id])
+        elif action < 0.8 and product_id in names:
+            quantity = rng.randint(1, 5)
+            sales[product_id] += quantity
+            index.add_sales(product_id, quantity)
+        else:
+            names.pop(product_id, None)
+            sales.pop(product_id, None)
+            index.remove(product_id)
+        for prefix in ['s', 'smart', 'smart s', 'tv', 'p', 'smartw']:
+            expected = sorted(
+                (p for p, name in names.items()
+                 if any(key.startswith(prefix)
+                        for key in completion_keys(name))),
+                key=lambda p: (-sales[p], names[p], p))[:3]
+            assert [p for p, _ in index.suggest(prefix)] == expected